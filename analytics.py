@@ -0,0 +1,284 @@
+"""
+Moderation events in columnar day partitions: incremental export from the event spool (events.py) and
+the trade table of user.db, and aggregate queries for dashboards that should not touch the bot's files
+"""
+
+import array
+import glob
+import json
+import math
+import os
+import sqlite3
+import time
+from collections import defaultdict
+
+try:
+    import numpy
+except ImportError:
+    # Queries fall back to the array module, numpy only makes them faster
+    numpy = None
+
+# Column files of a partition as (name, array typecode), string columns are dictionary encoded per
+# partition with code 0 for no value. Files hold the values back to back in native byte order.
+COLUMNS = (("time", "d"), ("kind", "B"), ("subreddit", "H"), ("author", "I"), ("reason", "H"), ("latency", "f"))
+STRING_COLUMNS = ("kind", "subreddit", "author", "reason")
+NUMPY_TYPES = {"d": "f8", "B": "u1", "H": "u2", "I": "u4", "f": "f4"}
+GROUPS = ("day", "kind", "subreddit", "author", "reason")
+
+
+def _day(timestamp):
+    return time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+
+def _read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as json_file:
+        return json.load(json_file)
+
+
+def _write_json(path, data):
+    with open(path + ".tmp", "w", encoding="utf-8") as json_file:
+        json.dump(data, json_file)
+    os.replace(path + ".tmp", path)
+
+
+class DayPartition:
+    """
+    Column files and meta.json (row count, string dictionaries, last export batch) of one day.
+    Columns are appended before meta.json is replaced, rows past the row count of meta.json are
+    left over from an interrupted append and cut off by the next one.
+    """
+
+    def __init__(self, directory):
+        self.path = directory
+        self.day = os.path.basename(directory)
+        self.meta = _read_json(os.path.join(directory, "meta.json"),
+                               {"rows": 0, "batch": 0, "dictionaries": {name: [] for name in STRING_COLUMNS}})
+        self._codes = {name: {value: code for code, value in enumerate(values, 1)}
+                       for name, values in self.meta["dictionaries"].items()}
+
+    @property
+    def rows(self):
+        return self.meta["rows"]
+
+    def _encode(self, name, value):
+        if name not in self._codes:
+            return float("nan") if value is None else value
+        if value is None:
+            return 0
+        codes = self._codes[name]
+        if value not in codes:
+            self.meta["dictionaries"][name].append(value)
+            codes[value] = len(codes) + 1
+        return codes[value]
+
+    def code(self, name, value):
+        """ Code of value in the string column name, None if the partition has no such value """
+        return self._codes[name].get(value)
+
+    def decode(self, name, code):
+        return self.meta["dictionaries"][name][code - 1] if code else None
+
+    def append(self, rows, batch):
+        """ Append rows (dicts with the COLUMNS names) as part of export batch """
+        os.makedirs(self.path, exist_ok=True)
+        for name, typecode in COLUMNS:
+            values = array.array(typecode, (self._encode(name, row.get(name)) for row in rows))
+            with open(os.path.join(self.path, name + ".bin"), "ab") as column_file:
+                column_file.truncate(self.meta["rows"] * values.itemsize)
+                values.tofile(column_file)
+        self.meta["rows"] += len(rows)
+        self.meta["batch"] = batch
+        _write_json(os.path.join(self.path, "meta.json"), self.meta)
+
+    def read(self, name):
+        """ Values of column name, a numpy array if numpy is installed """
+        typecode = dict(COLUMNS)[name]
+        path = os.path.join(self.path, name + ".bin")
+        if numpy is not None:
+            return numpy.fromfile(path, dtype=NUMPY_TYPES[typecode], count=self.rows) if self.rows else \
+                numpy.zeros(0, dtype=NUMPY_TYPES[typecode])
+        values = array.array(typecode)
+        if self.rows:
+            with open(path, "rb") as column_file:
+                values.fromfile(column_file, self.rows)
+        return values
+
+
+def partitions(export_dir, since=None, until=None):
+    """ DayPartitions of the days from since to until (unix timestamps, inclusive days), oldest first """
+    first = _day(since) if since is not None else ""
+    last = _day(until) if until is not None else "9999"
+    for path in sorted(glob.glob(os.path.join(export_dir, "????-??-??"))):
+        if first <= os.path.basename(path) <= last:
+            yield DayPartition(path)
+
+
+class Exporter:
+    """
+    Exports the events added since the last run in numbered batches. The source positions a batch
+    covers are saved before it is applied, an interrupted batch is redone over the same positions,
+    skipping the partitions it already reached, so every event is exported once.
+    """
+
+    def __init__(self, export_dir):
+        self._dir = export_dir
+        self._checkpoint_path = os.path.join(export_dir, "checkpoint.json")
+        self._pending_path = os.path.join(export_dir, "checkpoint.pending.json")
+
+    @staticmethod
+    def _spool_lines(path, start, end=None):
+        """ Complete lines of a spool file from byte start (to end), and the position after them """
+        with open(path, "rb") as spool_file:
+            spool_file.seek(start)
+            data = spool_file.read() if end is None else spool_file.read(end - start)
+        complete = data[:data.rfind(b"\n") + 1]
+        return complete.decode("utf-8").splitlines(), start + len(complete)
+
+    @staticmethod
+    def _trade_rows(subreddit, db_path, after, until=None):
+        """ Trades of a user.db with rowids after (up to until) as event rows, and the last rowid """
+        con = sqlite3.connect("file:{}?mode=ro".format(db_path), uri=True)
+        try:
+            sql = "SELECT rowid, created_utc, user_a FROM trade WHERE rowid > ?"
+            params = [after]
+            if until is not None:
+                sql += " AND rowid <= ?"
+                params.append(until)
+            rows = con.execute(sql + " ORDER BY rowid", params).fetchall()
+        except sqlite3.OperationalError:
+            # Not migrated to the trade graph yet
+            return [], after
+        finally:
+            con.close()
+        return ([{"time": created_utc, "kind": "trade", "subreddit": subreddit, "author": user}
+                 for _rowid, created_utc, user in rows], rows[-1][0] if rows else after)
+
+    def export(self, spool_dir=None, trade_dbs=(), keep_spool_days=7):
+        """
+        Append new events of the spool files in spool_dir and new trades of trade_dbs, a list of
+        (subreddit, user.db path). Returns the number of exported rows.
+        """
+        os.makedirs(self._dir, exist_ok=True)
+        checkpoint = _read_json(self._checkpoint_path, {"batch": 0, "spool": {}, "trades": {}})
+        pending = _read_json(self._pending_path)
+        rows_by_day = defaultdict(list)
+
+        spool_files = sorted(glob.glob(os.path.join(spool_dir, "*.jsonl"))) if spool_dir else []
+        ends = {"spool": dict(checkpoint["spool"]), "trades": dict(checkpoint["trades"])}
+        for path in spool_files:
+            name = os.path.basename(path)
+            end = pending["spool"].get(name, checkpoint["spool"].get(name, 0)) if pending else None
+            lines, ends["spool"][name] = self._spool_lines(path, checkpoint["spool"].get(name, 0), end)
+            for line in lines:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                rows_by_day[_day(event["time"])].append(event)
+        for subreddit, db_path in trade_dbs:
+            until = pending["trades"].get(db_path, checkpoint["trades"].get(db_path, 0)) if pending else None
+            rows, ends["trades"][db_path] = self._trade_rows(subreddit, db_path, checkpoint["trades"].get(db_path, 0),
+                                                             until)
+            for row in rows:
+                rows_by_day[_day(row["time"])].append(row)
+
+        if pending is None:
+            pending = dict(ends, batch=checkpoint["batch"] + 1)
+            _write_json(self._pending_path, pending)
+        for day, rows in sorted(rows_by_day.items()):
+            partition = DayPartition(os.path.join(self._dir, day))
+            if partition.meta["batch"] < pending["batch"]:
+                partition.append(rows, pending["batch"])
+        _write_json(self._checkpoint_path, pending)
+        os.remove(self._pending_path)
+
+        if keep_spool_days is not None:
+            self._prune_spool(spool_files, pending["spool"], time.time() - keep_spool_days * 86400)
+        return sum(len(rows) for rows in rows_by_day.values())
+
+    def _prune_spool(self, spool_files, positions, before_utc):
+        """ Remove exported spool files of days before before_utc """
+        checkpoint = _read_json(self._checkpoint_path)
+        for path in spool_files:
+            name = os.path.basename(path)
+            if name[:-len(".jsonl")] < _day(before_utc) and positions.get(name) == os.path.getsize(path):
+                os.remove(path)
+                del checkpoint["spool"][name]
+        _write_json(self._checkpoint_path, checkpoint)
+
+
+def _percentile(sorted_values, fraction):
+    if not len(sorted_values):  # pylint: disable=len-as-condition
+        return None
+    return round(float(sorted_values[int(fraction * (len(sorted_values) - 1))]), 3)
+
+
+def _select(partition, since, until, filters):
+    """ Row numbers of partition matching the time range and {column: value} filters, None if none can """
+    codes = {}
+    for name, value in filters.items():
+        codes[name] = partition.code(name, value)
+        if codes[name] is None:
+            return None
+    times = partition.read("time")
+    if numpy is not None:
+        mask = numpy.ones(partition.rows, dtype=bool)
+        if since is not None:
+            mask &= times >= since
+        if until is not None:
+            mask &= times < until
+        for name, code in codes.items():
+            mask &= partition.read(name) == code
+        return numpy.flatnonzero(mask)
+    columns = {name: partition.read(name) for name in codes}
+    return [row for row in range(partition.rows)
+            if (since is None or times[row] >= since) and (until is None or times[row] < until) and
+            all(columns[name][row] == code for name, code in codes.items())]
+
+
+def query(export_dir, since=None, until=None, by=None, **filters):
+    """
+    Event counts and latency percentiles (seconds) from since to until (unix timestamps), filtered by
+    column values (e.g. kind="remove", subreddit="hardwareswap") and grouped by one of GROUPS.
+    Returns [{"key", "count", "latency_p50", "latency_p95"}], days in order, other groups most frequent first.
+    """
+    if by is not None and by not in GROUPS:
+        raise ValueError("Unknown group {}, use one of {}".format(by, ", ".join(GROUPS)))
+    counts = defaultdict(int)
+    latencies = defaultdict(list)
+    for partition in partitions(export_dir, since, until):
+        rows = _select(partition, since, until, filters)
+        if rows is None or not len(rows):  # pylint: disable=len-as-condition
+            continue
+        latency = partition.read("latency")
+        if by is None or by == "day":
+            keys = {partition.day if by else None: rows}
+        elif numpy is not None:
+            codes = partition.read(by)[rows]
+            keys = {partition.decode(by, code): rows[codes == code] for code in numpy.unique(codes)}
+        else:
+            column = partition.read(by)
+            keys = defaultdict(list)
+            for row in rows:
+                keys[partition.decode(by, column[row])].append(row)
+        for key, key_rows in keys.items():
+            counts[key] += len(key_rows)
+            if numpy is not None:
+                values = latency[key_rows]
+                latencies[key].append(values[~numpy.isnan(values)])
+            else:
+                latencies[key].append([latency[row] for row in key_rows if not math.isnan(latency[row])])
+
+    result = []
+    for key, count in counts.items():
+        if numpy is not None:
+            values = numpy.sort(numpy.concatenate(latencies[key]))
+        else:
+            values = sorted(value for chunk in latencies[key] for value in chunk)
+        result.append({"key": key, "count": count, "latency_p50": _percentile(values, 0.5),
+                       "latency_p95": _percentile(values, 0.95)})
+    if by == "day":
+        return sorted(result, key=lambda entry: entry["key"])
+    return sorted(result, key=lambda entry: (-entry["count"], str(entry["key"])))
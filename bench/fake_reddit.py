@@ -0,0 +1,791 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the parts of the Reddit API the bot uses, for load tests without touching Reddit.
+post_check.py, flair.py and heatware.py run unmodified against it through a praw.ini site (see --praw-ini).
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import statistics
+from configparser import SafeConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# Site name written to praw.ini, select it with praw_site=fakereddit
+PRAW_SITE = "fakereddit"
+# Reddit's limits: top-level comments in a thread response, things per morechildren response
+COMMENT_PAGE = 200
+MORECHILDREN_PAGE = 100
+# Kinds of generated items whose handling by the bot is tracked
+TRACKED_KINDS = ("post", "trade", "heatware", "message")
+
+
+def to_base36(number):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while number:
+        number, rest = divmod(number, 36)
+        out = digits[rest] + out
+    return out or "0"
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {"p50": round(statistics.median(ordered), 3),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            "max": round(ordered[-1], 3)}
+
+
+class RateLimitWindow:
+    """ Reddit's OAuth rate limit: a number of requests per access token and fixed window """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._used = {}
+
+    def take(self, token, now):
+        """ Headers for this request and whether it is within the limit """
+        window_start = now - now % self.window
+        start, used = self._used.get(token, (window_start, 0))
+        if start != window_start:
+            used = 0
+        used += 1
+        self._used[token] = (window_start, used)
+        headers = {"x-ratelimit-used": str(used),
+                   "x-ratelimit-remaining": "{:.1f}".format(max(self.limit - used, 0)),
+                   "x-ratelimit-reset": str(int(window_start + self.window - now))}
+        return headers, used <= self.limit
+
+
+class FakeReddit:
+    """
+    In-memory subreddits, submissions, comments, user flair, wiki pages, widgets and the bot's inbox.
+    Items created by the traffic generator are tracked until the bot acts on them (reply, removal,
+    report, approval, flair or marking a message read), which gives throughput, backlog and latency.
+    """
+
+    def __init__(self, subreddits, bot, mods=(), suspended_share=0.0):
+        self.lock = threading.Lock()
+        self.bot = bot
+        self.suspended_share = suspended_share
+        self.mods = [bot] + [mod for mod in mods if mod.lower() != bot.lower()]
+        # Submission ids have 6 characters, comment (and other) ids 7, like on reddit today
+        self._next_ids = {"t3": 36 ** 5, "t1": 36 ** 6}
+        self.things = {}
+        self.users = {}
+        self.subreddits = {}
+        self.posts = []
+        self.inbox = []
+        self.started = time.time()
+        self.requests = {}
+        self.unknown_routes = {}
+        self.rate_limited = 0
+        self.injected_errors = 0
+        # Stub image host for the timestamp links of generated posts
+        self.timestamps = set()
+        self.timestamp_requests = 0
+        self._tracked = {}
+        self._pending_by_author = {}
+        self.threads = {}
+        for name in subreddits:
+            self.add_subreddit(name)
+
+    def new_id(self, kind="t1"):
+        self._next_ids[kind] += 1
+        return to_base36(self._next_ids[kind])
+
+    # Users
+
+    def user(self, name):
+        """ About data of a user, created on first use with a random age and karma """
+        key = name.lower()
+        if key not in self.users:
+            rand = random.Random(key)
+            self.users[key] = {"name": name, "id": self.new_id(),
+                               "created_utc": float(int(time.time() - rand.uniform(1, 3000) * 86400)),
+                               "link_karma": int(rand.expovariate(1 / 500)),
+                               "comment_karma": int(rand.expovariate(1 / 2000)),
+                               "is_suspended": (rand.random() < self.suspended_share and
+                                                key not in {mod.lower() for mod in self.mods})}
+        return self.users[key]
+
+    def user_json(self, name):
+        user = self.user(name)
+        if user["is_suspended"]:
+            return {"kind": "t2", "data": {"name": user["name"], "is_suspended": True}}
+        data = dict(user, created=user["created_utc"], has_verified_email=True, is_mod=False,
+                    is_gold=False, icon_img="")
+        return {"kind": "t2", "data": data}
+
+    # Subreddits
+
+    def add_subreddit(self, name):
+        sub = {"name": name, "id": self.new_id(), "flair": {}, "modlog": [],
+               "wiki": {}, "widgets": {}}
+        self.subreddits[name.lower()] = sub
+        trade = self.create_post(name, self.bot, "Confirmed Trade Thread", "Post your confirmed trades below.",
+                                 tracked=False)
+        heatware = self.create_post(name, self.bot, "Heatware Thread", "Post your heatware link below.",
+                                    tracked=False)
+        price = self.create_post(name, self.bot, "Price Check Thread", "Price checks below.", tracked=False)
+        self.threads[name.lower()] = {"trade": trade["id"], "heatware": heatware["id"], "price": price["id"]}
+        sidebar = "[Confirm your Trades](/{})\n\n[Price check thread](/{})".format(trade["id"], price["id"])
+        sub["wiki"]["config/sidebar"] = {"content_md": sidebar,
+                                         "revision_date": time.time(), "revision_by": self.bot}
+        widget_id = "widget_" + self.new_id()
+        sub["widgets"][widget_id] = {"kind": "button", "shortName": "Links", "id": widget_id, "description": "",
+                                     "styles": {"backgroundColor": "", "headerColor": ""},
+                                     "buttons": [{"kind": "text", "text": text, "url": "https://redd.it/" + post_id,
+                                                  "color": "#000000", "textColor": "#FFFFFF",
+                                                  "fillColor": "#FFFFFF"}
+                                                 for text, post_id in (("Confirm your Trades", trade["id"]),
+                                                                       ("Price check thread", price["id"]))]}
+        return sub
+
+    def subreddit(self, name):
+        sub = self.subreddits.get(name.lower())
+        if sub is None:
+            raise NotFoundError("subreddit " + name)
+        return sub
+
+    def flair_of(self, subreddit, author):
+        if author is None:
+            return ("", "")
+        return self.subreddit(subreddit)["flair"].get(author.lower(), (None, None, None))[1:]
+
+    def set_user_flair(self, subreddit, name, text, css_class):
+        sub = self.subreddit(subreddit)
+        if text or css_class:
+            sub["flair"][name.lower()] = (self.user(name)["name"], text or "", css_class or "")
+        else:
+            sub["flair"].pop(name.lower(), None)
+        self.log_action(sub, "editflair", target_author=self.user(name)["name"])
+        self.user_action(name)
+
+    def log_action(self, sub, action, target_author=None, target_fullname=None):
+        sub["modlog"].append({"id": "ModAction_" + self.new_id(), "action": action, "mod": self.bot,
+                              "mod_id36": self.user(self.bot)["id"], "created_utc": time.time(),
+                              "subreddit": sub["name"], "target_author": target_author or "",
+                              "target_fullname": target_fullname, "details": "", "description": None})
+
+    # Submissions, comments and messages
+
+    def create_post(self, subreddit, author, title, selftext, tracked=True):
+        sub = self.subreddit(subreddit)
+        post_id = self.new_id("t3")
+        now = time.time()
+        post = {"id": post_id, "name": "t3_" + post_id, "title": title, "selftext": selftext,
+                "author": author, "created_utc": now, "subreddit": sub["name"],
+                "subreddit_id": "t5_" + sub["id"], "permalink": "/r/{}/comments/{}/_/".format(sub["name"], post_id),
+                "url": "https://www.reddit.com/r/{}/comments/{}/".format(sub["name"], post_id),
+                "is_self": True, "domain": "self." + sub["name"], "link_flair_text": None,
+                "link_flair_css_class": None, "removed": False, "banned_by": None, "approved_by": None,
+                "distinguished": None, "stickied": False, "locked": False, "score": 1, "over_18": False,
+                "spoiler": False, "suggested_sort": None, "mod_reports": [], "user_reports": [],
+                "_children": [], "_track": None}
+        self.things[post["name"]] = post
+        self.posts.append(post["name"])
+        if author is not None:
+            self.user(author)
+        if tracked:
+            self.track(post, "post")
+        return post
+
+    def create_comment(self, parent_fullname, author, body, track=None):
+        """ Comment replying to parent, track is None, "trade"/"heatware" (tracked) or a tracked fullname """
+        parent = self.things.get(parent_fullname)
+        if parent is None:
+            raise NotFoundError(parent_fullname)
+        comment_id = self.new_id()
+        link_id = parent["name"] if parent["name"].startswith("t3_") else parent["link_id"]
+        post = self.things[link_id]
+        comment = {"id": comment_id, "name": "t1_" + comment_id, "link_id": link_id, "parent_id": parent["name"],
+                   "author": author, "body": body, "created_utc": time.time(), "subreddit": post["subreddit"],
+                   "subreddit_id": post["subreddit_id"],
+                   "permalink": "/r/{}/comments/{}/_/{}/".format(post["subreddit"], post["id"], comment_id),
+                   "removed": False, "banned_by": None, "approved_by": None, "distinguished": None,
+                   "stickied": False, "score": 1, "mod_reports": [], "user_reports": [], "edited": False,
+                   "is_submitter": author == post["author"], "_children": [], "_track": None}
+        self.things[comment["name"]] = comment
+        parent["_children"].append(comment["name"])
+        if author is not None:
+            self.user(author)
+        if track in TRACKED_KINDS:
+            self.track(comment, track, authors=[author])
+        elif track is not None and track in self._tracked:
+            # A reply completing a tracked item (a confirmation), latency counts from here
+            comment["_track"] = track
+            self._tracked[track]["created"] = time.monotonic()
+            self._pending_by_author.setdefault(author.lower(), set()).add(track)
+        return comment
+
+    def create_message(self, author, subject, body, dest=None, tracked=True):
+        message_id = self.new_id()
+        message = {"id": message_id, "name": "t4_" + message_id, "author": author, "dest": dest or self.bot,
+                   "subject": subject, "body": body, "created_utc": time.time(), "was_comment": False,
+                   "new": True, "first_message": None, "first_message_name": None, "parent_id": None,
+                   "context": "", "subreddit": None, "distinguished": None, "replies": "", "_track": None}
+        self.things[message["name"]] = message
+        if message["dest"].lower() == self.bot.lower():
+            self.inbox.append(message["name"])
+        if tracked:
+            self.track(message, "message")
+        return message
+
+    # Handling of tracked items
+
+    def track(self, thing, kind, authors=()):
+        thing["_track"] = thing["name"]
+        self._tracked[thing["name"]] = {"kind": kind, "created": time.monotonic(), "handled": None}
+        for author in authors:
+            if author is not None:
+                self._pending_by_author.setdefault(author.lower(), set()).add(thing["name"])
+
+    def _mark_handled(self, fullname):
+        entry = self._tracked.get(fullname)
+        if entry is not None and entry["handled"] is None:
+            entry["handled"] = time.monotonic()
+
+    def thing_action(self, fullname):
+        """ The bot acted on (or replied to) a thing, handles the tracked item it belongs to """
+        thing = self.things.get(fullname)
+        if thing is not None and thing["_track"]:
+            self._mark_handled(thing["_track"])
+
+    def user_action(self, name):
+        """ The bot changed a user's flair, handles tracked comments of that user """
+        for fullname in self._pending_by_author.pop(name.lower(), ()):
+            self._mark_handled(fullname)
+
+    def stats(self):
+        now = time.monotonic()
+        generated = dict.fromkeys(TRACKED_KINDS, 0)
+        handled = dict.fromkeys(TRACKED_KINDS, 0)
+        recent = dict.fromkeys(TRACKED_KINDS, 0)
+        oldest = dict.fromkeys(TRACKED_KINDS, 0.0)
+        latencies = {kind: [] for kind in TRACKED_KINDS}
+        for entry in self._tracked.values():
+            kind = entry["kind"]
+            generated[kind] += 1
+            if entry["handled"] is None:
+                oldest[kind] = max(oldest[kind], now - entry["created"])
+                continue
+            handled[kind] += 1
+            latencies[kind].append(entry["handled"] - entry["created"])
+            if now - entry["handled"] <= 60:
+                recent[kind] += 1
+        total_requests = sum(self.requests.values())
+        uptime = time.time() - self.started
+        return {"uptime_s": round(uptime, 1),
+                "requests": {"total": total_requests, "per_s": round(total_requests / max(uptime, 1e-9), 2),
+                             "by_route": dict(sorted(self.requests.items())), "rate_limited": self.rate_limited,
+                             "injected_errors": self.injected_errors, "unknown_routes": self.unknown_routes},
+                "generated": generated, "handled": handled,
+                "backlog": {kind: generated[kind] - handled[kind] for kind in TRACKED_KINDS},
+                "oldest_unhandled_s": {kind: round(age, 1) for kind, age in oldest.items()},
+                "handled_last_minute": recent,
+                "latency_s": {kind: percentiles(values) for kind, values in latencies.items()},
+                "timestamps": {"hosted": len(self.timestamps), "requests": self.timestamp_requests,
+                               "reported": self._timestamp_reports()}}
+
+    def _timestamp_reports(self):
+        reports = {}
+        for name in self.posts:
+            for reason, _mod in self.things[name]["mod_reports"]:
+                if reason.startswith("Timestamp"):
+                    reason = reason.split(":")[0].split(" from ")[0]
+                    reports[reason] = reports.get(reason, 0) + 1
+        return reports
+
+    # JSON representation
+
+    def thing_json(self, thing, with_replies=False, depth=0):
+        data = {key: value for key, value in thing.items() if not key.startswith("_")}
+        if thing["name"].startswith("t4_"):
+            return {"kind": "t4", "data": data}
+        text, css_class = self.flair_of(thing["subreddit"], thing["author"])
+        data.update(author=thing["author"] or "[deleted]", author_flair_text=text or None,
+                    author_flair_css_class=css_class or None, created=thing["created_utc"],
+                    num_reports=len(thing["mod_reports"]) + len(thing["user_reports"]))
+        if thing["author"] is not None:
+            data["author_fullname"] = "t2_" + self.user(thing["author"])["id"]
+        if thing["name"].startswith("t3_"):
+            data["num_comments"] = self._count_comments(thing)
+            return {"kind": "t3", "data": data}
+        data["depth"] = depth
+        data["replies"] = ""
+        if with_replies and thing["_children"]:
+            data["replies"] = self.listing([self.thing_json(self.things[child], True, depth + 1)
+                                            for child in thing["_children"]])
+        return {"kind": "t1", "data": data}
+
+    def _count_comments(self, thing):
+        return sum(1 + self._count_comments(self.things[child]) for child in thing["_children"])
+
+    def _flatten(self, fullname, depth):
+        """ Comment and its replies in tree order, as returned by morechildren """
+        thing = self.things[fullname]
+        items = [self.thing_json(thing, depth=depth)]
+        for child in thing["_children"]:
+            items += self._flatten(child, depth + 1)
+        return items
+
+    @staticmethod
+    def listing(children, after=None):
+        return {"kind": "Listing", "data": {"after": after, "before": None, "dist": len(children),
+                                            "modhash": None, "children": children}}
+
+    def more(self, parent_fullname, children, depth=0):
+        return {"kind": "more", "data": {"count": len(children), "name": "t1_" + children[0], "id": children[0],
+                                         "parent_id": parent_fullname, "depth": depth, "children": children}}
+
+    def comment_page(self, post, top_level):
+        """ Top-level comments up to COMMENT_PAGE with their replies, the rest as a more object """
+        shown = top_level[:COMMENT_PAGE]
+        children = [self.thing_json(self.things[fullname], True) for fullname in shown]
+        rest = [fullname.split("_", 1)[1] for fullname in top_level[COMMENT_PAGE:]]
+        if rest:
+            children.append(self.more(post["name"], rest))
+        return children
+
+    def morechildren(self, link_id, ids):
+        things = []
+        for comment_id in ids[:MORECHILDREN_PAGE]:
+            fullname = "t1_" + comment_id
+            if fullname in self.things and self.things[fullname]["link_id"] == link_id:
+                parent = self.things[self.things[fullname]["parent_id"]]
+                depth = 0 if parent["name"].startswith("t3_") else 1
+                things += self._flatten(fullname, depth)
+        if ids[MORECHILDREN_PAGE:]:
+            things.append(self.more(link_id, ids[MORECHILDREN_PAGE:]))
+        return things
+
+
+class NotFoundError(Exception):
+    pass
+
+
+def json_things(things):
+    """ Response of api/comment and friends """
+    return {"json": {"errors": [], "data": {"things": things}}}
+
+
+class Api:
+    """ Routes of the fake API, each handler gets the state, the regex match, query and form parameters """
+
+    def __init__(self, state):
+        self.state = state
+        self.routes = []
+        for method, pattern, handler in (
+                ("POST", r"api/v1/access_token", self.access_token),
+                ("GET", r"api/v1/me", self.me),
+                ("GET", r"r/(?P<subs>[^/]+)/new", self.new),
+                ("GET", r"r/(?P<sub>[^/]+)/about", self.subreddit_about),
+                ("GET", r"r/(?P<sub>[^/]+)/about/moderators", self.moderators),
+                ("GET", r"r/(?P<sub>[^/]+)/about/log", self.modlog),
+                ("GET", r"r/(?P<sub>[^/]+)/api/flairlist", self.flairlist),
+                ("POST", r"r/(?P<sub>[^/]+)/api/flair", self.flair),
+                ("GET", r"r/(?P<sub>[^/]+)/wiki/(?P<page>.+)", self.wiki_page),
+                ("POST", r"r/(?P<sub>[^/]+)/api/wiki/edit", self.wiki_edit),
+                ("GET", r"r/(?P<sub>[^/]+)/api/widgets", self.widgets),
+                ("PUT", r"r/(?P<sub>[^/]+)/api/widget/(?P<widget>[^/]+)", self.widget_update),
+                ("GET", r"comments/(?P<id>[a-z0-9]+)(?:/[^/]*)?(?:/(?P<comment>[a-z0-9]+))?", self.comments),
+                ("POST", r"api/morechildren", self.morechildren),
+                ("GET", r"api/info", self.info),
+                ("GET", r"user/(?P<user>[^/]+)/about", self.user_about),
+                ("GET", r"message/unread", self.unread),
+                ("POST", r"api/read_message", self.read_message),
+                ("POST", r"api/comment", self.comment),
+                ("POST", r"api/submit", self.submit),
+                ("POST", r"api/(?P<action>remove|approve|report|distinguish(?:/\w+)?|set_subreddit_sticky|"
+                         r"set_suggested_sort|lock|unlock)", self.mod_action)):
+            self.routes.append((method, re.compile(pattern + "$"), handler))
+
+    def route(self, method, path):
+        for route_method, regex, handler in self.routes:
+            match = regex.match(path) if route_method == method else None
+            if match:
+                return handler, match
+        return None, None
+
+    def access_token(self, _match, _query, _form):
+        return {"access_token": "fake-" + self.state.new_id(), "token_type": "bearer", "expires_in": 3600,
+                "scope": "*"}
+
+    def me(self, _match, _query, _form):
+        return self.state.user_json(self.state.bot)["data"]
+
+    def new(self, match, query, _form):
+        subs = {self.state.subreddit(name)["name"].lower() for name in match["subs"].split("+")}
+        posts = [name for name in reversed(self.state.posts) if self.state.things[name]["subreddit"].lower() in subs]
+        return self._page(posts, query)
+
+    def _page(self, fullnames, query):
+        """ Listing page of fullnames honouring limit/after like reddit (max 100 per page) """
+        limit = min(int(query.get("limit", 25)), 100)
+        start = 0
+        if query.get("after"):
+            start = fullnames.index(query["after"]) + 1 if query["after"] in fullnames else len(fullnames)
+        page = fullnames[start:start + limit]
+        after = page[-1] if len(page) == limit and start + limit < len(fullnames) else None
+        return FakeReddit.listing([self.state.thing_json(self.state.things[name]) for name in page], after)
+
+    def subreddit_about(self, match, _query, _form):
+        sub = self.state.subreddit(match["sub"])
+        return {"kind": "t5", "data": {"display_name": sub["name"], "id": sub["id"], "name": "t5_" + sub["id"],
+                                       "subscribers": 10000, "user_is_moderator": True,
+                                       "display_name_prefixed": "r/" + sub["name"]}}
+
+    def moderators(self, match, _query, _form):
+        self.state.subreddit(match["sub"])
+        return {"kind": "UserList", "data": {"children": [
+            {"name": mod, "id": "t2_" + self.state.user(mod)["id"], "date": self.state.started,
+             "mod_permissions": ["all"]} for mod in self.state.mods]}}
+
+    def modlog(self, match, query, _form):
+        sub = self.state.subreddit(match["sub"])
+        entries = [entry for entry in reversed(sub["modlog"]) if query.get("type") in (None, entry["action"])]
+        limit = min(int(query.get("limit", 100)), 500)
+        start = 0
+        if query.get("after"):
+            ids = [entry["id"] for entry in entries]
+            start = ids.index(query["after"]) + 1 if query["after"] in ids else len(ids)
+        page = entries[start:start + limit]
+        after = page[-1]["id"] if len(page) == limit else None
+        return FakeReddit.listing([{"kind": "modaction", "data": dict(entry)} for entry in page], after)
+
+    def flairlist(self, match, query, _form):
+        sub = self.state.subreddit(match["sub"])
+        entries = list(sub["flair"].values())
+        if query.get("name"):
+            entries = [entry for entry in entries if entry[0].lower() == query["name"].lower()]
+        limit = min(int(query.get("limit", 1000)), 1000)
+        start = 0
+        if query.get("after"):
+            names = ["t2_" + self.state.user(entry[0])["id"] for entry in entries]
+            start = names.index(query["after"]) + 1 if query["after"] in names else len(names)
+        page = entries[start:start + limit]
+        result = {"users": [{"user": name, "flair_text": text or None, "flair_css_class": css_class or None}
+                            for name, text, css_class in page]}
+        if len(page) == limit and start + limit < len(entries):
+            result["next"] = "t2_" + self.state.user(page[-1][0])["id"]
+        return result
+
+    def flair(self, match, _query, form):
+        sub = self.state.subreddit(match["sub"])
+        if "link" in form:
+            post = self._thing(form["link"])
+            post["link_flair_text"] = form.get("text") or None
+            post["link_flair_css_class"] = form.get("css_class") or None
+            self.state.log_action(sub, "editflair", post["author"], post["name"])
+            self.state.thing_action(post["name"])
+        else:
+            self.state.set_user_flair(sub["name"], form["name"], form.get("text"), form.get("css_class"))
+        return {"json": {"errors": []}}
+
+    def wiki_page(self, match, _query, _form):
+        page = self.state.subreddit(match["sub"])["wiki"].get(match["page"].lower())
+        if page is None:
+            raise NotFoundError("wiki page " + match["page"])
+        return {"kind": "wikipage", "data": {"content_md": page["content_md"], "content_html": "",
+                                             "may_revise": True, "revision_date": page["revision_date"],
+                                             "revision_id": self.state.new_id(),
+                                             "revision_by": self.state.user_json(page["revision_by"])}}
+
+    def wiki_edit(self, match, _query, form):
+        sub = self.state.subreddit(match["sub"])
+        sub["wiki"][form["page"].lower()] = {"content_md": form.get("content", ""), "revision_date": time.time(),
+                                             "revision_by": self.state.bot}
+        self.state.log_action(sub, "wikirevise")
+        return {}
+
+    def widgets(self, match, _query, _form):
+        sub = self.state.subreddit(match["sub"])
+        order = list(sub["widgets"])
+        return {"items": {widget_id: dict(widget) for widget_id, widget in sub["widgets"].items()},
+                "layout": {"idCardWidget": None, "moderatorWidget": None, "sidebar": {"order": order},
+                           "topbar": {"order": []}}}
+
+    def widget_update(self, match, _query, form):
+        sub = self.state.subreddit(match["sub"])
+        widget = sub["widgets"].get(match["widget"])
+        if widget is None:
+            raise NotFoundError("widget " + match["widget"])
+        widget.update(json.loads(form["json"]))
+        widget["id"] = match["widget"]
+        return dict(widget)
+
+    def _thing(self, fullname):
+        thing = self.state.things.get(fullname)
+        if thing is None:
+            raise NotFoundError(fullname)
+        return thing
+
+    def comments(self, match, _query, _form):
+        post = self._thing("t3_" + match["id"])
+        if match["comment"]:
+            comment = self._thing("t1_" + match["comment"])
+            children = [self.state.thing_json(comment, True)]
+        else:
+            children = self.state.comment_page(post, post["_children"])
+        return [FakeReddit.listing([self.state.thing_json(post)]), FakeReddit.listing(children)]
+
+    def morechildren(self, _match, _query, form):
+        return json_things(self.state.morechildren(form["link_id"], form["children"].split(",")))
+
+    def info(self, _match, query, _form):
+        things = [self.state.things[name] for name in query.get("id", "").split(",") if name in self.state.things]
+        return FakeReddit.listing([self.state.thing_json(thing) for thing in things])
+
+    def user_about(self, match, _query, _form):
+        return self.state.user_json(match["user"])
+
+    def unread(self, _match, query, _form):
+        unread = [name for name in reversed(self.state.inbox) if self.state.things[name]["new"]]
+        return self._page(unread, query)
+
+    def read_message(self, _match, _query, form):
+        for fullname in form.get("id", "").split(","):
+            if fullname in self.state.things:
+                self.state.things[fullname]["new"] = False
+                self.state.thing_action(fullname)
+        return {}
+
+    def comment(self, _match, _query, form):
+        parent = self._thing(form["thing_id"])
+        if parent["name"].startswith("t4_"):
+            reply = self.state.create_message(self.state.bot, "re: " + parent["subject"], form["text"],
+                                              dest=parent["author"], tracked=False)
+            reply["parent_id"] = parent["name"]
+        else:
+            reply = self.state.create_comment(parent["name"], self.state.bot, form["text"])
+        self.state.thing_action(parent["name"])
+        return json_things([self.state.thing_json(reply)])
+
+    def submit(self, _match, _query, form):
+        post = self.state.create_post(form["sr"], self.state.bot, form["title"], form.get("text", ""),
+                                      tracked=False)
+        return {"json": {"errors": [], "data": {"url": post["url"], "id": post["id"], "name": post["name"]}}}
+
+    def mod_action(self, match, _query, form):
+        thing = self._thing(form["id"])
+        action = match["action"].split("/")[0]
+        if action == "remove":
+            thing.update(removed=True, banned_by=self.state.bot, approved_by=None)
+        elif action == "approve":
+            thing.update(removed=False, banned_by=None, approved_by=self.state.bot)
+        elif action == "report":
+            thing["mod_reports"].append([form.get("reason", ""), self.state.bot])
+        elif action == "distinguish":
+            thing["distinguished"] = "moderator" if form.get("how", "yes") == "yes" else None
+        elif action == "set_subreddit_sticky":
+            thing["stickied"] = form.get("state") == "True"
+        elif action == "set_suggested_sort":
+            thing["suggested_sort"] = form.get("sort")
+        elif action in ("lock", "unlock"):
+            thing["locked"] = action == "lock"
+        if thing["name"][:3] in ("t1_", "t3_"):
+            log_action = action
+            if action in ("remove", "approve"):
+                log_action += "link" if thing["name"].startswith("t3_") else "comment"
+            self.state.log_action(self.state.subreddit(thing["subreddit"]), log_action, thing["author"],
+                                  thing["name"])
+        self.state.thing_action(thing["name"])
+        if action == "distinguish":
+            return json_things([self.state.thing_json(thing)])
+        return {}
+
+
+class Control:
+    """ Endpoints under /_fake/ for the traffic generator (not rate limited, no latency) """
+
+    def __init__(self, state):
+        self.state = state
+
+    def handle(self, method, path, body):
+        state = self.state
+        if method == "GET" and path == "_fake/stats":
+            return state.stats()
+        if method == "GET" and path.startswith("_fake/timestamp/"):
+            # Stub image host: albums uploaded through POST _fake/timestamp exist, all others are missing
+            state.timestamp_requests += 1
+            return {} if path.rsplit("/", 1)[-1] in state.timestamps else None
+        if method == "GET" and path == "_fake/config":
+            return {"bot": state.bot, "mods": state.mods, "threads": state.threads,
+                    "subreddits": [sub["name"] for sub in state.subreddits.values()]}
+        if method != "POST":
+            return None
+        if path == "_fake/submit":
+            post = state.create_post(body["subreddit"], body["author"], body["title"], body.get("selftext", ""),
+                                     tracked=body.get("tracked", True))
+            return {"id": post["id"], "name": post["name"]}
+        if path == "_fake/comment":
+            comment = state.create_comment(body["parent"], body["author"], body["body"], body.get("track"))
+            return {"id": comment["id"], "name": comment["name"]}
+        if path == "_fake/message":
+            message = state.create_message(body["author"], body["subject"], body["body"])
+            return {"id": message["id"], "name": message["name"]}
+        if path == "_fake/timestamp":
+            state.timestamps.add(body["id"])
+            return {"url": "/_fake/timestamp/a/" + body["id"]}
+        if path == "_fake/flair":
+            state.subreddit(body["subreddit"])["flair"][body["user"].lower()] = (
+                state.user(body["user"])["name"], body.get("text") or "", body.get("css_class") or "")
+            return {}
+        return None
+
+
+def make_handler(state, api, control, rate_limit, latency, jitter, error_rate):
+    """ Request handler class bound to the shared state """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *_args):  # pylint: disable=arguments-differ
+            pass
+
+        def _send(self, status, payload, headers=None):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _form(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length).decode("utf-8") if length else ""
+            if "json" in (self.headers.get("Content-Type") or ""):
+                return json.loads(raw or "{}")
+            return {key: values[-1] for key, values in parse_qs(raw, keep_blank_values=True).items()}
+
+        def _handle(self, method):
+            url = urlsplit(self.path)
+            path = url.path.strip("/")
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            form = self._form()
+            if path.startswith("_fake/"):
+                with state.lock:
+                    try:
+                        result = control.handle(method, path, form)
+                    except (KeyError, NotFoundError) as exc:
+                        self._send(400, {"error": str(exc)})
+                        return
+                self._send(200 if result is not None else 404, result if result is not None else {})
+                return
+
+            if latency or jitter:
+                time.sleep(max(0.0, random.gauss(latency, jitter)))
+            handler, match = api.route(method, path)
+            route = handler.__name__ if handler else None
+            with state.lock:
+                if route is None:
+                    key = "{} {}".format(method, re.sub(r"[a-z0-9]{6,}", "{id}", path))
+                    state.unknown_routes[key] = state.unknown_routes.get(key, 0) + 1
+                    self._send(404, {"message": "Not Found", "error": 404})
+                    return
+                state.requests[route] = state.requests.get(route, 0) + 1
+                headers = {}
+                if route != "access_token":
+                    token = (self.headers.get("Authorization") or "").split(" ")[-1]
+                    headers, allowed = rate_limit.take(token, time.time())
+                    if not allowed:
+                        state.rate_limited += 1
+                        self._send(429, {"message": "Too Many Requests", "error": 429}, headers)
+                        return
+                    if error_rate and random.random() < error_rate:
+                        state.injected_errors += 1
+                        self._send(503, {"message": "Service Unavailable", "error": 503}, headers)
+                        return
+                try:
+                    result = handler(match, query, form)
+                except NotFoundError:
+                    self._send(404, {"message": "Not Found", "error": 404}, headers)
+                    return
+                except (KeyError, ValueError) as exc:
+                    self._send(400, {"message": "Bad Request: {}".format(exc), "error": 400}, headers)
+                    return
+                self._send(200, result, headers)
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            self._handle("GET")
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            self._handle("POST")
+
+        def do_PUT(self):  # pylint: disable=invalid-name
+            self._handle("PUT")
+
+    return Handler
+
+
+def write_praw_ini(path, url):
+    """ praw.ini site pointing praw at the fake server, update checks would go to pypi """
+    with open(path, "w", encoding="utf-8") as ini_file:
+        ini_file.write("[{site}]\noauth_url = {url}\nreddit_url = {url}\nshort_url = {url}\n"
+                       "check_for_updates = false\n".format(site=PRAW_SITE, url=url))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Reddit API server for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-s", "--subreddit", dest="subreddits", action="append",
+                        help="subreddit to serve (repeat for several, default from config.cfg)")
+    parser.add_argument("--bot", default=None, help="bot account, a moderator (default from config.cfg)")
+    parser.add_argument("--mod", dest="mods", action="append", default=[], help="additional moderator")
+    parser.add_argument("--latency-ms", type=float, default=50, help="mean added latency per API request")
+    parser.add_argument("--jitter-ms", type=float, default=20, help="standard deviation of the added latency")
+    parser.add_argument("--ratelimit", type=int, default=600, help="requests per token and rate limit window")
+    parser.add_argument("--window", type=int, default=600, help="rate limit window in seconds")
+    parser.add_argument("--suspended-share", type=float, default=0.0,
+                        help="share of users that are suspended (the bot leaves their trades pending)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--praw-ini", default="praw.ini",
+                        help="praw.ini written with a '{}' site for this server (empty skips)".format(PRAW_SITE))
+    args = parser.parse_args()
+
+    if not args.subreddits or not args.bot:
+        cfg_file = SafeConfigParser()
+        cfg_file.read(os.path.join(os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0]))), "config.cfg"))
+        if not args.subreddits and cfg_file.has_option("subreddit", "uri"):
+            args.subreddits = [cfg_file["subreddit"]["uri"]]
+        if not args.bot and cfg_file.has_option("login", "username"):
+            args.bot = cfg_file["login"]["username"]
+    if not args.subreddits or not args.bot:
+        sys.exit("No subreddit/bot given and no config.cfg to read them from")
+
+    state = FakeReddit(args.subreddits, args.bot, args.mods, args.suspended_share)
+    handler = make_handler(state, Api(state), Control(state), RateLimitWindow(args.ratelimit, args.window),
+                           args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate)
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    url = "http://{}:{}".format(args.host, server.server_address[1])
+    if args.praw_ini:
+        write_praw_ini(args.praw_ini, url)
+        print("Wrote {} (run the bot with praw_site={} in that directory)".format(args.praw_ini, PRAW_SITE))
+    for name, threads in state.threads.items():
+        print("r/{}: [trade] link_id = {}, [heatware] link_id = {}, [price] link_id = {}".format(
+            name, threads["trade"], threads["heatware"], threads["price"]))
+    print("Serving fake reddit at {}, stats at {}/_fake/stats".format(url, url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
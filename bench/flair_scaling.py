@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Run time, memory and simulated API calls of TradeFlairer.process_post and process_mod_messages on
+synthetic confirmation threads of growing size, to check the work grows linearly with the thread
+"""
+
+import sys
+import os
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from types import SimpleNamespace
+from configparser import ConfigParser
+
+REPO_DIR = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+sys.path.insert(0, REPO_DIR)
+
+# Reddit's page sizes: comments in a thread response, children per morechildren request, listing items
+THREAD_PAGE = 500
+MORECHILDREN_PAGE = 100
+LISTING_PAGE = 100
+SUBREDDIT = "benchswap"
+THREAD_ID = "bench1"
+BOT = "benchbot"
+MOD = "benchmod"
+# First run over the whole thread, rerun after 1% new confirmations (later cron runs of the month), mod PMs
+PHASES = ("first_run", "rerun", "mod_messages")
+
+
+class FakeComment:
+    """ The praw comment attributes and actions TradeFlairer uses, requests are counted by reddit """
+
+    def __init__(self, reddit, comment_id, author, body, parent_id, created_utc, flair_css_class=None):
+        self._reddit = reddit
+        self.id = comment_id
+        self.author = SimpleNamespace(name=author) if author else None
+        self.body = body
+        self.link_id = "t3_" + THREAD_ID
+        self.parent_id = parent_id
+        self.permalink = "/r/{}/comments/{}/_/{}/".format(SUBREDDIT, THREAD_ID, comment_id)
+        self.created_utc = created_utc
+        self.author_flair_css_class = flair_css_class
+        self.author_flair_text = None
+        self.banned_by = None
+        self.mod_reports = []
+        self.removed = False
+        self.replies = []
+        self.mod = SimpleNamespace(remove=lambda: reddit.count("remove"), approve=lambda: reddit.count("approve"),
+                                   distinguish=lambda: reddit.count("distinguish"))
+
+    def reply(self, body):
+        self._reddit.count("comment")
+        reply = FakeComment(self._reddit, "{}r{}".format(self.id, len(self.replies)), BOT, body, "t1_" + self.id,
+                            time.time())
+        # Shows up in the next fetch of the thread, like on reddit
+        self.replies.append(reply)
+        self._reddit.comments[reply.id] = reply
+        return reply
+
+    def report(self, _reason):
+        self._reddit.count("report")
+
+    def refresh(self):
+        # Comment by id: api/info for its thread, then the comment with its replies
+        self._reddit.count("refresh", 2)
+        return self
+
+
+class FakeRedditor:
+    """ Lazy redditor, the about request is sent on first attribute access """
+
+    def __init__(self, reddit, name, profile):
+        self._reddit = reddit
+        self.name = name
+        self._profile = profile
+
+    def __getattr__(self, attribute):
+        if attribute.startswith("_") or attribute not in self._profile:
+            raise AttributeError(attribute)
+        self._reddit.count("user_about")
+        self.__dict__.update(self._profile)
+        return self._profile[attribute]
+
+
+class FakeMessage:
+    def __init__(self, reddit, message_id, author, body):
+        self._reddit = reddit
+        self.id = message_id
+        self.fullname = "t4_" + message_id
+        self.author = SimpleNamespace(name=author)
+        self.body = body
+        self.created_utc = time.time()
+        self.was_comment = False
+
+    def reply(self, _body):
+        self._reddit.count("message_reply")
+
+
+class FakeForest(list):
+    def __init__(self, reddit, comments):
+        super().__init__(comments)
+        self._reddit = reddit
+
+    def replace_more(self, limit=None, threshold=0):  # pylint: disable=unused-argument
+        self._reddit.count("morechildren", math.ceil(max(len(self) - THREAD_PAGE, 0) / MORECHILDREN_PAGE))
+
+
+class FakeReddit:
+    """
+    The praw.Reddit surface SubRedditMod, TradeFlairer and InboxStream use, answering from memory
+    and counting the requests praw would have sent
+    """
+
+    def __init__(self, profiles):
+        self.calls = {}
+        self.thread = []
+        self.comments = {}
+        self.messages = []
+        self.profiles = profiles
+        self.inbox = SimpleNamespace(unread=self._unread)
+
+    def count(self, name, requests=1):
+        self.calls[name] = self.calls.get(name, 0) + requests
+
+    def add_comments(self, comments):
+        self.thread += comments
+        for comment in comments:
+            self.comments[comment.id] = comment
+            for reply in comment.replies:
+                self.comments[reply.id] = reply
+
+    def _unread(self, limit=None):  # pylint: disable=unused-argument
+        self.count("inbox", max(1, math.ceil(len(self.messages) / LISTING_PAGE)))
+        return list(self.messages)
+
+    def subreddit(self, name):
+        return SimpleNamespace(display_name=name, moderator=self._moderators,
+                               flair=SimpleNamespace(set=lambda *_args, **_kwargs: self.count("flair")))
+
+    def _moderators(self):
+        self.count("moderators")
+        return [SimpleNamespace(name=mod) for mod in (BOT, MOD)]
+
+    def submission(self, id):  # pylint: disable=redefined-builtin
+        self.count("thread")
+        return SimpleNamespace(id=id, comments=FakeForest(self, self.thread))
+
+    def comment(self, id):  # pylint: disable=redefined-builtin
+        return self.comments[id]
+
+    def redditor(self, name):
+        return FakeRedditor(self, name, self.profiles[name])
+
+    def post(self, path, data=None):  # pylint: disable=unused-argument
+        self.count(path.strip("/").split("/")[-1])
+
+
+def build_thread(reddit, size, prefix, seed):
+    """
+    size top-level confirmations: most confirmed by the tagged user, some without mention, unconfirmed
+    or with a wrong confirmation text. Accounts come from a pool of size / 2 users, some too young for flair.
+    """
+    rand = random.Random(seed)
+    users = ["{}user{}".format(prefix, number) for number in range(max(size // 2, 2))]
+    now = time.time()
+    for name in users:
+        young = rand.random() < 0.05
+        reddit.profiles[name] = {"fullname": "t2_" + name, "link_karma": rand.randrange(1000),
+                                 "comment_karma": rand.randrange(5000),
+                                 "created_utc": now - rand.randrange(1, 10) * 86400 if young else
+                                 now - rand.randrange(30, 3000) * 86400}
+    thread = []
+    for number in range(size):
+        author, partner = rand.sample(users, 2)
+        kind = rand.random()
+        body = "Traded with /u/{}".format(partner) if kind >= 0.05 else "Traded with {}".format(partner)
+        comment = FakeComment(reddit, "{}{:06x}".format(prefix, number), author, body, "t3_" + THREAD_ID,
+                              now - size + number, "i-{}".format(rand.randrange(20)))
+        if kind >= 0.15:
+            confirmation = "Confirmed" if kind >= 0.2 else "Thanks, smooth trade"
+            comment.replies.append(FakeComment(reddit, comment.id + "c", partner, confirmation, "t1_" + comment.id,
+                                               now - size + number + 1, "i-{}".format(rand.randrange(20))))
+        thread.append(comment)
+    return thread
+
+
+def mod_messages(reddit, thread, count, links_per_message, seed):
+    """ Mod PMs linking confirmations, as sent for trades needing manual review """
+    rand = random.Random(seed)
+    messages = []
+    for number in range(count):
+        links = ["https://www.reddit.com/r/{}/comments/{}/_/{}/".format(SUBREDDIT, THREAD_ID, comment.id)
+                 for comment in rand.sample(thread, min(links_per_message, len(thread)))]
+        messages.append(FakeMessage(reddit, "m{:06x}".format(number), MOD, "\n".join(links)))
+    return messages
+
+
+def write_config(work_dir):
+    """ config.cfg of the benchmark subreddit, based on the sample """
+    config = ConfigParser(interpolation=None)
+    config.read(os.path.join(REPO_DIR, "config.cfg.sample"))
+    config["login"]["username"] = BOT
+    config["subreddit"]["uri"] = SUBREDDIT
+    config["trade"]["link_id"] = THREAD_ID
+    path = os.path.join(work_dir, "config.cfg")
+    with open(path, "w", encoding="utf-8") as config_file:
+        config.write(config_file)
+    return path
+
+
+def run(size, messages_per_1k, links_per_message, seed):
+    """ PHASES on a thread of size comments in this process """
+    work_dir = tempfile.mkdtemp(prefix="flair_scaling")
+    os.chdir(work_dir)
+    config_path = write_config(work_dir)
+    # flair.py's logger reads config.cfg next to the running script
+    import log_conf  # pylint: disable=import-outside-toplevel
+    log_conf.path_to_cfg = config_path
+    import flair  # pylint: disable=import-outside-toplevel
+    import user_db  # pylint: disable=import-outside-toplevel
+    from common import SubRedditMod  # pylint: disable=import-outside-toplevel
+
+    con = user_db.connect(os.path.join(work_dir, "user.db"))
+    user_db.migrate(con)
+    con.close()
+
+    reddit = FakeReddit({})
+    reddit.add_comments(build_thread(reddit, size, "c", seed))
+    subreddit = SubRedditMod(flair.LOGGER, config_path, reddit)
+    flairer = flair.TradeFlairer(subreddit, flair.LOGGER)
+
+    results = {"size": size}
+    tracemalloc.start()
+    for phase in PHASES:
+        items = size
+        if phase == "rerun":
+            items = max(size // 100, 1)
+            reddit.add_comments(build_thread(reddit, items, "n", seed + 1))
+        elif phase == "mod_messages":
+            items = max(1, size * messages_per_1k // 1000)
+            reddit.messages = mod_messages(reddit, reddit.thread, items, links_per_message, seed + 2)
+        calls_before = dict(reddit.calls)
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        if phase == "mod_messages":
+            flairer.process_mod_messages()
+        else:
+            flairer.process_post("curr")
+        elapsed = time.perf_counter() - start
+        calls = {name: count - calls_before.get(name, 0) for name, count in sorted(reddit.calls.items())
+                 if count != calls_before.get(name, 0)}
+        results[phase] = {"items": items, "seconds": elapsed, "peak_mb": tracemalloc.get_traced_memory()[1] / 2 ** 20,
+                          "api_calls": sum(calls.values()), "api_by_call": calls}
+    results["maxrss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    os.chdir(REPO_DIR)
+    shutil.rmtree(work_dir)
+    return results
+
+
+def per_item(result, phase):
+    """ Seconds per comment (first run), per new comment (rerun) or per mod PM """
+    return result[phase]["seconds"] / result[phase]["items"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling of trade flair processing with the confirmation thread size")
+    parser.add_argument("-s", "--sizes", default="1000,10000,50000", help="comma separated thread sizes")
+    parser.add_argument("-m", "--messages", type=int, default=5, help="mod PMs per 1000 thread comments")
+    parser.add_argument("-l", "--links", type=int, default=3, help="comment links per mod PM")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-ratio", type=float, default=3.0,
+                        help="largest allowed growth of time per item from the smallest to the largest size")
+    parser.add_argument("--history", default=None,
+                        help="json file the results are appended to, compared against its last entry")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="relative time increase over the last history entry reported as regression")
+    parser.add_argument("--size", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size:
+        print(json.dumps(run(args.size, args.messages, args.links, args.seed)))
+        return
+
+    # Each size in a fresh process so resident sizes do not mix
+    results = {}
+    for size in (int(size) for size in args.sizes.split(",")):
+        output = subprocess.run([sys.executable, os.path.abspath(sys.argv[0]), "--size", str(size),
+                                 "-m", str(args.messages), "-l", str(args.links), "--seed", str(args.seed)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results[str(size)] = result
+        print("{:>7} comments, {:.0f} MB max resident".format(size, result["maxrss_mb"]))
+        for phase in PHASES:
+            print("{:>16}: {:8.2f} s ({:7.3f} ms/item), {:6.1f} MB peak, {:6} API calls {}".format(
+                phase, result[phase]["seconds"], per_item(result, phase) * 1000, result[phase]["peak_mb"],
+                result[phase]["api_calls"], result[phase]["api_by_call"]))
+
+    problems = 0
+    sizes = sorted(results, key=int)
+    for phase in PHASES if len(sizes) > 1 else ():
+        ratio = per_item(results[sizes[-1]], phase) / max(per_item(results[sizes[0]], phase), 1e-9)
+        line = "{:>16}: time per item x{:.2f} from {} to {} comments".format(phase, ratio, sizes[0], sizes[-1])
+        if ratio > args.max_ratio:
+            line += " NOT LINEAR"
+            problems += 1
+        print(line)
+
+    history = []
+    if args.history and os.path.exists(args.history):
+        with open(args.history, "r", encoding="utf-8") as history_file:
+            history = json.load(history_file)
+    previous = history[-1]["results"] if history else {}
+    for size, result in results.items():
+        for phase in PHASES:
+            if size not in previous:
+                continue
+            change = result[phase]["seconds"] / max(previous[size][phase]["seconds"], 1e-9) - 1
+            if change > args.tolerance:
+                print("{} comments {}: {:+.0%} REGRESSION".format(size, phase, change))
+                problems += 1
+    if args.history:
+        history.append({"time": int(time.time()), "python": sys.version.split()[0], "results": results})
+        with open(args.history, "w", encoding="utf-8") as history_file:
+            json.dump(history, history_file, indent=1)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+""" Import time of each entry point (python -X importtime SCRIPT --help), tracked in a history file """
+
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+ENTRY_POINTS = ("post_check.py", "flair.py", "heatware.py", "monthly_post.py")
+
+
+def parse_importtime(stderr):
+    """ {module: (self_us, cumulative_us)} and the total of top level imports in microseconds """
+    modules = {}
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = len(name) - len(name.lstrip(" ")) - 1
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+        if depth == 0:
+            total += int(cumulative_us)
+    return modules, total
+
+
+def measure(work_dir, script, runs):
+    """ Median import total and wall time of runs cold starts, plus the slowest modules of the last run """
+    totals = []
+    walls = []
+    modules = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", script, "--help"], cwd=work_dir,
+                                capture_output=True, text=True, check=False)
+        walls.append(time.perf_counter() - start)
+        modules, total = parse_importtime(result.stderr)
+        totals.append(total)
+    slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:5]
+    return {"import_ms": statistics.median(totals) / 1000, "wall_ms": statistics.median(walls) * 1000,
+            "slowest": [[name, self_us / 1000] for name, (self_us, _cumulative) in slowest]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure and track import time of the entry points")
+    parser.add_argument("-r", "--runs", type=int, default=5, help="cold starts per entry point (median reported)")
+    parser.add_argument("--history", default=None,
+                        help="json file the results are appended to, compared against its last entry")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative import time increase over the last entry reported as regression")
+    args = parser.parse_args()
+
+    # Scripts read config.cfg next to themselves, run copies with the sample config
+    work_dir = tempfile.mkdtemp(prefix="import_time")
+    try:
+        for name in os.listdir(REPO_DIR):
+            if name.endswith((".py", ".json")):
+                shutil.copy(os.path.join(REPO_DIR, name), work_dir)
+        shutil.copy(os.path.join(REPO_DIR, "config.cfg.sample"), os.path.join(work_dir, "config.cfg"))
+        results = {script: measure(work_dir, script, args.runs) for script in ENTRY_POINTS}
+    finally:
+        shutil.rmtree(work_dir)
+
+    history = []
+    if args.history and os.path.exists(args.history):
+        with open(args.history, "r", encoding="utf-8") as history_file:
+            history = json.load(history_file)
+    previous = history[-1]["results"] if history else {}
+
+    regressions = 0
+    for script, result in results.items():
+        line = "{:>16}: imports {:6.1f} ms, wall {:6.1f} ms".format(script, result["import_ms"], result["wall_ms"])
+        if script in previous:
+            change = result["import_ms"] / max(previous[script]["import_ms"], 1e-9) - 1
+            line += " ({:+.0%})".format(change)
+            if change > args.tolerance:
+                line += " REGRESSION"
+                regressions += 1
+        print(line)
+        print("{:>16}  slowest: {}".format("", ", ".join("{} {:.1f}".format(name, ms)
+                                                         for name, ms in result["slowest"])))
+
+    if args.history:
+        history.append({"time": int(time.time()), "python": sys.version.split()[0], "results": results})
+        with open(args.history, "w", encoding="utf-8") as history_file:
+            json.dump(history, history_file, indent=1)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
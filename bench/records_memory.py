@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+""" Compare memory held by a day of praw submissions/comments against the slotted records """
+
+import sys
+import os
+import gc
+import json
+import time
+import random
+import argparse
+import resource
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0]))))
+
+import praw  # noqa: E402 pylint: disable=wrong-import-position
+
+from records import CommentRecord, PostRecord  # noqa: E402 pylint: disable=wrong-import-position
+
+WORDS = "gpu cpu ram ssd monitor keyboard mouse case fan psu cable board shipped local paypal".split()
+
+
+def _text(rand, words):
+    return " ".join(rand.choice(WORDS) for _ in range(words))
+
+
+def submission_data(rand, number):
+    """ Listing data of a submission with the fields reddit returns """
+    name = "user{}".format(rand.randrange(5000))
+    created = time.time() - rand.randrange(86400)
+    data = {"id": "s{:05x}".format(number), "name": "t3_s{:05x}".format(number), "author": name,
+            "author_fullname": "t2_" + name, "title": "[US-CA] [H] " + _text(rand, 8) + " [W] PayPal",
+            "selftext": _text(rand, rand.randrange(50, 400)), "created_utc": created, "created": created,
+            "subreddit": "hardwareswap", "subreddit_id": "t5_2skrs", "subreddit_name_prefixed": "r/hardwareswap",
+            "author_flair_css_class": "i-{}".format(rand.randrange(50)), "author_flair_text": None,
+            "link_flair_css_class": "selling", "link_flair_text": "Selling", "permalink": "/r/hardwareswap/x",
+            "url": "https://www.reddit.com/r/hardwareswap/x", "domain": "self.hardwareswap", "is_self": True,
+            "num_comments": rand.randrange(20), "score": 1, "ups": 1, "downs": 0, "upvote_ratio": 1.0,
+            "removed": False, "banned_by": None, "approved_by": None, "mod_reports": [], "user_reports": [],
+            "selftext_html": "<div>" + _text(rand, 200) + "</div>", "thumbnail": "self", "edited": False,
+            "stickied": False, "locked": False, "over_18": False, "spoiler": False, "archived": False,
+            "media": None, "media_embed": {}, "secure_media": None, "secure_media_embed": {},
+            "all_awardings": [], "awarders": [], "gildings": {}, "treatment_tags": [],
+            "link_flair_richtext": [], "author_flair_richtext": [], "content_categories": None}
+    for extra in range(40):
+        data["misc_field_{}".format(extra)] = None
+    return data
+
+
+def comment_data(rand, number, depth=1):
+    name = "user{}".format(rand.randrange(5000))
+    created = time.time() - rand.randrange(86400)
+    replies = ""
+    if depth:
+        replies = {"kind": "Listing", "data": {"after": None, "before": None, "children": [
+            {"kind": "t1", "data": comment_data(rand, number * 10 + 1, depth - 1)}]}}
+    data = {"id": "c{:06x}".format(number), "name": "t1_c{:06x}".format(number), "author": name,
+            "author_fullname": "t2_" + name, "body": ("/u/user{} ".format(rand.randrange(5000)) if depth else
+                                                      "Confirmed"),
+            "body_html": "<div>text</div>", "created_utc": created, "created": created,
+            "link_id": "t3_conf01", "parent_id": "t3_conf01", "subreddit": "hardwareswap",
+            "subreddit_id": "t5_2skrs", "permalink": "/r/hardwareswap/comments/conf01/x/c/",
+            "author_flair_css_class": "i-{}".format(rand.randrange(50)), "author_flair_text": None,
+            "banned_by": None, "mod_reports": [], "user_reports": [], "score": 1, "ups": 1, "downs": 0,
+            "edited": False, "stickied": False, "distinguished": None, "removed": False,
+            "all_awardings": [], "gildings": {}, "replies": replies}
+    for extra in range(30):
+        data["misc_field_{}".format(extra)] = None
+    return data
+
+
+def listing(kind, children):
+    return {"kind": "Listing", "data": {"after": None, "before": None,
+                                        "children": [{"kind": kind, "data": data} for data in children]}}
+
+
+def run(mode, posts, comments):
+    reddit = praw.Reddit(client_id="bench", client_secret="bench", user_agent="records_memory bench")
+    rand = random.Random(1)
+    tracemalloc.start()
+    kept = []
+    # Items arrive in polls of 50 like the bot's listing requests
+    for start in range(0, posts, 50):
+        batch = reddit._objector.objectify(  # pylint: disable=protected-access
+            listing("t3", [submission_data(rand, number) for number in range(start, min(start + 50, posts))]))
+        kept += [PostRecord.from_praw(post) for post in batch] if mode == "records" else list(batch)
+    for start in range(0, comments, 50):
+        batch = reddit._objector.objectify(  # pylint: disable=protected-access
+            listing("t1", [comment_data(rand, number) for number in range(start, min(start + 50, comments))]))
+        kept += [CommentRecord.from_praw(comment) for comment in batch] if mode == "records" else list(batch)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    return {"mode": mode, "items": len(kept), "held_mb": current / 2 ** 20, "peak_mb": peak / 2 ** 20,
+            "maxrss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory held by praw objects vs records over a simulated day")
+    parser.add_argument("-p", "--posts", type=int, default=3000, help="submissions per day")
+    parser.add_argument("-c", "--comments", type=int, default=10000, help="confirmation comments per day")
+    parser.add_argument("--mode", choices=["praw", "records"], default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run(args.mode, args.posts, args.comments)))
+        return
+
+    # Each mode in a fresh process so resident sizes do not mix
+    for mode in ("praw", "records"):
+        output = subprocess.run([sys.executable, os.path.abspath(sys.argv[0]), "--mode", mode,
+                                 "-p", str(args.posts), "-c", str(args.comments)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print("{mode:>8}: {items} items, {held_mb:.1f} MB held, {peak_mb:.1f} MB peak (traced), "
+              "{maxrss_mb:.1f} MB max resident".format(**result))
+
+
+if __name__ == "__main__":
+    main()
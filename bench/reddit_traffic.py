@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Traffic generator for bench/fake_reddit.py: trade posts, trade confirmations, heatware comments and mod PMs
+at chosen rates, reporting how far the bot (post_check.py, flair.py, heatware.py) keeps up
+"""
+
+import sys
+import json
+import time
+import heapq
+import random
+import argparse
+import urllib.request
+
+STATES = ("CA", "NY", "TX", "WA", "FL", "IL", "MA", "OR")
+ITEMS = ("GMK Olivia", "Keycaps", "Switches", "Artisan", "60% board", "TKL case", "Cable", "Deskmat")
+WANTS = ("PayPal", "Cash", "Trade", "PayPal, Trade")
+# Titles the post check removes
+INVALID_TITLES = ("[H] {item} [W] {want}", "[US-{state}] {item} for {want}", "WTS {item}")
+
+
+class Traffic:
+    """ Schedules generated items as a heap of due times, each kind arriving as a Poisson process """
+
+    def __init__(self, url, rates, users, invalid_share, confirm_delay, seed=None, dead_share=0.0, reused_share=0.0):
+        self._url = url.rstrip("/")
+        self._rates = rates
+        self._random = random.Random(seed)
+        self._users = ["trader{}".format(number) for number in range(users)]
+        self._invalid_share = invalid_share
+        self._confirm_delay = confirm_delay
+        self._events = []
+        self._sequence = 0
+        self._confirmations = []
+        self._dead_share = dead_share
+        self._reused_share = reused_share
+        self._timestamps = []
+        self.sent = dict.fromkeys(rates, 0)
+        self.config = self.call("GET", "config")
+
+    def call(self, method, name, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request("{}/_fake/{}".format(self._url, name), data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+    def _schedule(self, due, kind, payload=None):
+        self._sequence += 1
+        heapq.heappush(self._events, (due, self._sequence, kind, payload))
+
+    def start(self, now):
+        for kind, per_minute in self._rates.items():
+            if per_minute > 0:
+                self._schedule(now + self._random.expovariate(per_minute / 60), kind)
+
+    def _user(self):
+        return self._random.choice(self._users)
+
+    def _subreddit(self):
+        return self._random.choice(self.config["subreddits"])
+
+    def _thread(self, subreddit, kind):
+        return "t3_" + self.config["threads"][subreddit.lower()][kind]
+
+    def post(self):
+        values = {"state": self._random.choice(STATES), "item": self._random.choice(ITEMS),
+                  "want": self._random.choice(WANTS)}
+        if self._random.random() < self._invalid_share:
+            title = self._random.choice(INVALID_TITLES).format(**values)
+        else:
+            title = "[US-{state}] [H] {item} [W] {want}".format(**values)
+        author = self._user()
+        selftext = "Timestamp: {}\n\nShipped only, prices include shipping.".format(self.timestamp(author))
+        self.call("POST", "submit", {"subreddit": self._subreddit(), "author": author, "title": title,
+                                     "selftext": selftext})
+
+    def timestamp(self, author):
+        """ Album on the server's stub image host, missing for dead_share and another user's for reused_share """
+        draw = self._random.random()
+        others = [url for user, url in self._timestamps[-1000:] if user != author]
+        if draw < self._reused_share and others:
+            return self._random.choice(others)
+        album = "{:07x}".format(self._random.getrandbits(28))
+        if draw < self._reused_share + self._dead_share:
+            return "{}/_fake/timestamp/a/{}".format(self._url, album)
+        url = self._url + self.call("POST", "timestamp", {"id": album})["url"]
+        self._timestamps.append((author, url))
+        return url
+
+    def trade(self, now):
+        subreddit = self._subreddit()
+        author, partner = self._random.sample(self._users, 2)
+        if self._random.random() < self._invalid_share:
+            body = "Traded with {}".format(partner)
+        else:
+            body = "Traded with /u/{}".format(partner)
+        comment = self.call("POST", "comment", {"parent": self._thread(subreddit, "trade"), "author": author,
+                                                "body": body, "track": "trade"})
+        self._confirmations.append((subreddit, comment["id"]))
+        delay = self._random.uniform(0.5, 1.5) * self._confirm_delay
+        self._schedule(now + delay, "confirm", (comment["name"], partner))
+
+    def confirm(self, payload):
+        parent, partner = payload
+        body = "Confirmed" if self._random.random() >= self._invalid_share else "Thanks, smooth trade!"
+        self.call("POST", "comment", {"parent": parent, "author": partner, "body": body, "track": parent})
+
+    def heatware(self):
+        subreddit = self._subreddit()
+        self.call("POST", "comment", {"parent": self._thread(subreddit, "heatware"), "author": self._user(),
+                                      "body": "https://www.heatware.com/u/{}".format(self._random.randint(1, 10 ** 6)),
+                                      "track": "heatware"})
+
+    def message(self):
+        """ Mod PM with a link to an earlier confirmation, as mods send for trades needing review """
+        if not self._confirmations or len(self.config["mods"]) < 2:
+            return
+        subreddit, comment_id = self._random.choice(self._confirmations)
+        thread_id = self.config["threads"][subreddit.lower()]["trade"]
+        link = "https://www.reddit.com/r/{}/comments/{}/_/{}/".format(subreddit, thread_id, comment_id)
+        self.call("POST", "message", {"author": self._random.choice(self.config["mods"][1:]),
+                                      "subject": "Trade confirmation", "body": link})
+
+    def run_due(self, now):
+        """ Send all items due by now, returns the time the next one is due """
+        while self._events and self._events[0][0] <= now:
+            due, _sequence, kind, payload = heapq.heappop(self._events)
+            if kind == "confirm":
+                self.confirm(payload)
+                continue
+            if kind == "trade":
+                self.trade(due)
+            else:
+                getattr(self, kind)()
+            self.sent[kind] += 1
+            self._schedule(due + self._random.expovariate(self._rates[kind] / 60), kind)
+        return self._events[0][0] if self._events else now + 1
+
+
+def summary_lines(stats, elapsed):
+    lines = ["{:>6.0f}s  requests {} ({:.1f}/s), rate limited {}".format(
+        elapsed, stats["requests"]["total"], stats["requests"]["per_s"], stats["requests"]["rate_limited"])]
+    for kind, generated in stats["generated"].items():
+        if not generated:
+            continue
+        latency = stats["latency_s"][kind] or {}
+        lines.append("{:>14}: {:6} generated, {:6} handled ({:4}/min), backlog {:5} (oldest {:6.1f}s), "
+                     "latency p50 {} p95 {}".format(kind, generated, stats["handled"][kind],
+                                                    stats["handled_last_minute"][kind], stats["backlog"][kind],
+                                                    stats["oldest_unhandled_s"][kind], latency.get("p50"),
+                                                    latency.get("p95")))
+    if stats["timestamps"]["requests"] or stats["timestamps"]["reported"]:
+        lines.append("    timestamps: {} hosted, {} checked by the bot, reported {}".format(
+            stats["timestamps"]["hosted"], stats["timestamps"]["requests"], stats["timestamps"]["reported"]))
+    if stats["requests"]["unknown_routes"]:
+        lines.append("  unknown routes: {}".format(stats["requests"]["unknown_routes"]))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate subreddit traffic against bench/fake_reddit.py")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="fake reddit server")
+    parser.add_argument("--posts", type=float, default=2, help="trade posts per minute")
+    parser.add_argument("--trades", type=float, default=2, help="trade confirmations per minute")
+    parser.add_argument("--heatware", type=float, default=0.2, help="heatware comments per minute")
+    parser.add_argument("--messages", type=float, default=0.1, help="mod PMs per minute (needs --mod on the server)")
+    parser.add_argument("--scale", type=float, default=1, help="multiply all rates (e.g. 10 for ten times traffic)")
+    parser.add_argument("--invalid-share", type=float, default=0.1,
+                        help="share of posts/confirmations the bot should reject")
+    parser.add_argument("--confirm-delay", type=float, default=60,
+                        help="mean seconds until the tagged user confirms")
+    parser.add_argument("--dead-timestamp-share", type=float, default=0.0,
+                        help="share of posts with a missing timestamp album (needs timestamp_concurrency)")
+    parser.add_argument("--reused-timestamp-share", type=float, default=0.0,
+                        help="share of posts reusing another user's timestamp album")
+    parser.add_argument("--users", type=int, default=5000, help="number of distinct generated users")
+    parser.add_argument("-d", "--duration", type=float, default=600, help="seconds of traffic")
+    parser.add_argument("--drain", type=float, default=120, help="seconds to wait for the bot after the traffic")
+    parser.add_argument("--report", type=float, default=30, help="seconds between progress reports")
+    parser.add_argument("-o", "--output", default=None, help="json file for the final server statistics")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    rates = {kind: rate * args.scale for kind, rate in (("post", args.posts), ("trade", args.trades),
+                                                        ("heatware", args.heatware), ("message", args.messages))}
+    traffic = Traffic(args.url, rates, args.users, args.invalid_share, args.confirm_delay, args.seed,
+                      args.dead_timestamp_share, args.reused_timestamp_share)
+    print("Subreddits {}, threads {}".format(", ".join(traffic.config["subreddits"]), traffic.config["threads"]))
+
+    start = time.monotonic()
+    traffic.start(start)
+    next_report = start + args.report
+    end = start + args.duration
+    while True:
+        now = time.monotonic()
+        if now >= end + args.drain:
+            break
+        next_due = traffic.run_due(now) if now < end else end + args.drain
+        if now >= next_report:
+            print("\n".join(summary_lines(traffic.call("GET", "stats"), now - start)), flush=True)
+            next_report += args.report
+        time.sleep(max(0.0, min(next_due, next_report, end + args.drain) - time.monotonic()))
+
+    stats = traffic.call("GET", "stats")
+    print("Final:\n" + "\n".join(summary_lines(stats, time.monotonic() - start)))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({"args": vars(args), "sent": traffic.sent, "stats": stats}, output_file, indent=1)
+    sys.exit(1 if any(stats["backlog"].values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+""" Benchmark online user.db migration on a large legacy table while a reader keeps querying it """
+
+import sys
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0]))))
+
+import user_db  # noqa: E402 pylint: disable=wrong-import-position
+from profiling import Histogram  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def build_legacy_db(path, rows):
+    """ Create the pre-group user table (last_created/last_id) with rows users """
+    con = sqlite3.connect(path)
+    con.execute('''CREATE TABLE user (
+username TEXT PRIMARY KEY NOT NULL ,
+flair_text TEXT,
+flair_css_class TEXT,
+last_created timestamp,
+last_id TEXT DEFAULT ''
+)''')
+    con.executemany("INSERT INTO user VALUES (?, '', ?, ?, ?)",
+                    (("user{}".format(i), "i-{}".format(i % 50), "2019-05-{:02d} 12:00:00".format(i % 28 + 1),
+                      "{:06x}".format(i)) for i in range(rows)))
+    con.commit()
+    con.close()
+
+
+def reader(path, rows, stop, latencies):
+    """ Simulate post_check: look up and update random users """
+    con = user_db.connect(path, timeout=60)
+    while not stop.is_set():
+        name = "user{}".format(random.randrange(rows))
+        start = time.perf_counter()
+        con.execute("SELECT * FROM user WHERE username=?", (name,)).fetchone()
+        with con:
+            con.execute("UPDATE user SET flair_text=? WHERE username=?", ("x", name))
+        latencies.observe(time.perf_counter() - start)
+        time.sleep(0.001)
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark user.db migration")
+    parser.add_argument("-n", "--rows", type=int, default=1000000)
+    parser.add_argument("-b", "--batch-size", type=int, default=1000)
+    parser.add_argument("-p", "--pause", type=float, default=0.002)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "user.db")
+        start = time.perf_counter()
+        build_legacy_db(path, args.rows)
+        print("Built {} row legacy table in {:.1f}s".format(args.rows, time.perf_counter() - start))
+
+        stop = threading.Event()
+        latencies = Histogram()
+        reader_thread = threading.Thread(target=reader, args=(path, args.rows, stop, latencies))
+        reader_thread.start()
+
+        con = user_db.connect(path)
+        start = time.perf_counter()
+        version = user_db.migrate(con, args.batch_size, args.pause)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        reader_thread.join()
+
+        print("Migrated to version {} in {:.1f}s ({:.0f} rows/s)".format(version, elapsed, args.rows / elapsed))
+        print("Concurrent reader: {} queries, mean {:.2f}ms, p95 <= {:.1f}ms, max {:.1f}ms".format(
+            latencies.count, latencies.mean * 1000, latencies.percentile(95) * 1000, latencies.max * 1000))
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,10 @@ import re
 
 from configparser import SafeConfigParser
 
-import praw
-from praw.models.reddit import widgets
-import puni
+# praw, puni and praw's widgets are imported where first needed, scripts started by cron
+# that exit early (--help, no new messages) do not pay for them
+from records import CommentRecord, PostRecord
+from request_scheduler import SCHEDULER, setup_scheduler
 
 
 # TODO: Split into one generic helper class and one with mod specific actions
@@ -20,26 +21,60 @@ class SubRedditMod:  # pylint: disable=too-many-public-methods
     _suspended = {}
     _removed = {}
 
-    def __init__(self, logger):
+    def __init__(self, logger, config_path=None, praw_h=None):
+        """
+        config_path defaults to config.cfg next to the running script, other subreddits
+        sharing the process pass their own config_path and the praw_h of the first one
+        """
         self.logger = logger
-        self.config = self._load_config()
+        self.config_path = config_path or self._default_config_path()
+        # Relative paths of additional subreddits are resolved against their config directory
+        self.base_dir = os.path.dirname(os.path.abspath(config_path)) if config_path else None
+        self.config = self._load_config(self.config_path)
         self._sub_config = self.config["subreddit"]
-        self.praw_h = self.login()
+        self.praw_h = praw_h or self.login()
         self.subreddit = self.praw_h.subreddit(self._sub_config["uri"])
-        self.puni_h = puni.UserNotes(self.praw_h, self.subreddit)
+        self._puni_h = None
+        self._username = None
 
     @property
     def subreddit_uri(self):
         return "/r/" + self._sub_config["uri"]
 
+    @property
+    def name(self):
+        """ Lower case subreddit name, matches post.subreddit.display_name.lower() """
+        return self._sub_config["uri"].lower()
+
+    def path(self, filename):
+        """ Path of a subreddit specific file (logs, json config, databases) """
+        if self.base_dir is None or os.path.isabs(filename):
+            return filename
+        return os.path.join(self.base_dir, filename)
+
+    @property
+    def puni_h(self):
+        """ Usernotes, the usernotes wiki page is only fetched when notes are used """
+        if self._puni_h is None:
+            import puni  # pylint: disable=import-outside-toplevel
+            self._puni_h = puni.UserNotes(self.praw_h, self.subreddit)
+        return self._puni_h
+
     @property
     def username(self):
-        return self.config["login"]["username"]
+        """ Bot account, subreddits sharing the login of the first one have no [login] section """
+        if self._username is None:
+            if "login" in self.config and self.config["login"].get("username"):
+                self._username = self.config["login"]["username"]
+            else:
+                self._username = self.praw_h.user.me().name
+        return self._username
 
     def get_usernotes(self, username):
         return self.puni_h.get_notes(username)
 
     def set_usernote(self, user, reason, link='', warning='none'):
+        import puni  # pylint: disable=import-outside-toplevel
         note = puni.Note(user, reason, self._sub_config["uri"], self.username, link, warning)
         self.puni_h.add_note(note)
 
@@ -52,26 +87,49 @@ class SubRedditMod:  # pylint: disable=too-many-public-methods
             title=title, uri=self.subreddit_uri + self._sub_config["wiki"])
 
     @staticmethod
-    def _load_config():
-        """ Load config from config.cfg """
+    def _default_config_path():
         containing_dir = os.path.abspath(os.path.dirname(sys.argv[0]))
-        path_to_cfg = os.path.join(containing_dir, 'config.cfg')
+        return os.path.join(containing_dir, 'config.cfg')
+
+    @staticmethod
+    def _load_config(path_to_cfg):
+        """ Load config from config.cfg """
         config = SafeConfigParser()
         config.read(path_to_cfg)
         return config
 
+    def read_config(self):
+        """ Freshly parsed config_path, not yet used by this instance """
+        return self._load_config(self.config_path)
+
+    def use_config(self, config):
+        """ Switch to a reloaded config, login and subreddit uri changes need a restart """
+        if config["subreddit"]["uri"] != self._sub_config["uri"]:
+            self.logger.warning("Subreddit uri changed in {}, restart to apply".format(self.config_path))
+            config["subreddit"]["uri"] = self._sub_config["uri"]
+        self.config = config
+        self._sub_config = config["subreddit"]
+
     def save_config(self):
-        """ Save config to config.cfg """
-        containing_dir = os.path.abspath(os.path.dirname(sys.argv[0]))
-        path_to_cfg = os.path.join(containing_dir, 'config.cfg')
-        with open(path_to_cfg, "w", encoding="utf-8") as configfile:
+        """ Save config to config.cfg, replaced in one step so running processes never read a partial file """
+        tmp_path = self.config_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as configfile:
             self.config.write(configfile)
+            configfile.flush()
+            os.fsync(configfile.fileno())
+        os.replace(tmp_path, self.config_path)
 
     def login(self):
         """ Login in praw """
+        import praw  # pylint: disable=import-outside-toplevel
         login_info = self.config["login"]
         self.logger.info('Logging in as /u/' + login_info["username"])
-        return praw.Reddit(**login_info)
+        setup_scheduler(self.config)
+        return SCHEDULER.install(praw.Reddit(**login_info))
+
+    def priority(self, priority):
+        """ Requests inside the block are scheduled with priority, fairly shared with other subreddits """
+        return SCHEDULER.priority(priority, self.name)
 
     def get_modmail_link(self, title="modmail", subject=None, content=None):
         """ Get link to modmail """
@@ -84,12 +142,16 @@ class SubRedditMod:  # pylint: disable=too-many-public-methods
         return "[{title}]({link})".format(title=title, link=link)
 
     def get_unread_messages(self):
-        """ Get unread messages (not comment replies) """
-        return [msg for msg in self.praw_h.inbox.unread(limit=100) if not msg.was_comment]
+        """ Get unread messages (not comment replies), all pages, see inbox.InboxStream for handling them """
+        return [msg for msg in self.praw_h.inbox.unread(limit=None) if not msg.was_comment]
 
-    def get_unread_mod_messages(self):
-        """ Get undread messages from mods """
-        return [msg for msg in self.get_unread_messages() if msg.author in self.get_mods()]
+    def get_unread_mod_messages(self, subreddits=None):
+        """
+        Get undread messages from mods (of any of subreddits, default only this one), callers acting on
+        one subreddit still have to check is_mod for it
+        """
+        return [msg for msg in self.get_unread_messages()
+                if msg.author and any(subreddit.is_mod(msg.author.name) for subreddit in (subreddits or [self]))]
 
     def is_removed(self, submission_id):
         """ Returns if the submission with submission_id is removed (by mod or user) """
@@ -111,28 +173,60 @@ class SubRedditMod:  # pylint: disable=too-many-public-methods
         """ Get all comments on a submission with specified link_id """
         return self.get_top_level_comments(link_id).list()
 
+    def submission(self, submission_id):
+        """ Lazy submission, for acting on a record without fetching it """
+        return self.praw_h.submission(id=submission_id)
+
+    def comment(self, comment_id):
+        """ Lazy comment, for acting on a record without fetching it """
+        return self.praw_h.comment(id=comment_id)
+
+    def redditor(self, name):
+        """ Lazy redditor, fetched on first attribute access """
+        return self.praw_h.redditor(name)
+
+    @staticmethod
+    def author_name(item):
+        """ Author name of a praw item or record """
+        if isinstance(item, (CommentRecord, PostRecord)):
+            return item.author_name
+        return item.author.name if item.author is not None else None
+
     def update_comment_user_flair(self, comment, css_class=None, text=None):
-        """ Update the user flair of an author of a comment """
+        """ Update the user flair of an author of a comment (praw comment or record) """
+        author_name = self.author_name(comment)
         if css_class is None:
             css_class = comment.author_flair_css_class
         else:
-            self.logger.info("Set {}'s flair class to {}".format(comment.author.name, css_class))
+            self.logger.info("Set {}'s flair class to {}".format(author_name, css_class))
         if text is None:
             text = comment.author_flair_text
         else:
-            self.logger.info("Set {}'s flair text to {}".format(comment.author.name, text))
-        self.subreddit.flair.set(comment.author, text, css_class)
+            self.logger.info("Set {}'s flair text to {}".format(author_name, text))
+        self.set_user_flair(author_name, text, css_class)
+
+    def set_user_flair(self, username, text, css_class):
+        self.subreddit.flair.set(username, text, css_class)
 
     def get_new(self, limit=20):
         """ Get new posts """
         return self.subreddit.new(limit=limit)
 
+    def get_new_multi(self, subreddits, limit=20):
+        """ Get new posts of several subreddits in one listing request """
+        return self.praw_h.subreddit("+".join(sub.name for sub in subreddits)).new(limit=limit)
+
     @staticmethod
     def _get_replies(item):
         """ Get replies to submission or comment """
-        if isinstance(item, praw.models.reddit.submission.Submission):
+        from praw.models import Comment, Submission  # pylint: disable=import-outside-toplevel
+        if isinstance(item, CommentRecord):
+            comments = item.replies
+        elif isinstance(item, PostRecord):
+            raise TypeError("Post records do not keep comments, pass the submission")
+        elif isinstance(item, Submission):
             comments = item.comments
-        elif isinstance(item, praw.models.reddit.comment.Comment):
+        elif isinstance(item, Comment):
             comments = item.replies
         else:
             raise TypeError("Unknown item type {}".format(type(item)))
@@ -144,6 +238,15 @@ class SubRedditMod:  # pylint: disable=too-many-public-methods
             self._mods = self.subreddit.moderator()
         return self._mods
 
+    def is_mod(self, username):
+        """ Whether username moderates this subreddit """
+        return username is not None and username.lower() in {mod.name.lower() for mod in self.get_mods()}
+
+    def refresh_mods(self):
+        """ Refetch the cached mods, e.g. after a thread rotation """
+        self._mods = None
+        return self.get_mods()
+
     def check_mod_reply(self, item, exclude_mods=None):
         """ Check if mod already has replied """
         comments = self._get_replies(item)
@@ -152,7 +255,7 @@ class SubRedditMod:  # pylint: disable=too-many-public-methods
         if exclude_mods:
             mods -= set(exclude_mods)
         for comment in comments:
-            if comment.author.name in mods:
+            if self.author_name(comment) in mods:
                 return True
         return False
 
@@ -161,7 +264,8 @@ class SubRedditMod:  # pylint: disable=too-many-public-methods
         comments = self._get_replies(item)
 
         for comment in comments:
-            if comment.author == self.username:
+            author_name = self.author_name(comment)
+            if author_name is not None and author_name.lower() == self.username.lower():
                 return comment
         return None
 
@@ -187,6 +291,7 @@ class SubRedditMod:  # pylint: disable=too-many-public-methods
         sidebar.edit(content=new_md)
 
         # New reddit
+        from praw.models.reddit import widgets  # pylint: disable=import-outside-toplevel
         for widget in self.subreddit.widgets.items.values():
             if (isinstance(widget, widgets.ButtonWidget) and
                     widget.shortName == "Links"):
@@ -195,3 +300,21 @@ class SubRedditMod:  # pylint: disable=too-many-public-methods
                     if button.text == post_text:
                         button.url = f"https://redd.it/{post_id}"
                 widget.mod.update(buttons=buttons)
+
+
+def load_subreddits(logger):
+    """
+    SubRedditMod for the subreddit in config.cfg plus one for each directory listed in
+    [multi] subreddits, all sharing one login
+    """
+    primary = SubRedditMod(logger)
+    subreddits = [primary]
+    if "multi" in primary.config:
+        for sub_dir in primary.config["multi"].get("subreddits", "").split(","):
+            sub_dir = sub_dir.strip()
+            if not sub_dir:
+                continue
+            config_path = os.path.join(os.path.dirname(primary.config_path),
+                                       sub_dir, "config.cfg")
+            subreddits.append(SubRedditMod(logger, config_path, primary.praw_h))
+    return subreddits
@@ -0,0 +1,47 @@
+""" Parsing of trade confirmation comments, without side effects so backfills can reuse it """
+
+import re
+
+USER_MENTION = re.compile(r"\/?u(?:ser)?\/([a-zA-Z0-9_-]+)")
+EXPLICIT_LINK = re.compile(r"\[.*\]\(.*\)")
+
+
+def tagged_users(body):
+    """ Lower case users mentioned in a top level comment, None if the mention is an explicit link """
+    if EXPLICIT_LINK.search(body):
+        return None
+    return {user.lower() for user in USER_MENTION.findall(body)}
+
+
+def is_confirmation(body):
+    return "confirmed" in body.lower()
+
+
+def confirmed_trade(comment):
+    """
+    (comment, reply) if top level comment record tags exactly one other user who replied
+    "confirmed", else None. Account age/karma requirements are not checked.
+    """
+    if comment.author_name is None:
+        return None
+    users = tagged_users(comment.body)
+    if not users or len(users) > 1:
+        return None
+    tagged_user = users.pop()
+    if tagged_user == comment.author_name.lower():
+        return None
+    for reply in comment.replies:
+        if reply.author_name is not None and reply.author_name.lower() == tagged_user and \
+                is_confirmation(reply.body):
+            return comment, reply
+    return None
+
+
+def confirmed_trades(submission_id, comments):
+    """ TradeGraph rows (comment_id, reply_id, submission_id, user_a, user_b, created_utc) of a thread """
+    for comment in comments:
+        trade = confirmed_trade(comment)
+        if trade is not None:
+            comment, reply = trade
+            yield (comment.id, reply.id, submission_id, comment.author_name, reply.author_name,
+                   int(reply.created_utc))
@@ -0,0 +1,43 @@
+""" Append-only spool of moderation events, exported into columnar day partitions by util/analytics_export.py """
+
+import json
+import os
+import time
+
+
+class EventSpool:
+    """
+    One json line per event in a file per (UTC) day. Every line is a single append write, so
+    the bot processes share the files without locks and the exporter reads complete lines only.
+    """
+
+    def __init__(self):
+        self._dir = None
+
+    def start(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self._dir = directory
+
+    def record(self, kind, subreddit, author=None, reason=None, created_utc=None):
+        """ Record an event of kind, created_utc of the handled item gives the latency """
+        if self._dir is None:
+            return
+        now = time.time()
+        line = json.dumps({"time": round(now, 3), "kind": kind, "subreddit": subreddit, "author": author,
+                           "reason": reason,
+                           "latency": round(max(0.0, now - created_utc), 3) if created_utc else None})
+        path = os.path.join(self._dir, time.strftime("%Y-%m-%d", time.gmtime(now)) + ".jsonl")
+        spool_fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(spool_fd, (line + "\n").encode("utf-8"))
+        finally:
+            os.close(spool_fd)
+
+
+EVENTS = EventSpool()
+
+
+def setup_events(subreddit):
+    """ Start the spool configured in the [analytics] section of subreddit (the first one of the process) """
+    if "analytics" in subreddit.config and subreddit.config["analytics"].get("spool_dir"):
+        EVENTS.start(subreddit.path(subreddit.config["analytics"]["spool_dir"]))
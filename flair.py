@@ -1,16 +1,34 @@
 #!/usr/bin/env python3
 
 import sys
+import os
 import re
 import argparse
+import time
 from datetime import datetime
 
 from log_conf import LoggerManager
-from common import SubRedditMod
+from common import load_subreddits
+from profiling import PROFILER, add_profile_arguments, setup_profiling
+from metrics import METRICS, setup_metrics
+from events import EVENTS, setup_events
+from records import CommentRecord
+from confirmations import tagged_users, is_confirmation
+from trade_journal import TradeJournal
+from request_scheduler import BULK
+from inbox import InboxStream
+import user_db
+from trade_graph import TradeGraph, SCHEMA_VERSION as TRADE_GRAPH_VERSION
+from flair_snapshot import FlairSnapshot, SCHEMA_VERSION as FLAIR_SNAPSHOT_VERSION
+from profile_cache import ProfileCache, SCHEMA_VERSION as PROFILE_CACHE_VERSION
+from recheck_scheduler import RecheckScheduler, SCHEMA_VERSION as RECHECK_VERSION
+from thread_rotation import ROTATION, register_process, read_archive, lock_thread
 
 # Configure logging
 LOGGER = LoggerManager().getLogger("trade_flair")
 
+COMMENT_LINK = r"^https?:\/\/(?:www\.)?reddit\.com\/r\/([^\/]*)\/comments\/.{6}\/.*\/(.{7})\/$"
+
 
 class TradeFlairer:
     """ Trade flair helper """
@@ -18,94 +36,187 @@ class TradeFlairer:
     def __init__(self, subreddit, logger):
         self._subreddit = subreddit
         self._config = subreddit.config["trade"]
-        self.completed = []
-        self.pending = []
+        # Comment ids of the open submission, pending in the order of its log
+        self.completed = set()
+        self.pending = {}
+        self._pending_removed = False
+        # Logs of the last opened submission, kept in memory as this process writes all changes to them
+        self._loaded_submission = None
         self._trade_count_cache = {}
         self._current_submission = None
+        self._journal = None
+        self._thread_lock = None
         self._logger = logger
+        self._trade_graph = None
+        self._flair_snapshot = None
+        self._profile_cache = None
+        self._rechecks = None
+        self._rotations = ROTATION.count
+        self._user_db_con = user_db.connect(subreddit.path(self._config["user_db"]))
+        db_version = user_db.current_version(self._user_db_con)
+        if db_version >= TRADE_GRAPH_VERSION:
+            self._trade_graph = TradeGraph(self._user_db_con)
+        if db_version >= FLAIR_SNAPSHOT_VERSION:
+            self._flair_snapshot = FlairSnapshot(self._user_db_con)
+        if db_version >= PROFILE_CACHE_VERSION:
+            self._profile_cache = ProfileCache(self._user_db_con,
+                                               float(self._config.get("profile_cache_hours", 6)) * 3600)
+        if db_version >= RECHECK_VERSION:
+            self._rechecks = RecheckScheduler(self._user_db_con)
+        if user_db.pending_migrations(self._user_db_con):
+            logger.warning("Trade graph, flair snapshot, profile cache or rechecks disabled until user db is migrated")
+
+    @property
+    def subreddit(self):
+        return self._subreddit
+
+    def switch_thread(self):
+        """ Reload the thread ids from config.cfg and refetch the mods after a thread rotation """
+        self._subreddit.use_config(self._subreddit.read_config())
+        self._config = self._subreddit.config["trade"]
+        self._subreddit.refresh_mods()
+        self._logger.info("Switched to trade thread {}".format(self._config["link_id"]))
 
     def open_submission(self, submission):
+        if self._rotations != ROTATION.count:
+            # Only between submissions, a submission is processed start to end with the thread ids it was opened with
+            self._rotations = ROTATION.count
+            self.switch_thread()
         if submission == "curr":
             submission = self._config["link_id"]
         elif submission == "prev":
             submission = self._config["prevlink_id"]
+        if self._journal is not None:
+            # Previous submission returned early without close_submission
+            self._journal.close()
+            self._thread_lock.close()
         self._current_submission = submission
+        # Keeps monthly_post.py from archiving the logs while this process writes them
+        self._thread_lock = lock_thread(self._subreddit, submission)
 
         self._logger.info("Opening trade confirmation submission {id}".format(id=submission))
+        if submission != self._loaded_submission:
+            self._load_logs(submission)
+
+        self._journal = TradeJournal(self._subreddit.path(submission + "_journal.log"))
+        for comment_id, intent in list(self._journal.open_intents.items()):
+            self._resume_intent(comment_id, intent)
 
-        with open(submission + "_completed.log", "a+", encoding="utf-8") as completed_file:
+    def _load_logs(self, submission):
+        with open(self._subreddit.path(submission + "_completed.log"), "a+", encoding="utf-8") as completed_file:
             completed_file.seek(0)
-            self.completed = completed_file.read().splitlines()
+            self.completed = set(completed_file.read().splitlines())
 
-        with open(submission + "_pending.log", "a+", encoding="utf-8") as pending_file:
+        with open(self._subreddit.path(submission + "_pending.log"), "a+", encoding="utf-8") as pending_file:
             pending_file.seek(0)
-            self.pending = pending_file.read().splitlines()
+            content = pending_file.read()
+            if content and not content.endswith("\n"):
+                # Older versions wrote the file without a final newline, add_pending appends lines
+                pending_file.write("\n")
+            # Pending entries of trades completed after the last rewrite of the file are dropped
+            logged = content.splitlines()
+            self.pending = dict.fromkeys(comment_id for comment_id in logged if comment_id not in self.completed)
+        self._pending_removed = len(self.pending) != len(logged)
+
+        archived = read_archive(self._subreddit, submission)
+        if archived is not None:
+            # Mod PM for a thread of an earlier month, its logs only hold what was added after archiving
+            self.completed.update(archived["completed"])
+            pending = dict.fromkeys(comment_id for comment_id in archived["pending"]
+                                    if comment_id not in self.completed)
+            pending.update(self.pending)
+            self._pending_removed = self._pending_removed or len(pending) != len(self.pending)
+            self.pending = pending
+        self._loaded_submission = submission
 
     def close_submission(self):
         assert self._current_submission
-        if self.pending:
-            with open(self._current_submission + "_pending.log", "w", encoding="utf-8") as pending_file:
-                pending_file.write("\n".join(self.pending))
+        if self._pending_removed:
+            # Added entries are appended right away, removals need a rewrite
+            with open(self._subreddit.path(self._current_submission + "_pending.log"), "w",
+                      encoding="utf-8") as pending_file:
+                pending_file.write("".join(comment_id + "\n" for comment_id in self.pending))
+            self._pending_removed = False
+        self._journal.close()
+        self._journal = None
+        self._thread_lock.close()
+        self._thread_lock = None
         self._current_submission = None
 
+    def _mark_completed(self, comment_id):
+        self.completed.add(comment_id)
+        with open(self._subreddit.path(self._current_submission + "_completed.log"), "a",
+                  encoding="utf-8") as completed_file:
+            completed_file.write("{id}\n".format(id=comment_id))
+            completed_file.flush()
+            os.fsync(completed_file.fileno())
+        self._journal.commit(comment_id)
+
     def add_completed(self, comment):
         assert self._current_submission
-        self.completed.append(comment.id)
-        with open(self._current_submission + "_completed.log", "a", encoding="utf-8") as completed_file:
-            completed_file.write("{id}\n".format(id=comment.id))
+        self._mark_completed(comment.id)
 
     def add_pending(self, comment):
         assert self._current_submission
-        self.pending.append(comment.id)
+        self.pending[comment.id] = None
+        # Written right away so a crash later in the run does not re-evaluate it
+        with open(self._subreddit.path(self._current_submission + "_pending.log"), "a",
+                  encoding="utf-8") as pending_file:
+            pending_file.write("{id}\n".format(id=comment.id))
 
     def remove_pending(self, comment):
         assert self._current_submission
-        self.pending.remove(comment.id)
+        del self.pending[comment.id]
+        self._pending_removed = True
 
     def get_unhandled_comments(self):
         assert self._current_submission
-        comments = self._subreddit.get_top_level_comments(self._current_submission)
-        handled = self.completed + self.pending
-        unhandled = [comment for comment in comments if comment.id not in handled]
+        with PROFILER.stage("process_post.fetch_comments"):
+            comments = self._subreddit.get_top_level_comments(self._current_submission)
+        # Keep compact records only, the comment forest is dropped on return
+        unhandled = [CommentRecord.from_praw(comment) for comment in comments
+                     if comment.id not in self.completed and comment.id not in self.pending]
+        METRICS.set("queue_depth", len(unhandled))
         self._logger.info("Checking {unhandled} out of {total} comments ({pending} pending)"
                           .format(unhandled=len(unhandled), total=len(comments),
                                   pending=len(self.pending)))
         return unhandled
 
+    def _comment(self, comment):
+        """ Lazy comment to act on, records only hold data """
+        return self._subreddit.comment(comment.id)
+
     def check_top_level_comment(self, comment):
         bot_reply = self._subreddit.check_bot_reply(comment)
 
-        explicit_link = re.search(r"\[.*\]\(.*\)", comment.body)
-        match = re.findall(r"\/?u(?:ser)?\/([a-zA-Z0-9_-]+)", comment.body)
-
-        if explicit_link or not match:
+        users = tagged_users(comment.body)
+        if not users:
             if not bot_reply:
-                comment.reply("Could not find user mention, "
-                              "please edit your comment and make sure the username "
-                              "starts with /u/ (no explicit linking!)")
+                self._comment(comment).reply("Could not find user mention, "
+                                             "please edit your comment and make sure the username "
+                                             "starts with /u/ (no explicit linking!)")
             return None
 
-        match = {user.lower() for user in match}
-        if len(match) > 1:
+        if len(users) > 1:
             if not bot_reply:
-                comment.reply("Found multiple usernames, "
-                              "please only include one user per confirmation comment")
+                self._comment(comment).reply("Found multiple usernames, "
+                                             "please only include one user per confirmation comment")
             return None
 
         if bot_reply:
-            bot_reply.mod.remove()
+            self._comment(bot_reply).mod.remove()
 
-        return match.pop()
+        return users.pop()
 
     def check_reply(self, comment):
         bot_reply = self._subreddit.check_bot_reply(comment)
-        if "confirmed" not in comment.body.lower():
+        if not is_confirmation(comment.body):
             if not bot_reply:
-                comment.reply('Could not find "confirmed" in comment, please edit your comment')
+                self._comment(comment).reply('Could not find "confirmed" in comment, please edit your comment')
             return False
 
         if bot_reply:
-            bot_reply.mod.remove()
+            self._comment(bot_reply).mod.remove()
 
         return True
 
@@ -128,31 +239,75 @@ class TradeFlairer:
                           "as provided with no additions or removals."]
         return "\n\n".join(comment_lines)
 
-    def check_requirements(self, parent, reply):
+    def check_requirements(self, parent, reply, warn=True):
+        """
+        True if both users pass, otherwise the trade is left for review (the review form is only
+        replied if warn is set) and scheduled for a recheck if it can pass the age or karma check later
+        """
+        with PROFILER.stage("check_requirements"):
+            return self._check_requirements(parent, reply, warn)
+
+    def _check_requirements(self, parent, reply, warn):
         for comment in [parent, reply]:
-            if self._subreddit.check_user_suspended(comment.author):
+            profile = self._author_profile(comment.author_name)
+            failed = self._failed_requirement(comment, profile)
+            if failed is not None and profile["cached"]:
+                # Cached profiles only pass users, a failed check is repeated with a fresh profile
+                profile = self._author_profile(comment.author_name, fresh=True)
+                failed = self._failed_requirement(comment, profile)
+
+            if failed == "suspended":
                 return False
             if comment.banned_by:
-                comment.report("Flair: Banned user")
+                if warn:
+                    self._comment(comment).report("Flair: Banned user")
+                return False
+            if failed is not None:
+                if warn:
+                    self._comment(comment).reply(self._get_review_comment(parent, failed))
+                self._schedule_recheck(parent, profile, failed)
                 return False
-
-            karma = comment.author.link_karma + comment.author.comment_karma
-            age = (datetime.utcnow() - datetime.utcfromtimestamp(comment.author.created_utc)).days
-            trade_count = self.get_author_trade_count(comment)
-
-            if trade_count is not None and trade_count < int(self._config["flair_check"]):
-                if age < int(self._config["age_check"]):
-                    comment.reply(self._get_review_comment(parent, "age_warning"))
-                    return False
-                if karma < int(self._config["karma_check"]):
-                    comment.reply(self._get_review_comment(parent, "karma_warning"))
-                    return False
 
         return True
 
+    def _schedule_recheck(self, parent, profile, failed):
+        """ Recheck the trade when the account is old enough, failed karma checks are retried every recheck_hours """
+        if self._rechecks is None:
+            return
+        if failed == "age_warning":
+            due_utc = profile["created_utc"] + int(self._config["age_check"]) * 86400 + 60
+        else:
+            due_utc = time.time() + float(self._config.get("recheck_hours", 24)) * 3600
+        self._rechecks.schedule(parent.id, self._current_submission, due_utc, failed)
+
+    def _author_profile(self, name, fresh=False):
+        """ Account age, karma and suspension of name, from the profile cache if user.db has it """
+        if self._profile_cache is not None:
+            return self._profile_cache.profile(self._subreddit, name, fresh)
+        author = self._subreddit.redditor(name)
+        if self._subreddit.check_user_suspended(author):
+            return {"suspended": True, "cached": False}
+        return {"suspended": False, "created_utc": author.created_utc,
+                "karma": author.link_karma + author.comment_karma, "cached": False}
+
+    def _failed_requirement(self, comment, profile):
+        """ "suspended", the warning type of a failed age or karma check or None if comment's author passes """
+        if profile["suspended"]:
+            return "suspended"
+        trade_count = self.get_author_trade_count(comment)
+        if trade_count is not None and trade_count < int(self._config["flair_check"]):
+            age = (datetime.utcnow() - datetime.utcfromtimestamp(profile["created_utc"])).days
+            if age < int(self._config["age_check"]):
+                return "age_warning"
+            if profile["karma"] < int(self._config["karma_check"]):
+                return "karma_warning"
+        return None
+
     def get_author_trade_count(self, item):
-        if item.author.name in self._trade_count_cache:
-            return self._trade_count_cache[item.author.name]
+        if item.author_name in self._trade_count_cache:
+            return self._trade_count_cache[item.author_name]
+        # The flair of the comment listing is current and costs no request, unlike the snapshot
+        # which lags manual flair changes until the next util/flair_snapshot_sync.py run
         if not item.author_flair_css_class:
             return 0
 
@@ -164,6 +319,11 @@ class TradeFlairer:
         return trade_count
 
     def flair(self, parent, reply, dock_trade=False):
+        with PROFILER.stage("flair"):
+            self._flair(parent, reply, dock_trade)
+
+    def _flair(self, parent, reply, dock_trade):
+        flairs = []
         for comment in parent, reply:
             trade_count = self.get_author_trade_count(comment)
             if trade_count is not None:
@@ -171,124 +331,299 @@ class TradeFlairer:
                     trade_count -= 1
                 else:
                     trade_count += 1
-                new_flair_css_class = "i-{trade_count}".format(trade_count=trade_count)
-                self._subreddit.update_comment_user_flair(comment, css_class=new_flair_css_class)
-                self._trade_count_cache[comment.author.name] = trade_count
-
+                flairs.append((comment.author_name, comment.author_flair_text,
+                               "i-{trade_count}".format(trade_count=trade_count), trade_count))
+        trade = None
         if not dock_trade:
+            trade = (parent.id, reply.id, self._current_submission, parent.author_name, reply.author_name,
+                     int(reply.created_utc))
+        # Target flairs are journaled before changing any, a crash in between is resumed on next open
+        self._journal.intent(parent.id, flairs, trade, None if dock_trade else reply.id)
+        self._apply_intent(parent.id, self._journal.open_intents[parent.id], dock_trade)
+        METRICS.observe_since("confirmation_latency_seconds", reply.created_utc)
+        for user, _text, _css_class, _trade_count in flairs:
+            METRICS.inc("flair_updates_total", direction="dock" if dock_trade else "add")
+            EVENTS.record("user_flair", self._subreddit.name, user, "dock" if dock_trade else "add", reply.created_utc)
+        if dock_trade:
+            self._journal.commit(parent.id)
+
+    def _apply_intent(self, comment_id, intent, dock_trade=False):
+        """ Make the journaled changes of intent that are not logged as done yet """
+        for user, text, css_class, trade_count in intent["flairs"]:
+            if user not in intent["flaired"]:
+                with PROFILER.stage("flair.update"):
+                    self._subreddit.set_user_flair(user, text, css_class)
+                self._journal.flaired(comment_id, user)
+                self._record_flair(user, text, css_class)
+            self._trade_count_cache[user] = trade_count
+
+        if self._trade_graph is not None:
+            if dock_trade:
+                self._trade_graph.remove(comment_id)
+            elif intent["trade"]:
+                self._trade_graph.add(*intent["trade"])
+
+        if intent["reply"] and not intent["replied"]:
             try:
-                reply.reply(self._config["reply"])
+                with PROFILER.stage("flair.reply"):
+                    self._subreddit.comment(intent["reply"]).reply(self._config["reply"])
             except Exception:
                 LOGGER.info("Failed to reply, probably because of too old comment")
+            self._journal.replied(comment_id)
+
+    def _record_flair(self, user, text, css_class):
+        """ Keep user.db and the flair snapshot in line with flair set by the bot """
+        if self._flair_snapshot is None:
+            return
+        with self._user_db_con:
+            self._user_db_con.execute("INSERT INTO user (username, flair_text, flair_css_class) VALUES (?, ?, ?) "
+                                      "ON CONFLICT(username) DO UPDATE SET flair_text=excluded.flair_text, "
+                                      "flair_css_class=excluded.flair_css_class", (user, text, css_class))
+        self._flair_snapshot.record(user, text, css_class)
+
+    def _resume_intent(self, comment_id, intent):
+        """ Finish a flair change interrupted by a crash """
+        self._logger.info("Resuming interrupted flair change of comment {}".format(comment_id))
+        # Docked trades are journaled without a trade row and are not added to the completed log
+        dock_trade = intent["trade"] is None
+        if dock_trade or comment_id not in self.completed:
+            self._apply_intent(comment_id, intent, dock_trade)
+        if not dock_trade and comment_id not in self.completed:
+            self._mark_completed(comment_id)
+        self._journal.commit(comment_id)
+        if comment_id in self.pending:
+            del self.pending[comment_id]
+            self._pending_removed = True
 
     def process_post(self, post):
+        # Trade flair yields the rate limit to moderation actions of other processes
+        with PROFILER.stage("process_post"), self._subreddit.priority(BULK):
+            self._process_post(post)
+
+    def _process_post(self, post):
 
         self.open_submission(post)
 
         for comment in self.get_unhandled_comments():
-            if not hasattr(comment.author, 'name'):
+            if comment.author_name is None:
                 # Deleted comment, ignore comment and move on
                 self.add_completed(comment)
                 continue
 
-            tagged_user = self.check_top_level_comment(comment)
+            with PROFILER.stage("process_post.check_comment"):
+                tagged_user = self.check_top_level_comment(comment)
             if tagged_user is None:
                 continue
 
-            if tagged_user.lower() == comment.author.name.lower():
-                comment.report("Flair: Self-tagging")
+            if tagged_user.lower() == comment.author_name.lower():
+                self._comment(comment).report("Flair: Self-tagging")
 
             for reply in comment.replies:
-                if not hasattr(reply.author, 'name'):
+                if reply.author_name is None:
                     # Deleted comment, ignore comment and move on
                     continue
-                if reply.author.name.lower() == tagged_user.lower():
+                if reply.author_name.lower() == tagged_user.lower():
                     if not self.check_reply(reply):
                         continue
 
                     if self.check_requirements(comment, reply):
                         self.flair(comment, reply)
                         self.add_completed(comment)
+                        METRICS.inc("trades_confirmed_total")
                     else:
                         self.add_pending(comment)
+                        METRICS.inc("trades_pending_total")
+                        EVENTS.record("trade_pending", self._subreddit.name, comment.author_name, None,
+                                      reply.created_utc)
                     break
 
-                reply.report("User not tagged in parent")
+                self._comment(reply).report("User not tagged in parent")
 
         self.close_submission()
 
-    def process_mod_message(self, message):
+    def process_rechecks(self):
+        """ Recheck the pending trades that are due, of the current and the previous trade thread """
+        if self._rechecks is None:
+            return
+        with PROFILER.stage("process_rechecks"), self._subreddit.priority(BULK):
+            self._process_rechecks()
+        METRICS.set("pending_rechecks", len(self._rechecks), subreddit=self._subreddit.name)
+
+    def _process_rechecks(self):
+        now = time.time()
+        by_submission = {}
+        for comment_id, submission_id in self._rechecks.pop_due(now):
+            by_submission.setdefault(submission_id, []).append(comment_id)
+        threads = {self._config["link_id"], self._config.get("prevlink_id")}
+
+        for submission_id, comment_ids in by_submission.items():
+            if submission_id not in threads:
+                # Past the grace period of its thread, left to the mods
+                self._logger.info("Dropping rechecks of closed thread {}: {}".format(submission_id, comment_ids))
+                for comment_id in comment_ids:
+                    self._rechecks.remove(comment_id)
+                continue
+
+            self.open_submission(submission_id)
+            for comment_id in comment_ids:
+                try:
+                    flaired = comment_id in self.pending and self._recheck(comment_id)
+                except Exception as exception:
+                    # Kept scheduled, the next run retries it after the other due trades
+                    self._logger.error("Recheck of {} failed: {}".format(comment_id, exception))
+                    continue
+                due_utc = self._rechecks.due_utc(comment_id)
+                if flaired or due_utc is None or due_utc <= now:
+                    # Completed by a mod, flaired now or failed in a way waiting does not fix
+                    self._rechecks.remove(comment_id)
+            self.close_submission()
+
+    def _recheck(self, comment_id):
+        """ Flair a pending trade if both users pass the requirements now, returns if it was flaired """
+        comment = CommentRecord.from_praw(self._subreddit.comment(comment_id).refresh())
+        users = tagged_users(comment.body or "")
+        if comment.author_name is None or not users or len(users) != 1:
+            # Explicit links (users None) are left to the mods like in process_post
+            return False
+        tagged_user = users.pop().lower()
+        for reply in comment.replies:
+            if reply.author_name is not None and reply.author_name.lower() == tagged_user:
+                if not is_confirmation(reply.body) or not self.check_requirements(comment, reply, warn=False):
+                    return False
+                self.flair(comment, reply)
+                self.add_completed(comment)
+                self.remove_pending(comment)
+                METRICS.inc("trades_confirmed_total")
+                self._logger.info("Flaired pending trade {} on recheck".format(comment_id))
+                return True
+        return False
 
-        pattern = r"^https?:\/\/(?:www\.)?reddit\.com\/r\/.*\/comments\/.{6}\/.*\/(.{7})\/$"
+    def process_mod_message(self, message, flairers=None):
+        """ Handle comment links in a mod PM, flairers maps subreddit names to their TradeFlairer """
 
         reply_lines = []
         for message_line in message.body.splitlines():
             if message_line == "":
                 continue
 
-            comment_link = re.search(pattern, message_line)
+            comment_link = re.search(COMMENT_LINK, message_line)
             if not comment_link:
                 message.reply(f"You have submitted an invalid URL: {message_line}")
                 continue
 
-            comment_id = comment_link.group(1)
-            comment = self._subreddit.praw_h.comment(id=comment_id).refresh()
-
-            # TODO: Restore when stop supporting old confirmation threads
-            # tagged_user = self.check_top_level_comment(comment)
-            # if tagged_user is None:
-            if "u/" not in comment.body.lower():
-                message.reply(f"Could not find user mention (/u/[user]) in submitted comment: {message_line}")
+            link_subreddit = comment_link.group(1).lower()
+            flairer = (flairers or {self._subreddit.name: self}).get(link_subreddit)
+            if flairer is None:
+                reply_lines += [f"Subreddit r/{link_subreddit} is not handled by this bot: {message_line}"]
+                continue
+            if not flairer.subreddit.is_mod(message.author.name):
+                LOGGER.warning("Rejected link to r/{} from {}, not a mod there".format(
+                    link_subreddit, message.author.name))
+                reply_lines += [f"You are not a moderator of r/{link_subreddit}: {message_line}"]
                 continue
+            reply_lines += flairer.process_comment_link(message, message_line, comment_link.group(2))
+
+        return reply_lines
 
-            self.open_submission(comment.submission.id)
+    def process_comment_link(self, message, message_line, comment_id):
+        reply_lines = []
+        comment = CommentRecord.from_praw(self._subreddit.comment(comment_id).refresh())
 
-            if comment_id in self.completed:
-                reply_lines += [f"Trade already completed: {message_line}"]
-                continue
+        # TODO: Restore when stop supporting old confirmation threads
+        # tagged_user = self.check_top_level_comment(comment)
+        # if tagged_user is None:
+        if "u/" not in comment.body.lower():
+            message.reply(f"Could not find user mention (/u/[user]) in submitted comment: {message_line}")
+            return reply_lines
 
-            # if comment_id not in self.pending:
-            #     message.reply(f"Could not find trade in pending trade confirmations: {message_line}")
-            #     continue
+        self.open_submission(comment.submission_id)
 
-            if comment.mod_reports:
-                comment.mod.approve()
-            for reply in comment.replies:
-                # TODO: Restore when stop supporting old confirmation threads
-                # if reply.author.name.lower() == tagged_user.lower():
-                if reply.author.name.lower() in comment.body.lower():
-                    if not self.check_reply(reply):
-                        continue
-                    if reply.mod_reports:
-                        reply.mod.approve()
-                    self.flair(comment, reply)
-                    self.add_completed(comment)
-                    if comment.id in self.pending:
-                        self.remove_pending(comment)
-                    reply_lines += [f"Trade flair added for {comment.author.name} and {reply.author.name}: " +
-                                    f"{message_line}"]
-                    break
-            else:
-                message.reply(f"Could not find confirmation reply on submitted trade: {message_line}")
-            self.close_submission()
-        message.mark_read()
+        if comment_id in self.completed:
+            reply_lines += [f"Trade already completed: {message_line}"]
+            return reply_lines
 
-        return reply_lines
+        # if comment_id not in self.pending:
+        #     message.reply(f"Could not find trade in pending trade confirmations: {message_line}")
+        #     return reply_lines
 
-    def process_mod_messages(self):
+        if comment.mod_reports:
+            self._comment(comment).mod.approve()
+        for reply in comment.replies:
+            # TODO: Restore when stop supporting old confirmation threads
+            # if reply.author_name.lower() == tagged_user.lower():
+            if reply.author_name.lower() in comment.body.lower():
+                if not self.check_reply(reply):
+                    continue
+                if reply.mod_reports:
+                    self._comment(reply).mod.approve()
+                self.flair(comment, reply)
+                self.add_completed(comment)
+                if comment.id in self.pending:
+                    self.remove_pending(comment)
+                if self._rechecks is not None:
+                    self._rechecks.remove(comment.id)
+                reply_lines += [f"Trade flair added for {comment.author_name} and {reply.author_name}: " +
+                                f"{message_line}"]
+                break
+        else:
+            message.reply(f"Could not find confirmation reply on submitted trade: {message_line}")
+        self.close_submission()
 
-        prev_message_author_name = ""
-        reply_lines = []
-        for message in self._subreddit.get_unread_mod_messages():
-            if reply_lines and message.author.name != prev_message_author_name:
-                message.reply("\n\n".join(reply_lines))
+        return reply_lines
+
+    def register_inbox_handler(self, stream, flairers=None, skipped=()):
+        """
+        Handle comment links PMed by mods from the shared inbox stream, flairers maps subreddit
+        names to TradeFlairers. Result lines are sent as one reply per consecutive run of a mod's PMs.
+        PMs linking a subreddit in skipped (configured, but not processed by this run) stay unread.
+        """
+        pending_reply = {"message": None, "lines": []}
+
+        def send_reply():
+            if pending_reply["lines"]:
+                pending_reply["message"].reply("\n\n".join(pending_reply["lines"]))
+            pending_reply["lines"] = []
+
+        def handle(message):
+            if pending_reply["message"] is not None and message.author.name != pending_reply["message"].author.name:
+                send_reply()
             LOGGER.info("Processing PM from mod: " + message.author.name)
-            reply_lines += self.process_mod_message(message)
-            prev_message_author_name = message.author.name
+            pending_reply["lines"] += self.process_mod_message(message, flairers)
+            pending_reply["message"] = message
+
+        skipped = set(skipped)
+
+        def accepts(message):
+            return not linked_subreddits(message.body) & skipped
+
+        # Accepts every mod PM, more specific mod commands have to be registered before it
+        stream.register("trade_confirmation", handle, mods_only=True, finish=send_reply, accepts=accepts)
+
+    def process_mod_messages(self, flairers=None, primary=None, skipped=()):
+        """
+        Process PMs from mods, flairers maps subreddit names to TradeFlairers sharing the inbox.
+        The cursor is kept in the config of primary (the first configured subreddit), PMs about
+        the subreddits in skipped are left unread for a run that processes them.
+        """
+
+        subreddits = [flairer.subreddit for flairer in flairers.values()] if flairers else None
+        stream = open_inbox(primary or self._subreddit, subreddits)
+        self.register_inbox_handler(stream, flairers, skipped)
+        stream.run()
 
-        if reply_lines:
-            # reply_lines can only have content if at least one message
-            message.reply("\n\n".join(reply_lines))  # pylint: disable=undefined-loop-variable
+
+def linked_subreddits(body):
+    """ Lower case names of the subreddits of the comment links in a PM """
+    links = (re.search(COMMENT_LINK, line) for line in body.splitlines())
+    return {link.group(1).lower() for link in links if link}
+
+
+def open_inbox(subreddit, subreddits=None):
+    """ Inbox stream of the bot account with its cursor from the [inbox] section """
+    cursor = "inbox_cursor.json"
+    if "inbox" in subreddit.config:
+        cursor = subreddit.config["inbox"].get("cursor", cursor)
+    return InboxStream(subreddit, subreddit.path(cursor), subreddits)
 
 
 def main():
@@ -298,27 +633,51 @@ def main():
                         help="Which trade post to process (curr, prev or submission id)")
     parser.add_argument("-p", "--pm", dest="pm_only", default=False, action="store_true",
                         help="Only process PMs (from mods)")
+    parser.add_argument("-s", "--subreddit", dest="subreddit", default=None,
+                        help="Only process this subreddit (when several are configured)")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    setup_profiling(args, LOGGER)
 
     try:
         # Setup SubRedditMod
-        subreddit = SubRedditMod(LOGGER)
-
-        # Setup tradeflairer
-        trade_flairer = TradeFlairer(subreddit, LOGGER)
+        configured = load_subreddits(LOGGER)
+        subreddits = configured
+        if args.subreddit:
+            subreddits = [subreddit for subreddit in subreddits if subreddit.name == args.subreddit.lower()]
+            if not subreddits:
+                LOGGER.error("Subreddit {} is not configured".format(args.subreddit))
+                sys.exit(2)
+
+        setup_metrics(subreddits[0].config, "flair", serve_http=False, logger=LOGGER)
+        setup_events(subreddits[0])
+        # Told by monthly_post.py to switch threads if it rotates the trade thread during this run
+        register_process(subreddits[0], "flair")
+
+        # Setup tradeflairers, all subreddits share the bot's inbox
+        flairers = {subreddit.name: TradeFlairer(subreddit, LOGGER) for subreddit in subreddits}
 
         if not args.pm_only:
-            trade_flairer.process_post(args.post)
+            for trade_flairer in flairers.values():
+                trade_flairer.process_post(args.post)
 
-        trade_flairer.process_mod_messages()
+        # The inbox cursor stays with the first configured subreddit, whichever ones this run handles
+        skipped = {subreddit.name for subreddit in configured} - set(flairers)
+        flairers[subreddits[0].name].process_mod_messages(flairers, configured[0], skipped)
+
+        if not args.pm_only:
+            # After the PMs, trades pushed through by mods are not rechecked
+            for trade_flairer in flairers.values():
+                trade_flairer.process_rechecks()
 
     except KeyboardInterrupt:
         print("\nCtrl-C pressed, exiting gracefully")
         sys.exit()
 
     except Exception as exception:
-        LOGGER.error(exception)
-        sys.exit()
+        # Interrupted flair changes are journaled and resumed on the next run
+        LOGGER.exception(exception)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
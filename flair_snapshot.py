@@ -0,0 +1,144 @@
+""" Local copy of the subreddit's user flair in user.db, kept current by checkpointed sweeps """
+
+import time
+
+# Schema version of user.db adding the flair_snapshot tables
+SCHEMA_VERSION = 6
+
+
+def parse_trade_count(css_class):
+    """ Trade count of an i-N flair class, None for other classes (e.g. i-mod) """
+    if not css_class:
+        return 0
+    try:
+        return int(css_class.lstrip("i-"))
+    except ValueError:
+        return None
+
+
+class FlairSnapshot:
+    """
+    Full sweeps page through the subreddit flair list, checkpointing the listing position so an
+    interrupted sweep resumes, and drop users not seen by a completed sweep. Recent sweeps read
+    editflair entries of the mod log since the last one and refetch only those users.
+    """
+
+    def __init__(self, db_con):
+        self._con = db_con
+
+    def get(self, username):
+        return self._con.execute("SELECT * FROM flair_snapshot WHERE username=?", (username,)).fetchone()
+
+    def trade_count(self, username):
+        """ Trade count from the snapshot, None if the user has no (or a non-numeric) flair """
+        row = self.get(username)
+        return parse_trade_count(row["flair_css_class"]) if row is not None else None
+
+    def checkpoint(self, name, default=None):
+        row = self._con.execute("SELECT value FROM flair_sync WHERE name=?", (name,)).fetchone()
+        return row[0] if row is not None else default
+
+    def _set_checkpoint(self, name, value):
+        self._con.execute("INSERT OR REPLACE INTO flair_sync (name, value) VALUES (?, ?)",
+                          (name, None if value is None else str(value)))
+
+    def _upsert(self, rows, seen_utc):
+        self._con.executemany("INSERT INTO flair_snapshot (username, flair_text, flair_css_class, seen_utc) "
+                              "VALUES (?, ?, ?, ?) ON CONFLICT(username) DO UPDATE SET "
+                              "flair_text=excluded.flair_text, flair_css_class=excluded.flair_css_class, "
+                              "seen_utc=excluded.seen_utc",
+                              [(user, text, css_class, seen_utc) for user, text, css_class in rows])
+
+    @staticmethod
+    def _flair_row(flair):
+        return flair["user"].name, flair["flair_text"] or "", flair["flair_css_class"] or ""
+
+    def full_sweep(self, subreddit, progress=None):
+        """
+        Copy the whole flair list of the praw subreddit, resuming an interrupted sweep at its last
+        completed page. Returns the number of users stored.
+        """
+        sweep_start = int(self.checkpoint("full_sweep_start") or time.time())
+        resume_after = self.checkpoint("full_sweep_after")
+        with self._con:
+            self._set_checkpoint("full_sweep_start", sweep_start)
+            if self.checkpoint("modlog_utc") is None:
+                # Changes during the sweep are picked up by the next recent sweep
+                self._set_checkpoint("modlog_utc", sweep_start)
+
+        params = {"after": resume_after} if resume_after else {}
+        listing = subreddit.flair(limit=None, params=params)
+        stored = 0
+        batch = []
+        for flair in listing:
+            if listing.params.get("after") != params.get("after"):
+                # A new page was fetched, batch holds every user listed before its position
+                with self._con:
+                    self._upsert(batch, sweep_start)
+                    self._set_checkpoint("full_sweep_after", params.get("after"))
+                stored += len(batch)
+                batch = []
+                params = dict(listing.params)
+                if progress:
+                    progress(stored)
+            batch.append(self._flair_row(flair))
+
+        with self._con:
+            self._upsert(batch, sweep_start)
+            # Users without flair since the sweep started were not listed
+            self._con.execute("DELETE FROM flair_snapshot WHERE seen_utc < ?", (sweep_start,))
+            self._set_checkpoint("full_sweep_after", None)
+            self._set_checkpoint("full_sweep_start", None)
+            self._set_checkpoint("full_sweep_utc", sweep_start)
+        return stored + len(batch)
+
+    def recent_sweep(self, subreddit, max_entries=None):
+        """ Refetch flair of users with editflair mod log entries since the last sweep, returns their number """
+        since = float(self.checkpoint("modlog_utc") or 0)
+        newest = since
+        users = set()
+        for entry in subreddit.mod.log(action="editflair", limit=max_entries):
+            if entry.created_utc <= since:
+                break
+            newest = max(newest, entry.created_utc)
+            if entry.target_author:
+                users.add(entry.target_author)
+
+        now = int(time.time())
+        for username in users:
+            flairs = list(subreddit.flair(redditor=username))
+            with self._con:
+                if flairs and (flairs[0]["flair_text"] or flairs[0]["flair_css_class"]):
+                    self._upsert([self._flair_row(flairs[0])], now)
+                else:
+                    self._con.execute("DELETE FROM flair_snapshot WHERE username=?", (username,))
+        with self._con:
+            self._set_checkpoint("modlog_utc", newest)
+        return len(users)
+
+    def record(self, username, text, css_class):
+        """ Update a user the bot just flaired, without waiting for the next sweep """
+        with self._con:
+            self._upsert([(username, text or "", css_class or "")], int(time.time()))
+
+    def reconcile(self, flair_dev):
+        """
+        Users whose subreddit flair deviates from user.db: (username, snapshot count, user.db count, reason).
+        Only numeric i-N classes are compared, deviations up to flair_dev trades are accepted.
+        """
+        report = []
+        rows = self._con.execute("SELECT u.username, u.flair_css_class AS db_class, s.flair_css_class AS sub_class "
+                                 "FROM user AS u LEFT JOIN flair_snapshot AS s "
+                                 "ON s.username = u.username COLLATE NOCASE")
+        for row in rows:
+            db_count = parse_trade_count(row["db_class"])
+            if row["sub_class"] is None:
+                if db_count:
+                    report.append((row["username"], None, db_count, "missing"))
+                continue
+            sub_count = parse_trade_count(row["sub_class"])
+            if db_count is None or sub_count is None:
+                continue
+            if abs(sub_count - db_count) > flair_dev:
+                report.append((row["username"], sub_count, db_count, "deviation"))
+        return report
@@ -1,22 +1,28 @@
 #!/usr/bin/env python3
 """ Heatware flair updater """
 
-import re
+import argparse
+
 from log_conf import LoggerManager
-from common import SubRedditMod
+from common import load_subreddits
+from profiling import PROFILER, add_profile_arguments, setup_profiling
+from patterns import compile_and_check, BODY
 
 # Configure logging
 LOGGER = LoggerManager().getLogger("heatware")
 
+# Reddit limits comments to 10000 characters
+MAX_COMMENT_LENGTH = 10000
+
 
-def process_comment(subreddit, cfg, comment):
+def process_comment(subreddit, cfg, regex, comment):
     """ Process a heatware thread comment"""
     LOGGER.debug("Processing comment: " + comment.id)
     if subreddit.check_mod_reply(comment):
         # If a mod has already replied, case closed
         return
 
-    heatware = re.search(cfg["regex"], comment.body)
+    heatware = regex.search(comment.body[:MAX_COMMENT_LENGTH])
     if not heatware:
         # If no match, notify user
         comment.reply("No heatware link found, please double check your link and make a new comment")
@@ -43,19 +49,29 @@ def process_comment(subreddit, cfg, comment):
 def process_thread(subreddit):
     """ Get and process heatware thread comments """
     cfg = subreddit.config["heatware"]
-    comments = subreddit.get_all_comments(cfg["link_id"])
+    regex = compile_and_check({"heatware regex": (cfg["regex"], 0, BODY)}, MAX_COMMENT_LENGTH,
+                              float(cfg.get("regex_budget_ms", 50)) / 1000)["heatware regex"]
+    with PROFILER.stage("process_thread.fetch_comments"):
+        comments = subreddit.get_all_comments(cfg["link_id"])
     for comment in comments:
         if not hasattr(comment, 'author'):
             continue
         if comment.is_root is True:
-            process_comment(subreddit, cfg, comment)
+            with PROFILER.stage("process_comment"):
+                process_comment(subreddit, cfg, regex, comment)
 
 
 def main():
     """ Main function, tries to parse thread and adjust flairs """
+    parser = argparse.ArgumentParser(description="Process heatware thread")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    setup_profiling(args, LOGGER)
+
     try:
-        subreddit = SubRedditMod(LOGGER)
-        process_thread(subreddit)
+        for subreddit in load_subreddits(LOGGER):
+            if "heatware" in subreddit.config:
+                process_thread(subreddit)
     except Exception as exc:
         LOGGER.error(exc)
 
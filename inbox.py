@@ -0,0 +1,112 @@
+""" One consumer of the bot's unread private messages, dispatching them to registered handlers """
+
+import json
+import os
+import time
+
+# Fullnames sent per read_message request
+MARK_READ_BATCH = 25
+
+
+class InboxCursor:
+    """
+    Fullnames of messages already handled but maybe not yet marked read, persisted so a run
+    interrupted before marking them read does not handle them again
+    """
+
+    def __init__(self, path, keep_days=30):
+        self._path = path
+        self._keep_seconds = keep_days * 86400
+        self.handled = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as cursor_file:
+                self.handled = json.load(cursor_file).get("handled", {})
+
+    def save(self):
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cursor_file:
+            json.dump({"handled": self.handled}, cursor_file)
+        os.replace(tmp_path, self._path)
+
+    def add(self, fullname, created_utc):
+        self.handled[fullname] = created_utc
+        self.save()
+
+    def marked_read(self, fullnames):
+        """ Forget marked messages (they leave the unread listing) and entries older than keep_days """
+        cutoff = time.time() - self._keep_seconds
+        self.handled = {fullname: created_utc for fullname, created_utc in self.handled.items()
+                        if fullname not in fullnames and created_utc >= cutoff}
+        self.save()
+
+
+class InboxStream:
+    """
+    Pages through all unread messages (not comment replies), oldest first, and hands each one
+    to the first registered handler accepting it. Mod-only handlers see messages from mods of
+    any of the given subreddits, handlers acting on one subreddit check is_from_mod for it.
+    Handled messages are marked read in batches, others stay unread.
+    """
+
+    def __init__(self, subreddit, cursor_path, subreddits=None):
+        self._subreddit = subreddit
+        self._subreddits = subreddits or [subreddit]
+        self._cursor = InboxCursor(cursor_path)
+        self._handlers = []
+
+    def register(self, name, handler, mods_only=True, accepts=None, finish=None):
+        """
+        Register handler(message) for messages accepts(message) returns true for (default all),
+        finish() is called once after each run (e.g. to send collected replies)
+        """
+        self._handlers.append({"name": name, "handler": handler, "mods_only": mods_only,
+                               "accepts": accepts, "finish": finish})
+
+    def is_from_mod(self, message, subreddit=None):
+        """ Whether message is from a mod of subreddit (default any of the stream's subreddits) """
+        if message.author is None:
+            return False
+        return any(sub.is_mod(message.author.name) for sub in ([subreddit] if subreddit else self._subreddits))
+
+    def unread(self):
+        """ All unread private messages not handled yet, paging past the 100 item listing limit """
+        messages = [message for message in self._subreddit.praw_h.inbox.unread(limit=None)
+                    if not message.was_comment and message.fullname not in self._cursor.handled]
+        return sorted(messages, key=lambda message: message.created_utc)
+
+    def _handler_for(self, message):
+        for entry in self._handlers:
+            if entry["mods_only"] and not self.is_from_mod(message):
+                continue
+            if entry["accepts"] is None or entry["accepts"](message):
+                return entry
+        return None
+
+    def _mark_read(self, fullnames):
+        """ Mark messages read by fullname, 25 per request """
+        fullnames = sorted(fullnames)
+        for start in range(0, len(fullnames), MARK_READ_BATCH):
+            batch = fullnames[start:start + MARK_READ_BATCH]
+            self._subreddit.praw_h.post("api/read_message/", data={"id": ",".join(batch)})
+            self._cursor.marked_read(set(batch))
+
+    def run(self):
+        """ Handle all unread messages, returns the number handled """
+        handled = 0
+        try:
+            for message in self.unread():
+                entry = self._handler_for(message)
+                if entry is None:
+                    continue
+                self._subreddit.logger.info("Inbox: {} handles message {} from {}".format(
+                    entry["name"], message.fullname, message.author.name if message.author else "[deleted]"))
+                entry["handler"](message)
+                self._cursor.add(message.fullname, message.created_utc)
+                handled += 1
+        finally:
+            for entry in self._handlers:
+                if entry["finish"] is not None:
+                    entry["finish"]()
+            # Includes messages handled by an earlier, interrupted run
+            self._mark_read(self._cursor.handled)
+        return handled
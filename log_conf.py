@@ -1,21 +1,62 @@
 import sys
 import os
+import importlib.util
 from configparser import SafeConfigParser
 import logging
 
-# load config file
+# config file, read when the first LoggerManager is created
 containing_dir = os.path.abspath(os.path.dirname(sys.argv[0]))
-cfg_file = SafeConfigParser()
 path_to_cfg = os.path.join(containing_dir, 'config.cfg')
-cfg_file.read(path_to_cfg)
-SENTRY = cfg_file.get('logging', 'sentry')
 
 
-try:
-    import sentry_sdk
-except ImportError:
-    # sentry_sdk not installed, skip sentry even though config exists
-    SENTRY = ""
+def _sentry_dsn():
+    cfg_file = SafeConfigParser()
+    cfg_file.read(path_to_cfg)
+    return cfg_file.get('logging', 'sentry')
+
+
+class _LazySentry:
+    """
+    Imports and initializes sentry_sdk on the first error, so scripts that run without errors
+    (most cron runs) do not pay for it
+    """
+
+    def __init__(self, dsn):
+        self._dsn = dsn
+        self._sdk = None
+
+    def sdk(self):
+        if self._sdk is None:
+            # pylint: disable=import-outside-toplevel
+            import sentry_sdk
+            from sentry_sdk.integrations.logging import LoggingIntegration
+            # Error records are sent by _SentryHandler, including those logged before the init
+            sentry_sdk.init(self._dsn, integrations=[LoggingIntegration(level=None, event_level=None)])
+            self._sdk = sentry_sdk
+        return self._sdk
+
+    def install_excepthook(self):
+        previous_hook = sys.excepthook
+
+        def excepthook(exc_type, exc_value, exc_traceback):
+            sdk = self.sdk()
+            sdk.capture_exception((exc_type, exc_value, exc_traceback))
+            sdk.flush()
+            previous_hook(exc_type, exc_value, exc_traceback)
+        sys.excepthook = excepthook
+
+
+class _SentryHandler(logging.Handler):
+    def __init__(self, sentry):
+        super().__init__(logging.ERROR)
+        self._sentry = sentry
+
+    def emit(self, record):
+        sdk = self._sentry.sdk()
+        if record.exc_info:
+            sdk.capture_exception(record.exc_info)
+        else:
+            sdk.capture_message(record.getMessage(), level="error")
 
 
 class Singleton(type):
@@ -30,10 +71,14 @@ class Singleton(type):
 
 class LoggerManager(metaclass=Singleton):  # pylint: disable=too-few-public-methods
     _loggers = {}
+    _sentry = None
 
     def __init__(self, *_args, **kwargs):
-        if SENTRY and "disable_sentry" not in kwargs:
-            sentry_sdk.init(SENTRY)
+        dsn = _sentry_dsn()
+        # sentry_sdk not installed, skip sentry even though config exists
+        if dsn and "disable_sentry" not in kwargs and importlib.util.find_spec("sentry_sdk") is not None:
+            LoggerManager._sentry = _LazySentry(dsn)
+            LoggerManager._sentry.install_excepthook()
 
     @staticmethod
     def getLogger(name=None):  # pylint: disable=invalid-name
@@ -43,6 +88,8 @@ class LoggerManager(metaclass=Singleton):  # pylint: disable=too-few-public-meth
         fileh = logging.FileHandler('actions.log')
         fileh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(module)s - %(message)s'))
         LoggerManager._loggers[name].addHandler(fileh)
+        if LoggerManager._sentry is not None:
+            LoggerManager._loggers[name].addHandler(_SentryHandler(LoggerManager._sentry))
 
         requests_log = logging.getLogger("requests")
         requests_log.setLevel(logging.WARNING)
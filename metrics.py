@@ -0,0 +1,137 @@
+""" Moderation metrics, exported as a Prometheus text file and/or local HTTP endpoint """
+
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
+
+from profiling import Histogram
+
+# Moderation latencies range from seconds to (when the bot is down) days
+LATENCY_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1800, 3600, 3 * 3600, 12 * 3600, 86400, 7 * 86400)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace('"', '\\"')) for name, value in pairs) + "}"
+
+
+class Metrics:
+    """ Thread safe registry of counters, gauges and latency histograms """
+
+    def __init__(self, prefix="redditswapbot"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+        self._server = None
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, _label_key(labels))] += value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(LATENCY_BUCKETS)
+            self._histograms[key].observe(value)
+
+    def observe_since(self, name, created_utc, **labels):
+        """ Observe the time elapsed since the unix timestamp created_utc """
+        self.observe(name, max(0.0, time.time() - created_utc), **labels)
+
+    def render(self):
+        """ Render all metrics in the Prometheus text exposition format """
+        lines = []
+        with self._lock:
+            for (name, key), value in sorted(self._counters.items()):
+                lines.append("{}_{}{} {}".format(self.prefix, name, _format_labels(key), value))
+            for (name, key), value in sorted(self._gauges.items()):
+                lines.append("{}_{}{} {}".format(self.prefix, name, _format_labels(key), value))
+            for (name, key), hist in sorted(self._histograms.items()):
+                full_name = "{}_{}".format(self.prefix, name)
+                cumulative = 0
+                for bucket, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append("{}_bucket{} {}".format(full_name, _format_labels(key, [("le", bucket)]), cumulative))
+                lines.append("{}_bucket{} {}".format(full_name, _format_labels(key, [("le", "+Inf")]), hist.count))
+                lines.append("{}_sum{} {}".format(full_name, _format_labels(key), hist.total))
+                lines.append("{}_count{} {}".format(full_name, _format_labels(key), hist.count))
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """ Atomically write the rendered metrics to path """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(tmp_path, path)
+
+    def start_file_writer(self, path, interval=60, logger=None):
+        """ Write metrics to path every interval seconds and at exit, failed writes are logged and retried """
+        def write():
+            try:
+                self.write_file(path)
+            except Exception as exception:
+                # Disk full or permissions, the writer thread tries again next interval
+                if logger:
+                    logger.error("Could not write metrics to {}: {}".format(path, exception))
+
+        def writer():
+            while True:
+                time.sleep(interval)
+                write()
+
+        threading.Thread(target=writer, name="metrics-writer", daemon=True).start()
+        atexit.register(write)
+
+    def serve(self, port, host="127.0.0.1"):
+        """ Serve metrics over HTTP on host:port from a daemon thread """
+        # http.server (and ssl through it) is only imported by processes serving metrics
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # pylint: disable=import-outside-toplevel
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_args):  # pylint: disable=arguments-differ
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+
+
+METRICS = Metrics()
+
+
+def setup_metrics(config, name, serve_http=True, logger=None):
+    """
+    Start metric exports configured in the [metrics] section, name is the running script.
+    Short lived (cron) scripts should pass serve_http=False and rely on the metrics file.
+    """
+    if "metrics" not in config:
+        return
+    metrics_config = config["metrics"]
+    if metrics_config.get("file"):
+        METRICS.start_file_writer(metrics_config["file"].format(name=name),
+                                  int(metrics_config.get("interval", 60)), logger)
+    if serve_http and metrics_config.get("port"):
+        METRICS.serve(int(metrics_config["port"]), metrics_config.get("host", "127.0.0.1"))
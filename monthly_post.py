@@ -6,6 +6,8 @@ import time
 
 from log_conf import LoggerManager
 from common import SubRedditMod
+from profiling import PROFILER, add_profile_arguments, setup_profiling
+from thread_rotation import rotate_trade_thread
 
 # Configure logging
 LOGGER = LoggerManager().getLogger("monthly_post")
@@ -62,7 +64,9 @@ def main():
     parser.add_argument("-s", "--sidebar-only",
                         action="store_true",
                         help="Only update sidebar")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    setup_profiling(args, LOGGER)
 
     # Setup SubRedditMod
     subreddit = SubRedditMod(LOGGER)
@@ -71,22 +75,28 @@ def main():
     # Make post
     post_type_config = subreddit.config[args.post_type]
     if not args.sidebar_only:
-        post_id = submit_post(subreddit.subreddit, args.post_type, month)
+        with PROFILER.stage("submit_post"):
+            post_id = submit_post(subreddit.subreddit, args.post_type, month)
     else:
         post_id = post_type_config["link_id"]
 
     # Update sidebar
     sidebar_link = post_type_config["sidebar_link"]
     if "sidebar_link" in post_type_config:
-        subreddit.update_sidebar_link(sidebar_link, post_id)
+        with PROFILER.stage("update_sidebar_link"):
+            subreddit.update_sidebar_link(sidebar_link, post_id)
     elif args.sidebar_only:
         LOGGER.warning("Sidebar only specified, but no sidebar link found")
 
     # Update config
-    if "prevlink_id" in post_type_config:
-        post_type_config["prevlink_id"] = post_type_config["link_id"]
-    post_type_config["link_id"] = post_id
-    subreddit.save_config()
+    if args.post_type == "trade" and not args.sidebar_only:
+        with PROFILER.stage("rotate_trade_thread"):
+            rotate_trade_thread(subreddit, post_id, LOGGER)
+    else:
+        if "prevlink_id" in post_type_config:
+            post_type_config["prevlink_id"] = post_type_config["link_id"]
+        post_type_config["link_id"] = post_id
+        subreddit.save_config()
 
     # Done
     LOGGER.info(f"Posted {args.post_type} thread")
@@ -0,0 +1,96 @@
+""" Compile configured regexes once and reject ones exceeding a time budget on worst-case input """
+
+import json
+import multiprocessing
+import os
+import queue
+import re
+import time
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "regex_corpus.json")
+
+# Reddit limits submission titles to 300 characters
+TITLE_LENGTH = 300
+
+TITLE = "titles"
+BODY = "bodies"
+
+# Characters repeated in generated worst-case inputs, chosen to hit common character classes
+_REPEATED = ("a", "[", " ", "/", "-", "$", "%", ".", "http://")
+
+
+class PatternError(Exception):
+    """ Configured pattern does not compile or is too slow """
+
+
+def load_corpus(kind, max_length, path=CORPUS_FILE):
+    """ Stored worst-case titles or bodies plus generated long repetitive inputs, capped at max_length """
+    corpus = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as corpus_file:
+            corpus += json.load(corpus_file).get(kind, [])
+    for repeated in _REPEATED:
+        corpus.append(repeated * (max_length // len(repeated)))
+        # Nearly matching input forces backtracking before the final failure
+        corpus.append((repeated * (max_length // len(repeated)))[:max_length - 1] + "\x00")
+    return [text[:max_length] for text in corpus]
+
+
+def compile_pattern(name, pattern, flags=0):
+    try:
+        return re.compile(pattern, flags)
+    except re.error as exception:
+        raise PatternError("Pattern {} does not compile: {}".format(name, exception)) from exception
+
+
+def _time_pattern(pattern, flags, corpus, result_queue):
+    regex = re.compile(pattern, flags)
+    slowest = 0.0
+    for text in corpus:
+        start = time.perf_counter()
+        regex.search(text)
+        slowest = max(slowest, time.perf_counter() - start)
+    result_queue.put(slowest)
+
+
+def check_budget(name, regex, corpus, budget):
+    """
+    Run regex over corpus in a child process (catastrophic backtracking can not be interrupted
+    in-process), raise PatternError if one search exceeds budget seconds
+    """
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_time_pattern, args=(regex.pattern, regex.flags, corpus, result_queue),
+                                      daemon=True)
+    process.start()
+    process.join(budget * len(corpus) + 5)
+    if process.is_alive():
+        process.kill()
+        process.join()
+        raise PatternError("Pattern {} did not finish the worst-case corpus, check for catastrophic backtracking"
+                           .format(name))
+    if process.exitcode != 0:
+        raise PatternError("Pattern {} could not be timed, the check exited with code {}"
+                           .format(name, process.exitcode))
+    try:
+        # The child flushes its result before it exits, waiting only covers a slow pipe
+        slowest = result_queue.get(timeout=5)
+    except queue.Empty:
+        raise PatternError("Pattern {} could not be timed, the check returned no result".format(name)) from None
+    if slowest > budget:
+        raise PatternError("Pattern {} took {:.0f}ms on worst-case input, budget is {:.0f}ms"
+                           .format(name, slowest * 1000, budget * 1000))
+    return slowest
+
+
+def compile_and_check(patterns, max_length, budget, corpus_path=CORPUS_FILE):
+    """
+    Compile {name: (pattern, flags, kind)}, kind being TITLE or BODY (capped at max_length),
+    and time them against the matching corpus, returns {name: compiled} or raises PatternError
+    """
+    corpora = {TITLE: load_corpus(TITLE, TITLE_LENGTH, corpus_path),
+               BODY: load_corpus(BODY, max_length, corpus_path)}
+    compiled = {}
+    for name, (pattern, flags, kind) in patterns.items():
+        compiled[name] = compile_pattern(name, pattern, flags)
+        check_budget(name, compiled[name], corpora[kind], budget)
+    return compiled
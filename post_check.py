@@ -2,17 +2,29 @@
 """ New post checker """
 
 import sys
-import re
-import sqlite3
+import atexit
+import argparse
 import unicodedata
-import json
 import os
 import math
+import multiprocessing
 from datetime import datetime
-from time import sleep
+from time import sleep, time
 
 from log_conf import LoggerManager
-from common import SubRedditMod
+from common import load_subreddits
+import user_db
+from repost_index import RepostIndex
+from work_queue import WorkQueue, PENDING, DONE
+from rules import RulesWatcher
+from records import PostRecord
+from request_scheduler import MODERATION
+from profiling import PROFILER, add_profile_arguments, setup_profiling
+from metrics import METRICS, setup_metrics
+from events import EVENTS, setup_events
+from thread_rotation import ROTATION, register_process
+from timestamp_links import (LinkChecker, TimestampLinks, extract_links, OK, UNREACHABLE,
+                             SCHEMA_VERSION as TIMESTAMP_LINKS_VERSION)
 
 
 # configure logging
@@ -22,48 +34,118 @@ LOGGER = LoggerManager().getLogger("post_check")
 class PostChecker:
     """ Post check helper """
 
-    def __init__(self, subreddit, db_con, post_categories, locations):
+    def __init__(self, subreddit, db_con, rules, rules_watcher=None):
         self._subreddit = subreddit
-        self._config = subreddit.config["post_check"]
         self._user_db_con = db_con
         self._user_db_cursor = self._user_db_con.cursor()
-        self._post_categories = post_categories
-        self._locations = locations
+        self._rules = rules
+        self._rules_watcher = rules_watcher
+        self._repost_index = None
+        if rules.config.get("duplicate_threshold"):
+            if user_db.current_version(db_con) >= 4:
+                self._repost_index = RepostIndex(db_con,
+                                                 window_days=int(rules.config.get("duplicate_window_days", 30)))
+            else:
+                LOGGER.warning("Near-duplicate check disabled until user db is migrated")
+        self._timestamp_links = None
+        self._link_checker = None
+        # (post, links, future of the link checks) not reported yet
+        self._timestamp_checks = []
+        if int(rules.config.get("timestamp_concurrency", 0) or 0):
+            if user_db.current_version(db_con) >= TIMESTAMP_LINKS_VERSION:
+                self._timestamp_links = TimestampLinks(db_con,
+                                                       float(rules.config.get("timestamp_cache_hours", 24)) * 3600)
+                self._link_checker = LinkChecker(int(rules.config["timestamp_concurrency"]),
+                                                 float(rules.config.get("timestamp_timeout", 10)),
+                                                 # Secondary subreddits share the login and have no [login]
+                                                 subreddit.praw_h.config.user_agent)
+            else:
+                LOGGER.warning("Timestamp link check disabled until user db is migrated")
+
+    def reload_rules(self):
+        """
+        Swap in new rules if the watched config changed, called between posts so a post is
+        checked against one version and db connections, caches and indexes are kept
+        """
+        if self._rules_watcher is None:
+            return False
+        with PROFILER.stage("reload_rules"):
+            rules = self._rules_watcher.poll()
+        if rules is None:
+            return False
+        self._rules = rules
+        METRICS.set("rules_loaded_timestamp_seconds", rules.loaded_utc, subreddit=self._subreddit.name)
+        return True
 
     def _get_user_db_entry(self, post):
-        self._user_db_cursor.execute('SELECT * FROM user WHERE username=?', (post.author.name,))
+        self._user_db_cursor.execute('SELECT * FROM user WHERE username=?', (post.author_name,))
         return self._user_db_cursor.fetchone()
 
     def _update_user_db(self, post, fields_to_set):
         fields = ", ".join(field + "=?" for field in fields_to_set)
         self._user_db_cursor.execute('UPDATE OR IGNORE user SET {} WHERE username=?'.format(fields),
-                                     (post.created_utc, post.id, post.author.name))
+                                     (post.created_utc, post.id, post.author_name))
 
     def _add_to_user_db(self, post, fields_to_set):
         fields = ", ".join(("username",) + fields_to_set)
         self._user_db_cursor.execute('INSERT OR IGNORE INTO user ({}) VALUES (?, ?, ?)'.format(fields),
-                                     (post.author.name, post.created_utc, post.id))
+                                     (post.author_name, post.created_utc, post.id))
+
+    def _submission(self, post):
+        """ Lazy submission to act on, the record itself only holds data """
+        return self._subreddit.submission(post.id)
+
+    @staticmethod
+    def _record_action(post, action, reason=None):
+        METRICS.observe_since("moderation_latency_seconds", post.created_utc, action=action)
+        EVENTS.record(action, post.subreddit, post.author_name, reason, post.created_utc)
 
     def _is_personal_post(self, title):
-        return bool(re.search(self._config["trade_post_format"], title))
+        return bool(self._rules.patterns["trade_post_format"].search(title))
 
     def _is_informational_post(self, title):
-        return bool(re.search(self._config["informational_post_format"], title))
+        return bool(self._rules.patterns["informational_post_format"].search(title))
+
+    @staticmethod
+    def _clean_text(text):
+        return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode()
+
+    def check_duplicate(self, post):
+        """ Report post if its text is a near-duplicate of another user's recent submission """
+        with PROFILER.stage("check_duplicate"):
+            matches = self._repost_index.check_and_add(
+                post.id, post.author_name, post.created_utc,
+                self._clean_text(post.title) + "\n" + self._clean_text(post.selftext),
+                float(self._rules.config["duplicate_threshold"]))
+        for score, post_id, author in matches:
+            if author == post.author_name:
+                # Same account reposts are handled by the cooldown
+                LOGGER.info("Submission https://redd.it/{} is similar to own submission https://redd.it/{} ({:.0%})"
+                            .format(post.id, post_id, score))
+                continue
+            LOGGER.info("Submission https://redd.it/{} is a probable duplicate of https://redd.it/{} by {} ({:.0%})"
+                        .format(post.id, post_id, author, score))
+            self._submission(post).report("Probable duplicate of https://redd.it/{} by /u/{} ({:.0%})"
+                                          .format(post_id, author, score))
+            METRICS.inc("duplicates_reported_total")
+            self._record_action(post, "report", "duplicate")
+            break
 
     def save_submission(self, post):
-        user_path = os.path.join(self._config["user_history_dir"], str(post.author))
+        user_path = os.path.join(self._subreddit.path(self._rules.config["user_history_dir"]), post.author_name)
 
         if not os.path.exists(user_path):
             os.makedirs(user_path)
 
         with open(os.path.join(user_path, post.id), "w", encoding="utf-8") as submission_file:
-            submission_file.write(unicodedata.normalize('NFKD', post.title).encode('ascii', 'ignore').decode() + "\n")
-            submission_file.write(unicodedata.normalize('NFKD', post.selftext).encode('ascii', 'ignore').decode())
+            submission_file.write(self._clean_text(post.title) + "\n")
+            submission_file.write(self._clean_text(post.selftext))
 
     def check_and_flair_personal(self, post, clean_title):
         """ Check title of personal post and flair accordingly """
 
-        location, have, want = re.search(self._config["trade_post_format"], clean_title).groups()
+        submission = self._submission(post)
+        location, have, want = self._rules.patterns["trade_post_format"].search(clean_title).groups()
 
         if "-" in location:
             primary, secondary = location.split("-", 1)
@@ -71,55 +153,123 @@ class PostChecker:
             primary = "OTHER"
             secondary = location
 
-        if (primary not in self._locations or
-                secondary not in self._locations[primary]):
+        if (primary not in self._rules.locations or
+                secondary not in self._rules.locations[primary]):
             self.remove_post(post, "location")
             return False
 
-        if self._config["user_history_dir"]:
+        if self._rules.config["user_history_dir"]:
             self.save_submission(post)
 
+        if self._repost_index is not None and self._rules.config.get("duplicate_threshold"):
+            self.check_duplicate(post)
+
         timestamp_check = False
-        post_flair = self._config["default_category"]
-        flairs = self._post_categories["flairs"]
+        post_flair = self._rules.config["default_category"]
+        flairs = self._rules.post_categories["flairs"]
         for flair, flair_prop in flairs.items():
             assert not ("have" in flair_prop and "want" in flair_prop), "Limitation of script"
             if "want" in flair_prop:
-                regex = flair_prop["want"].replace("\\\\", "\\")
-                if re.search(regex, want, re.IGNORECASE):
+                if self._rules.patterns["flairs:{}:want".format(flair)].search(want):
                     post_flair = flair
                     timestamp_check = flair_prop["timestamp_check"]
             if "have" in flair_prop:
-                regex = flair_prop["have"].replace("\\\\", "\\")
-                if re.search(regex, have, re.IGNORECASE):
+                if self._rules.patterns["flairs:{}:have".format(flair)].search(have):
                     post_flair = flair
                     timestamp_check = flair_prop["timestamp_check"]
 
-        post.mod.flair(text=post_flair, css_class=flairs[post_flair]["class"])
+        submission.mod.flair(text=post_flair, css_class=flairs[post_flair]["class"])
+        self._record_action(post, "flair", post_flair)
 
         self.check_repost(post, flairs[post_flair].get("group", "personal"))
 
         if timestamp_check:
-            lines = list(line for line in post.selftext.splitlines() if line)
-            if not re.search(self._config["timestamp_regex"], post.selftext, re.IGNORECASE):
-                post.report("Could not find timestamp.")
-            if not re.search(self._config["timestamp_regex"], " ".join(lines[:3]), re.IGNORECASE):
-                post.reply("Hello, we have updated the rules with a recommendation to include the "
-                           "timestamp at the beginning of the submission and I could not find any "
-                           "timestamp in the beginning of your submission.\n\n"
-                           "(If this is not true, for example if this is a 'Buying' submission, "
-                           "you can ignore this comment)")
+            selftext = post.selftext[:self._rules.max_selftext_scan]
+            lines = list(line for line in selftext.splitlines() if line)
+            if not self._rules.patterns["timestamp_regex"].search(selftext):
+                submission.report("Could not find timestamp.")
+            if not self._rules.patterns["timestamp_regex"].search(" ".join(lines[:3])):
+                submission.reply("Hello, we have updated the rules with a recommendation to include the "
+                                 "timestamp at the beginning of the submission and I could not find any "
+                                 "timestamp in the beginning of your submission.\n\n"
+                                 "(If this is not true, for example if this is a 'Buying' submission, "
+                                 "you can ignore this comment)")
+            if self._link_checker is not None:
+                self.verify_timestamps(post, selftext)
 
         self.post_comment(post)
 
         return True
 
+    def verify_timestamps(self, post, selftext):
+        """
+        Report timestamp links used by another user before and start checking the others in the
+        background, results are reported by report_timestamps
+        """
+        if post.author_name is None:
+            # Deleted account, nobody to compare reuse with
+            return
+        hosts = [host.strip() for host in self._rules.config.get("timestamp_hosts", "").split(",") if host.strip()]
+        links = extract_links(self._rules.patterns["timestamp_regex"], selftext, hosts)
+        if not links:
+            return
+        with PROFILER.stage("verify_timestamps"):
+            for url in links:
+                first_use = self._timestamp_links.record(url, post.author_name, post.id, post.created_utc)
+                if first_use["author"].lower() != post.author_name.lower():
+                    LOGGER.info("Submission https://redd.it/{} reuses timestamp {} of https://redd.it/{} by {}"
+                                .format(post.id, url, first_use["post_id"], first_use["author"]))
+                    self._submission(post).report("Timestamp reused from https://redd.it/{} by /u/{}"
+                                                  .format(first_use["post_id"], first_use["author"]))
+                    METRICS.inc("timestamps_reported_total", reason="reused")
+                    self._record_action(post, "report", "timestamp_reused")
+                    return
+            statuses = {url: self._timestamp_links.cached_status(url) for url in links}
+            unchecked = [url for url, status in statuses.items() if status is None]
+            if unchecked:
+                self._timestamp_checks.append((post, links, self._link_checker.check(unchecked)))
+            else:
+                self._report_unreachable(post, statuses)
+
+    def report_timestamps(self):
+        """ Report posts whose timestamp checks finished without a reachable link, called between posts """
+        if not self._timestamp_checks:
+            return
+        finished, running = [], []
+        for check in self._timestamp_checks:
+            (finished if check[2].done() else running).append(check)
+        # Dropped before handling them, a failing check must not stay in the list and fail every call
+        self._timestamp_checks = running
+        for post, links, future in finished:
+            try:
+                checked = future.result()
+            except Exception as exception:
+                LOGGER.error("Timestamp check of https://redd.it/{} failed: {}".format(post.id, exception))
+                continue
+            for url, status in checked.items():
+                METRICS.inc("timestamp_checks_total", status=status)
+                if status != UNREACHABLE:
+                    # Unreachable hosts may be back soon, only answers of the host are kept
+                    self._timestamp_links.store_status(url, status)
+            self._report_unreachable(post, {url: checked.get(url) or self._timestamp_links.cached_status(url)
+                                            for url in links})
+
+    def _report_unreachable(self, post, statuses):
+        if any(status == OK for status in statuses.values()):
+            return
+        details = ", ".join("{} ({})".format(url, status) for url, status in statuses.items())
+        LOGGER.info("Submission https://redd.it/{} has no reachable timestamp: {}".format(post.id, details))
+        self._submission(post).report("Timestamp not reachable: {}".format(details)[:100])
+        METRICS.inc("timestamps_reported_total", reason="unreachable")
+        self._record_action(post, "report", "timestamp_unreachable")
+
     def check_and_flair_informational(self, post, clean_title):
         """ Check title of informational post and flair accordingly """
 
-        tag = re.search(self._config["informational_post_format"], clean_title).group(1)
+        submission = self._submission(post)
+        tag = self._rules.patterns["informational_post_format"].search(clean_title).group(1)
 
-        for category, category_prop in self._post_categories["flairs"].items():
+        for category, category_prop in self._rules.post_categories["flairs"].items():
             if tag == category_prop.get("tag", None):
                 post_flair = category
                 post_flair_prop = category_prop
@@ -128,7 +278,8 @@ class PostChecker:
             self.remove_post(post, "tag")
             return False
 
-        post.mod.flair(text=post_flair, css_class=post_flair_prop["class"])
+        submission.mod.flair(text=post_flair, css_class=post_flair_prop["class"])
+        self._record_action(post, "flair", post_flair)
 
         if "required_flair" in post_flair_prop:
             if post_flair_prop["required_flair"] != post.author_flair_css_class:
@@ -144,21 +295,34 @@ class PostChecker:
 
     def check_post(self, post):
         """
-        Check post for rule violations
+        Check post (PostRecord or praw submission) for rule violations
         """
 
-        clean_title = unicodedata.normalize('NFKD', post.title).encode('ascii', 'ignore').decode()
-
-        if self._is_personal_post(clean_title):
-            if "trade_post_format_strict" in self._config:
-                if not bool(re.match(self._config["trade_post_format_strict"], clean_title)):
-                    self.remove_post(post, "title")
-                    return
+        if not isinstance(post, PostRecord):
+            post = PostRecord.from_praw(post)
+
+        self.report_timestamps()
+        with PROFILER.stage("check_post"):
+            self._check_post(post)
+        EVENTS.record("post", post.subreddit, post.author_name, None, post.created_utc)
+
+    def _check_post(self, post):
+        with PROFILER.stage("check_post.title_regex"):
+            clean_title = self._clean_text(post.title)
+            is_personal = self._is_personal_post(clean_title)
+            is_informational = not is_personal and self._is_informational_post(clean_title)
+            strict_ok = (not is_personal or "trade_post_format_strict" not in self._rules.patterns or
+                         bool(self._rules.patterns["trade_post_format_strict"].match(clean_title)))
+
+        if is_personal:
+            if not strict_ok:
+                self.remove_post(post, "title")
+                return
 
             if not self.check_and_flair_personal(post, clean_title):
                 return
 
-        elif self._is_informational_post(clean_title):
+        elif is_informational:
             # TODO: Add strict format check (not necessary at the moment)
             if not self.check_and_flair_informational(post, clean_title):
                 return
@@ -172,22 +336,31 @@ class PostChecker:
         Reply and remove post
         """
 
+        submission = self._submission(post)
         # TODO: Implement this in a better way
-        if post.author in self._subreddit.get_mods():
+        if self._subreddit.is_mod(post.author_name):
             # Let mods make posts with arbitrary tags
             return
 
         comment = "REMOVED: Your post was automatically removed due to an incorrect title."
         comment += "\n\nYour **{bad_part}** does not match the format specified in the {rules_link}.".format(
             bad_part=bad_part, rules_link=self._subreddit.get_rules_link())
-        post.reply(comment).mod.distinguish()
-        post.mod.remove()
+        with PROFILER.stage("remove_post.reply"), self._subreddit.priority(MODERATION):
+            submission.reply(comment).mod.distinguish()
+            submission.mod.remove()
+        self._record_action(post, "remove", bad_part)
+        METRICS.inc("removals_total", reason=bad_part)
 
     def post_comment(self, post):
         """
         Post user info comment
         """
 
+        with PROFILER.stage("post_comment"):
+            self._post_comment(post)
+
+    def _post_comment(self, post):
+        submission = self._submission(post)
         try:
             reputation = int(post.author_flair_css_class.lstrip('i-'))
         except AttributeError:
@@ -199,12 +372,14 @@ class PostChecker:
         comment_lines += [f"* Submission time: {datetime.utcfromtimestamp(post.created_utc)} UTC"]
         comment_lines += ["  * [[Click here to see current UTC time]]" +
                           "(https://time.is/UTC)"]
-        comment_lines += [f"* Username: /u/{post.author.name}"]
+        comment_lines += [f"* Username: /u/{post.author_name}"]
         comment_lines += ["  * [[Click here to send a PM to this user]]" +
-                          f"(https://www.reddit.com/message/compose/?to={post.author.name})"]
-        comment_lines += [f"* Join date: {datetime.utcfromtimestamp(post.author.created_utc)}"]
-        comment_lines += [f"* Link karma: {post.author.link_karma}"]
-        comment_lines += [f"* Comment karma: {post.author.comment_karma}"]
+                          f"(https://www.reddit.com/message/compose/?to={post.author_name})"]
+        with PROFILER.stage("post_comment.author_fetch"):
+            author = self._subreddit.redditor(post.author_name)
+            comment_lines += [f"* Join date: {datetime.utcfromtimestamp(author.created_utc)}"]
+            comment_lines += [f"* Link karma: {author.link_karma}"]
+            comment_lines += [f"* Comment karma: {author.comment_karma}"]
         if isinstance(reputation, int):
             comment_lines += [f"* Reputation: {reputation} trade(s)"]
         else:
@@ -221,18 +396,26 @@ class PostChecker:
                           rules=self._subreddit.get_rules_link(), wiki=self._subreddit.get_wiki_link())
         disclaimer = "\n^^" + disclaimer.replace(" ", " ^^")
         comment_lines += [disclaimer]
-        post.reply("\n".join(comment_lines)).mod.distinguish()
+        with PROFILER.stage("post_comment.reply"), self._subreddit.priority(MODERATION):
+            submission.reply("\n".join(comment_lines)).mod.distinguish()
+        self._record_action(post, "comment")
 
     def check_repost(self, post, group):
         """
         Check post for repost rule violations
         """
 
-        cooldown = self._post_categories["groups"][group].get("cooldown", None)
+        with PROFILER.stage("check_repost"):
+            self._check_repost(post, group)
+
+    def _check_repost(self, post, group):
+        submission = self._submission(post)
+        cooldown = self._rules.post_categories["groups"][group].get("cooldown", None)
         if cooldown is None:
             return
 
-        db_row = self._get_user_db_entry(post)
+        with PROFILER.stage("check_repost.sqlite"):
+            db_row = self._get_user_db_entry(post)
         last_created_col = "{}_last_created".format(group)
         last_id_col = "{}_last_id".format(group)
         if db_row is not None:
@@ -242,76 +425,231 @@ class PostChecker:
                 LOGGER.info("Checking post {} for repost violation".format(post.id))
                 post_created = post.created_utc
                 seconds_between_posts = (post_created - last_created)
-                if (seconds_between_posts < int(self._config["lower_min"]) * 60 and
+                if (seconds_between_posts < int(self._rules.config["lower_min"]) * 60 and
                         self._subreddit.is_removed(last_id)):
                     LOGGER.info("Submission https://redd.it/{} not reported because grace period. "
                                 "(Previous submission: https://redd.it/{})".format(post.id, last_id))
                 elif seconds_between_posts < cooldown * 3600:
                     LOGGER.info("Submission https://redd.it/{} removed and flagged for repost violation. "
                                 "(Previous submission: https://redd.it/{})".format(post.id, last_id))
-                    post.mod.remove()
+                    with self._subreddit.priority(MODERATION):
+                        submission.mod.remove()
+                    self._record_action(post, "remove", "repost")
+                    METRICS.inc("removals_total", reason="repost")
                     # Add an extra hour for good measure
                     remaining_hours = math.ceil(cooldown - seconds_between_posts / 3600) + 1
-                    reply = post.reply(("Your submission has automatically been removed violating the " +
-                                        "cooldown period for {group} submissions. " +
-                                        "You will need to wait at least another {hours} hours " +
-                                        "before submitting a new submission.\n\n" +
-                                        "Note that repeated violations of this rule can result in a temporary " +
-                                        "suspension, so please keep track of your submission times in the future.\n\n" +
-                                        "For more information regarding the general posting rules, such as " +
-                                        "cooldowns, please read the {rules}.\n\n" +
-                                        "If you think this removal was made in error, please send a {modmail}.").format(
-                                            group=group, hours=remaining_hours,
-                                            rules=self._subreddit.get_rules_link("rules"),
-                                            modmail=self._subreddit.get_modmail_link()))
+                    message = ("Your submission has automatically been removed violating the " +
+                               "cooldown period for {group} submissions. " +
+                               "You will need to wait at least another {hours} hours " +
+                               "before submitting a new submission.\n\n" +
+                               "Note that repeated violations of this rule can result in a temporary " +
+                               "suspension, so please keep track of your submission times in the future.\n\n" +
+                               "For more information regarding the general posting rules, such as " +
+                               "cooldowns, please read the {rules}.\n\n" +
+                               "If you think this removal was made in error, please send a {modmail}.").format(
+                                   group=group, hours=remaining_hours,
+                                   rules=self._subreddit.get_rules_link("rules"),
+                                   modmail=self._subreddit.get_modmail_link())
+                    with self._subreddit.priority(MODERATION):
+                        reply = submission.reply(message)
                     reply.report("Repost, link to previous post: https://redd.it/{}".format(last_id))
                     return
-            self._update_user_db(post, (last_created_col, last_id_col))
+            with PROFILER.stage("check_repost.sqlite"):
+                self._update_user_db(post, (last_created_col, last_id_col))
         else:
-            self._add_to_user_db(post, (last_created_col, last_id_col))
+            with PROFILER.stage("check_repost.sqlite"):
+                self._add_to_user_db(post, (last_created_col, last_id_col))
 
-        self._user_db_con.commit()
+        with PROFILER.stage("check_repost.sqlite"):
+            self._user_db_con.commit()
 
 
-def main():
-    """ Main function, setups stuff and checks posts"""
+def setup_post_checker(subreddit):
+    """ Load rules (categories, locations, patterns) and user db of subreddit """
+    config = subreddit.config["post_check"]
+    rules_watcher = RulesWatcher(subreddit, LOGGER, int(config.get("rules_check_interval", 10)),
+                                 int(config.get("rules_wiki_interval", 600)))
+    with PROFILER.stage("compile_patterns"):
+        rules = rules_watcher.load()
+
+    user_db_path = subreddit.path(subreddit.config["trade"]["user_db"])
+    db_con = user_db.connect(user_db_path)
+    if user_db.pending_migrations(db_con):
+        LOGGER.warning("User db {} has pending migrations, run util/user_db_convert.py".format(user_db_path))
+    return PostChecker(subreddit, db_con, rules, rules_watcher)
 
+
+def open_queue(subreddit):
+    """ Work queue shared by the fetcher and worker processes """
+    config = subreddit.config["post_check"]
+    return WorkQueue(subreddit.path(config.get("queue_db", "post_queue.db")), int(config.get("lease_seconds", 300)))
+
+
+def setup(metrics_name, serve_http=True, with_checkers=True):
+    """ Setup SubRedditMod and (unless with_checkers is False) a PostChecker for each subreddit """
     try:
-        # Setup SubRedditMod
-        subreddit = SubRedditMod(LOGGER)
-        with open("submission_categories.json", "r", encoding="utf-8") as category_file:
-            post_categories = json.load(category_file)
-        with open("locations.json", "r", encoding="utf-8") as locations_file:
-            locations = json.load(locations_file)
-
-        # Setup PostChecker
-        user_db = subreddit.config["trade"]["user_db"]
-        db_con = sqlite3.connect(user_db)
-        db_con.row_factory = sqlite3.Row
-        post_checker = PostChecker(subreddit, db_con, post_categories, locations)
+        subreddits = load_subreddits(LOGGER)
+        post_checkers = {}
+        if with_checkers:
+            post_checkers = {subreddit.name: setup_post_checker(subreddit) for subreddit in subreddits}
+        setup_metrics(subreddits[0].config, metrics_name, serve_http, LOGGER)
+        setup_events(subreddits[0])
     except Exception as exception:
         LOGGER.error(exception)
         sys.exit()
+    return subreddits, post_checkers
+
+
+def handle_rotation(subreddits, rotations):
+    """
+    Refetch the cached mods if monthly_post.py signalled a thread rotation since rotations, returns
+    the handled count. The rotated config.cfg itself is picked up by the RulesWatcher.
+    """
+    if rotations != ROTATION.count:
+        LOGGER.info("Trade thread rotated, refreshing mods")
+        for subreddit in subreddits:
+            subreddit.refresh_mods()
+    return ROTATION.count
+
+
+def get_new_posts(subreddits):
+    """ New posts of all subreddits, one listing request covers all of them """
+    with PROFILER.stage("get_new"):
+        new_posts = list(subreddits[0].get_new_multi(subreddits, 50 * len(subreddits)))
+    METRICS.set("last_poll_timestamp_seconds", time())
+    return new_posts
+
+
+def run_single(subreddits, post_checkers):
+    """ Fetch and check posts in this process """
+
+    subreddit_by_name = {subreddit.name: subreddit for subreddit in subreddits}
+    register_process(subreddits[0], "post_check")
+    rotations = ROTATION.count
 
     while True:
         try:
             first_pass = True
             processed = []
             while True:
-                new_posts = subreddit.get_new(50)
+                rotations = handle_rotation(subreddits, rotations)
+                new_posts = get_new_posts(subreddits)
+                METRICS.set("queue_depth", sum(1 for post in new_posts if post.id not in processed))
                 for post in new_posts:
+                    subreddit_name = post.subreddit.display_name.lower()
+                    subreddit = subreddit_by_name[subreddit_name]
                     if first_pass and subreddit.check_mod_reply(post, exclude_mods=["AutoModerator"]):
                         processed.append(post.id)
                     if post.id in processed:
                         continue
-                    post_checker.check_post(post)
+                    post_checkers[subreddit_name].reload_rules()
+                    post_checkers[subreddit_name].check_post(PostRecord.from_praw(post))
                     processed.append(post.id)
+                    METRICS.inc("posts_processed_total", subreddit=subreddit_name)
+                for post_checker in post_checkers.values():
+                    post_checker.report_timestamps()
+                first_pass = False
+                LOGGER.debug("Sleeping for 1 minute")
+                sleep(60)
+
+        except KeyboardInterrupt:
+            print("\nCtrl-C pressed, exiting gracefully")
+            sys.exit(0)
+
+        except Exception as exception:
+            LOGGER.error(exception)
+            sleep(60)
+
+
+def _terminate_workers(worker_processes):
+    for process in worker_processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def run_fetcher(subreddits, worker_processes=()):
+    """ Enqueue new posts for worker processes, restarting workers that died """
+
+    subreddit_by_name = {subreddit.name: subreddit for subreddit in subreddits}
+    queue = open_queue(subreddits[0])
+    worker_processes = list(worker_processes)
+    atexit.register(_terminate_workers, worker_processes)
+    register_process(subreddits[0], "post_check")
+    rotations = ROTATION.count
+
+    while True:
+        try:
+            first_pass = True
+            while True:
+                rotations = handle_rotation(subreddits, rotations)
+                for worker_no, process in enumerate(worker_processes):
+                    if not process.is_alive():
+                        LOGGER.error("Worker {} exited with {}, restarting".format(worker_no, process.exitcode))
+                        worker_processes[worker_no] = start_worker(worker_no)
+
+                for post in get_new_posts(subreddits):
+                    if queue.is_known(post.id):
+                        continue
+                    subreddit_name = post.subreddit.display_name.lower()
+                    state = PENDING
+                    if (first_pass and subreddit_by_name[subreddit_name].check_mod_reply(
+                            post, exclude_mods=["AutoModerator"])):
+                        state = DONE
+                    author = post.author.name if post.author else "[deleted]"
+                    queue.enqueue(post.id, subreddit_name, author, post.created_utc, state)
+                METRICS.set("queue_depth", queue.depth())
+                queue.prune(time() - 7 * 86400)
                 first_pass = False
                 LOGGER.debug("Sleeping for 1 minute")
                 sleep(60)
 
         except KeyboardInterrupt:
             print("\nCtrl-C pressed, exiting gracefully")
+            for process in worker_processes:
+                process.terminate()
+            sys.exit(0)
+
+        except Exception as exception:
+            LOGGER.error(exception)
+            sleep(60)
+
+
+def run_worker(worker_no):
+    """ Check posts claimed from the work queue """
+
+    subreddits, post_checkers = setup("post_check_worker{}".format(worker_no), serve_http=False)
+    subreddit_by_name = {subreddit.name: subreddit for subreddit in subreddits}
+    queue = open_queue(subreddits[0])
+    register_process(subreddits[0], "post_check_worker{}".format(worker_no))
+    rotations = ROTATION.count
+
+    while True:
+        try:
+            rotations = handle_rotation(subreddits, rotations)
+            job = queue.claim()
+            if job is None:
+                for post_checker in post_checkers.values():
+                    post_checker.report_timestamps()
+                sleep(5)
+                continue
+            subreddit = subreddit_by_name[job["subreddit"]]
+            try:
+                with queue.keep_leased(job["post_id"]):
+                    if job["attempts"] > 1 and subreddit.check_bot_reply(subreddit.submission(job["post_id"])):
+                        # A worker that crashed or lost its lease already handled the post
+                        LOGGER.info("Worker {} skips {}, already replied".format(worker_no, job["post_id"]))
+                    else:
+                        post = PostRecord.from_praw(subreddit.submission(job["post_id"]))
+                        post_checkers[job["subreddit"]].reload_rules()
+                        post_checkers[job["subreddit"]].check_post(post)
+            except Exception as exception:
+                LOGGER.error("Worker {} failed on {}: {}".format(worker_no, job["post_id"], exception))
+                queue.fail(job["post_id"], exception)
+                continue
+            queue.complete(job["post_id"])
+            METRICS.inc("posts_processed_total", subreddit=job["subreddit"])
+
+        except KeyboardInterrupt:
             sys.exit(0)
 
         except Exception as exception:
@@ -319,5 +657,39 @@ def main():
             sleep(60)
 
 
+def start_worker(worker_no):
+    # Not daemonic, the regex budget check of the rules runs in a child process of the worker,
+    # run_fetcher terminates the workers when it exits
+    process = multiprocessing.Process(target=run_worker, args=(worker_no,),
+                                      name="post_check_worker{}".format(worker_no))
+    process.start()
+    return process
+
+
+def main():
+    """ Main function, setups stuff and checks posts"""
+
+    parser = argparse.ArgumentParser(description="Check new posts")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=0,
+                        help="Fetch posts into the work queue and check them in this many worker processes")
+    parser.add_argument("--fetcher", dest="fetcher", action="store_true",
+                        help="Only fetch posts into the work queue (workers started separately)")
+    parser.add_argument("--worker", dest="worker", type=int, default=None, metavar="N",
+                        help="Run as worker number N checking posts from the work queue")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    setup_profiling(args, LOGGER)
+
+    if args.worker is not None:
+        run_worker(args.worker)
+    elif args.workers or args.fetcher:
+        # Workers set up their own login and db connections after fork
+        worker_processes = [start_worker(worker_no) for worker_no in range(args.workers)]
+        subreddits, _post_checkers = setup("post_check", with_checkers=False)
+        run_fetcher(subreddits, worker_processes)
+    else:
+        run_single(*setup("post_check"))
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,58 @@
+""" Account age, karma and suspension of redditors cached in user.db, shared by all bot processes """
+
+import time
+
+# Schema version of user.db adding the redditor_profile table
+SCHEMA_VERSION = 7
+
+
+class ProfileCache:
+    """
+    Profiles are refetched once older than max_age seconds. Callers refetch a cached profile
+    (fresh=True) before acting on a failed check, so only passing checks rely on cached values.
+    """
+
+    def __init__(self, db_con, max_age=6 * 3600):
+        self._con = db_con
+        self._max_age = max_age
+
+    def get(self, username):
+        """ Cached profile dict, None if missing or expired """
+        row = self._con.execute("SELECT * FROM redditor_profile WHERE username=? AND fetched_utc >= ?",
+                                (username, int(time.time() - self._max_age))).fetchone()
+        if row is None:
+            return None
+        return dict(row, suspended=bool(row["suspended"]), cached=True)
+
+    def fetch(self, subreddit, username):
+        """ Fetch the profile of username through the SubRedditMod subreddit and store it """
+        author = subreddit.redditor(username)
+        profile = {"username": username, "created_utc": None, "karma": None, "suspended": True,
+                   "fetched_utc": int(time.time()), "cached": False}
+        if not subreddit.check_user_suspended(author):
+            profile.update(created_utc=int(author.created_utc), karma=author.link_karma + author.comment_karma,
+                           suspended=False)
+        with self._con:
+            self._con.execute("INSERT OR REPLACE INTO redditor_profile (username, created_utc, karma, suspended, "
+                              "fetched_utc) VALUES (?, ?, ?, ?, ?)",
+                              (username, profile["created_utc"], profile["karma"], int(profile["suspended"]),
+                               profile["fetched_utc"]))
+        return profile
+
+    def profile(self, subreddit, username, fresh=False):
+        """ Cached profile of username, fetched if missing, expired or fresh is set """
+        profile = None if fresh else self.get(username)
+        return profile if profile is not None else self.fetch(subreddit, username)
+
+    def prewarm(self, subreddit, usernames):
+        """ Fetch the profiles of usernames that are not cached, returns the number fetched """
+        fetched = 0
+        for username in usernames:
+            if self.get(username) is None:
+                self.fetch(subreddit, username)
+                fetched += 1
+        return fetched
+
+    def prune(self, older_than_utc):
+        with self._con:
+            self._con.execute("DELETE FROM redditor_profile WHERE fetched_utc < ?", (int(older_than_utc),))
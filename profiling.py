@@ -0,0 +1,133 @@
+""" Opt-in per-stage profiling """
+
+import atexit
+import bisect
+import cProfile
+import contextlib
+import sys
+import time
+from collections import defaultdict
+
+
+class Histogram:
+    """ Bucketed histogram of observed durations (in seconds) """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, pct):
+        """ Upper bound of the bucket containing the pct:th percentile """
+        if not self.count:
+            return 0.0
+        rank = pct / 100 * self.count
+        seen = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bucket
+        return self.max
+
+
+class _Stage:
+    """ Context manager timing one execution of a stage """
+
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class Profiler:
+    """ Times named stages, disabled (and close to free) unless enabled """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = defaultdict(Histogram)
+        self._cprofile = None
+        self._dump_path = None
+        self._logger = None
+
+    def enable(self, dump_path=None, logger=None):
+        """ Start collecting, report (and dump cProfile stats to dump_path) at exit """
+        if self.enabled:
+            return
+        self.enabled = True
+        self._logger = logger
+        if dump_path:
+            self._dump_path = dump_path
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        atexit.register(self.report)
+
+    def stage(self, name):
+        """ Context manager timing the stage called name """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self.stages[name])
+
+    def format_report(self):
+        lines = ["{:<32} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+            "stage", "count", "total(s)", "mean(ms)", "p95(ms)", "max(ms)")]
+        for name, hist in sorted(self.stages.items(), key=lambda item: -item[1].total):
+            lines.append("{:<32} {:>8} {:>10.3f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                name, hist.count, hist.total, hist.mean * 1000,
+                hist.percentile(95) * 1000, hist.max * 1000))
+        return "\n".join(lines)
+
+    def report(self):
+        """ Write stage report, and the cProfile dump if requested """
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._dump_path)
+        report = self.format_report()
+        if self._logger:
+            self._logger.info("Profile report:\n" + report)
+        print(report, file=sys.stderr)
+        if self._dump_path:
+            print("cProfile stats written to {}".format(self._dump_path), file=sys.stderr)
+
+
+PROFILER = Profiler()
+
+
+def add_profile_arguments(parser):
+    """ Add --profile options to an argparse parser """
+    parser.add_argument("--profile", action="store_true",
+                        help="Time processing stages and print a report at exit")
+    parser.add_argument("--profile-dump", metavar="FILE", default=None,
+                        help="Also run cProfile and write pstats to FILE (implies --profile)")
+
+
+def setup_profiling(args, logger=None):
+    """ Enable PROFILER if requested on the command line """
+    if args.profile or args.profile_dump:
+        PROFILER.enable(args.profile_dump, logger)
@@ -0,0 +1,69 @@
+""" Schedule of pending trade confirmations, rechecked once they could pass the age or karma requirement """
+
+import heapq
+import time
+
+# Schema version of user.db adding the pending_recheck table
+SCHEMA_VERSION = 8
+
+
+class RecheckScheduler:
+    """
+    Due times are stored in user.db and kept in a timer heap, so a run only looks at the
+    confirmations that are due. Rescheduled or removed entries stay in the heap until popped
+    and are skipped if their due time no longer matches.
+    """
+
+    def __init__(self, db_con):
+        self._con = db_con
+        self._heap = None
+        self._due = {}
+
+    def _load(self):
+        self._heap = []
+        self._due = {}
+        for row in self._con.execute("SELECT comment_id, submission_id, due_utc FROM pending_recheck"):
+            self._push(row["comment_id"], row["submission_id"], row["due_utc"])
+
+    def _push(self, comment_id, submission_id, due_utc):
+        self._due[comment_id] = due_utc
+        heapq.heappush(self._heap, (due_utc, comment_id, submission_id))
+
+    def schedule(self, comment_id, submission_id, due_utc, reason):
+        """ (Re)schedule a pending confirmation, returns the number of times it was scheduled """
+        due_utc = int(due_utc)
+        with self._con:
+            self._con.execute("INSERT INTO pending_recheck (comment_id, submission_id, due_utc, reason) "
+                              "VALUES (?, ?, ?, ?) ON CONFLICT(comment_id) DO UPDATE SET "
+                              "due_utc=excluded.due_utc, reason=excluded.reason, attempts=attempts + 1",
+                              (comment_id, submission_id, due_utc, reason))
+        if self._heap is not None:
+            self._push(comment_id, submission_id, due_utc)
+        return self._con.execute("SELECT attempts FROM pending_recheck WHERE comment_id=?",
+                                 (comment_id,)).fetchone()[0]
+
+    def remove(self, comment_id):
+        with self._con:
+            self._con.execute("DELETE FROM pending_recheck WHERE comment_id=?", (comment_id,))
+        self._due.pop(comment_id, None)
+
+    def due_utc(self, comment_id):
+        """ Due time of comment_id, None if it is not scheduled """
+        row = self._con.execute("SELECT due_utc FROM pending_recheck WHERE comment_id=?", (comment_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def pop_due(self, now=None):
+        """ (comment_id, submission_id) of the confirmations due by now, earliest first """
+        if self._heap is None:
+            self._load()
+        now = time.time() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_utc, comment_id, submission_id = heapq.heappop(self._heap)
+            if self._due.get(comment_id) == due_utc:
+                del self._due[comment_id]
+                due.append((comment_id, submission_id))
+        return due
+
+    def __len__(self):
+        return self._con.execute("SELECT COUNT(*) FROM pending_recheck").fetchone()[0]
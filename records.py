@@ -0,0 +1,80 @@
+""" Compact records of submissions and comments, extracted once so praw objects can be dropped """
+
+
+def _author_name(item):
+    author = item.author
+    return author.name if author is not None and hasattr(author, "name") else None
+
+
+class PostRecord:
+    """ The submission fields the post checks use """
+
+    __slots__ = ("id", "created_utc", "subreddit", "author_name", "title", "selftext",
+                 "author_flair_css_class", "author_flair_text", "link_flair_css_class", "link_flair_text",
+                 "removed")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_praw(cls, post):
+        return cls(id=post.id,
+                   created_utc=post.created_utc,
+                   subreddit=post.subreddit.display_name.lower(),
+                   author_name=_author_name(post),
+                   title=post.title,
+                   selftext=post.selftext,
+                   author_flair_css_class=post.author_flair_css_class,
+                   author_flair_text=post.author_flair_text,
+                   link_flair_css_class=post.link_flair_css_class,
+                   link_flair_text=post.link_flair_text,
+                   removed=bool(getattr(post, "removed", False)) or post.author is None)
+
+    def __repr__(self):
+        return "PostRecord(id={!r}, author_name={!r})".format(self.id, self.author_name)
+
+
+class CommentRecord:
+    """ The comment fields trade confirmation uses, with replies as records """
+
+    __slots__ = ("id", "created_utc", "link_id", "parent_id", "permalink", "author_name", "body",
+                 "author_flair_css_class", "author_flair_text", "banned_by", "mod_reports", "removed",
+                 "replies")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+        if self.replies is None:
+            self.replies = []
+
+    @property
+    def submission_id(self):
+        return self.link_id.split("_", 1)[-1] if self.link_id else None
+
+    @classmethod
+    def from_praw(cls, comment, reply_depth=2):
+        """
+        Record of comment, including replies reply_depth levels down
+        (default covers confirmation replies and the bot's answers to them)
+        """
+        replies = []
+        if reply_depth > 0:
+            # Skip MoreComments placeholders, those have no body
+            replies = [cls.from_praw(reply, reply_depth - 1) for reply in comment.replies if hasattr(reply, "body")]
+        return cls(id=comment.id,
+                   created_utc=comment.created_utc,
+                   link_id=comment.link_id,
+                   parent_id=comment.parent_id,
+                   permalink=comment.permalink,
+                   author_name=_author_name(comment),
+                   body=comment.body,
+                   author_flair_css_class=comment.author_flair_css_class,
+                   author_flair_text=comment.author_flair_text,
+                   banned_by=comment.banned_by,
+                   mod_reports=list(comment.mod_reports or []),
+                   removed=bool(getattr(comment, "removed", False)),
+                   replies=replies)
+
+    def __repr__(self):
+        return "CommentRecord(id={!r}, author_name={!r})".format(self.id, self.author_name)
@@ -0,0 +1,112 @@
+""" MinHash/LSH index of recent submission texts for near-duplicate detection """
+
+import re
+import zlib
+import time
+import random
+from array import array
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_TOKEN_RE = re.compile(r"[a-z0-9$]+")
+
+
+def shingles(text, size=3):
+    """ Set of hashed word size-grams of text """
+    tokens = _TOKEN_RE.findall(text.lower())
+    if len(tokens) < size:
+        return set()
+    return {zlib.crc32(" ".join(tokens[i:i + size]).encode()) for i in range(len(tokens) - size + 1)}
+
+
+class MinHasher:
+    """ num_perm universal hash permutations, seeded so signatures are stable between runs """
+
+    def __init__(self, num_perm=64, seed=1):
+        rand = random.Random(seed)
+        self.num_perm = num_perm
+        self._perms = [(rand.randrange(1, _MERSENNE_PRIME), rand.randrange(0, _MERSENNE_PRIME))
+                       for _ in range(num_perm)]
+
+    def signature(self, shingle_set):
+        return array("Q", (min(((a * x + b) % _MERSENNE_PRIME) & _MAX_HASH for x in shingle_set)
+                           for a, b in self._perms))
+
+
+def similarity(sig_a, sig_b):
+    """ Estimated Jaccard similarity of two signatures """
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+
+class RepostIndex:
+    """
+    LSH index over submission signatures stored in user.db (tables created by user_db migration 4).
+    Candidates are found through (band, bucket) index lookups instead of comparing every submission.
+    """
+
+    def __init__(self, db_con, bands=16, rows=4, window_days=30, min_shingles=5):
+        self._con = db_con
+        self._hasher = MinHasher(bands * rows)
+        self._bands = bands
+        self._rows = rows
+        self._window = window_days * 86400
+        self._min_shingles = min_shingles
+        self._last_prune = 0
+
+    def _buckets(self, signature):
+        for band in range(self._bands):
+            band_bytes = signature[band * self._rows:(band + 1) * self._rows].tobytes()
+            yield band, zlib.crc32(band_bytes)
+
+    def signature(self, text):
+        shingle_set = shingles(text)
+        if len(shingle_set) < self._min_shingles:
+            return None
+        return self._hasher.signature(shingle_set)
+
+    def query(self, signature, created_utc, threshold=0.7, exclude_id=None):
+        """ Return [(similarity, post_id, author)] of indexed submissions in the window, best first """
+        candidates = set()
+        for band, bucket in self._buckets(signature):
+            rows = self._con.execute("SELECT post_id FROM submission_band WHERE band=? AND bucket=?",
+                                     (band, bucket))
+            candidates.update(row[0] for row in rows)
+        candidates.discard(exclude_id)
+
+        matches = []
+        for post_id in candidates:
+            row = self._con.execute("SELECT author, created_utc, signature FROM submission_signature "
+                                    "WHERE post_id=?", (post_id,)).fetchone()
+            if row is None or row[1] < created_utc - self._window:
+                continue
+            score = similarity(signature, array("Q", row[2]))
+            if score >= threshold:
+                matches.append((score, post_id, row[0]))
+        return sorted(matches, reverse=True)
+
+    def add(self, post_id, author, created_utc, signature):
+        with self._con:
+            self._con.execute("INSERT OR REPLACE INTO submission_signature (post_id, author, created_utc, signature) "
+                              "VALUES (?, ?, ?, ?)", (post_id, author, created_utc, signature.tobytes()))
+            self._con.execute("DELETE FROM submission_band WHERE post_id=?", (post_id,))
+            self._con.executemany("INSERT INTO submission_band (band, bucket, post_id) VALUES (?, ?, ?)",
+                                  ((band, bucket, post_id) for band, bucket in self._buckets(signature)))
+        if time.time() - self._last_prune > 3600:
+            self.prune(time.time() - self._window)
+
+    def prune(self, before_utc):
+        """ Drop submissions created before before_utc """
+        with self._con:
+            self._con.execute("DELETE FROM submission_band WHERE post_id IN "
+                              "(SELECT post_id FROM submission_signature WHERE created_utc < ?)", (before_utc,))
+            self._con.execute("DELETE FROM submission_signature WHERE created_utc < ?", (before_utc,))
+        self._last_prune = time.time()
+
+    def check_and_add(self, post_id, author, created_utc, text, threshold=0.7):
+        """ Index text and return its probable duplicates (see query) """
+        signature = self.signature(text)
+        if signature is None:
+            return []
+        matches = self.query(signature, created_utc, threshold, exclude_id=post_id)
+        self.add(post_id, author, created_utc, signature)
+        return matches
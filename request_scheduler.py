@@ -0,0 +1,180 @@
+""" Priority scheduling of reddit API requests within the shared rate limit """
+
+import contextlib
+import fcntl
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+from metrics import METRICS
+
+# Priority classes, lower goes first
+MODERATION = 0  # removals and distinguished mod replies
+NORMAL = 1  # listings, submission flair, mod PMs
+BULK = 2  # trade flair, backfills and imports
+
+PRIORITY_NAMES = {MODERATION: "moderation", NORMAL: "normal", BULK: "bulk"}
+
+
+class TokenBucket:
+    """
+    Request tokens refilled at the rate reddit reports as left in the current window
+    (x-ratelimit-remaining / x-ratelimit-reset). With state_path the bucket lives in a
+    locked file shared by all processes logged in with the same account.
+    """
+
+    def __init__(self, capacity=30, rate=1.0, state_path=None):
+        self.capacity = capacity
+        self._state_path = state_path
+        self._lock = threading.Lock()
+        self._state = {"tokens": float(capacity), "rate": rate, "updated": time.time()}
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        with self._lock:
+            if self._state_path is None:
+                yield self._state
+                return
+            with open(self._state_path, "a+", encoding="utf-8") as state_file:
+                fcntl.flock(state_file, fcntl.LOCK_EX)
+                state_file.seek(0)
+                content = state_file.read()
+                state = json.loads(content) if content else dict(self._state)
+                yield state
+                state_file.seek(0)
+                state_file.truncate()
+                state_file.write(json.dumps(state))
+
+    def _refill(self, state, now):
+        state["tokens"] = min(self.capacity, state["tokens"] + (now - state["updated"]) * state["rate"])
+        state["updated"] = now
+
+    def try_take(self, reserve=0):
+        """ Take a token if more than reserve are left, returns (taken, seconds until one may be) """
+        with self._locked_state() as state:
+            self._refill(state, time.time())
+            if state["tokens"] >= 1 + reserve:
+                state["tokens"] -= 1
+                return True, 0.0
+            return False, (1 + reserve - state["tokens"]) / max(state["rate"], 1e-3)
+
+    def update_limits(self, remaining, seconds_to_reset):
+        """ Spread the requests reddit has left over the rest of the window """
+        with self._locked_state() as state:
+            self._refill(state, time.time())
+            state["rate"] = max(remaining, 1) / max(seconds_to_reset, 1)
+            state["tokens"] = min(state["tokens"], max(remaining, 0))
+
+
+class _ScheduledRateLimiter:
+    """
+    Stands in for a prawcore session's rate limiter: waits for the scheduler instead of sleeping
+    on its own and feeds the rate limit headers to the bucket. Wraps the original limiter so
+    prawcore is not imported here.
+    """
+
+    def __init__(self, scheduler, rate_limiter):
+        self._scheduler = scheduler
+        self._rate_limiter = rate_limiter
+
+    def __getattr__(self, name):
+        return getattr(self._rate_limiter, name)
+
+    def call(self, request_function, set_header_callback, *args, **kwargs):
+        self._scheduler.acquire()
+        kwargs["headers"] = set_header_callback()
+        response = request_function(*args, **kwargs)
+        self._rate_limiter.update(response.headers)
+        if "x-ratelimit-remaining" in response.headers:
+            self._scheduler.bucket.update_limits(float(response.headers["x-ratelimit-remaining"]),
+                                                 int(response.headers["x-ratelimit-reset"]))
+        return response
+
+
+class RequestScheduler:
+    """
+    Requests wait in one queue ordered by priority class and, within a class, by start-time
+    fair queueing over tasks (e.g. one task per subreddit) so a busy task can not starve others.
+    Lower classes only take a token while more than their reserve is left, keeping tokens
+    for moderation requests of other threads or processes sharing the bucket.
+    """
+
+    def __init__(self, bucket=None, reserve=10):
+        self.bucket = bucket or TokenBucket()
+        self._reserve = {MODERATION: 0, NORMAL: reserve / 2, BULK: reserve}
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._task_tags = {}
+        self._virtual_time = 0
+        self._local = threading.local()
+
+    def configure(self, bucket, reserve):
+        self.bucket = bucket
+        self._reserve = {MODERATION: 0, NORMAL: reserve / 2, BULK: reserve}
+
+    @contextlib.contextmanager
+    def priority(self, priority, task=None):
+        """ Requests made by this thread inside the block use priority and are accounted to task """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        self._local.stack.append((priority, task or threading.current_thread().name))
+        try:
+            yield
+        finally:
+            self._local.stack.pop()
+
+    def current(self):
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else (NORMAL, threading.current_thread().name)
+
+    def acquire(self):
+        """ Block until this thread's request may be sent """
+        priority, task = self.current()
+        start = time.monotonic()
+        with self._cond:
+            tag = max(self._task_tags.get(task, 0) + 1, self._virtual_time)
+            self._task_tags[task] = tag
+            ticket = (priority, tag, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            self._cond.notify_all()
+            while True:
+                if self._waiting[0] == ticket:
+                    taken, wait = self.bucket.try_take(self._reserve[priority])
+                    if taken:
+                        heapq.heappop(self._waiting)
+                        self._virtual_time = tag
+                        self._cond.notify_all()
+                        break
+                    # Other processes may take or a more urgent request may arrive meanwhile
+                    self._cond.wait(min(wait, 1.0))
+                else:
+                    self._cond.wait(1.0)
+        METRICS.observe("request_wait_seconds", time.monotonic() - start, priority=PRIORITY_NAMES[priority])
+
+    def install(self, reddit):
+        """ Route the requests of a praw.Reddit instance through this scheduler """
+        # pylint: disable=protected-access
+        for core in {id(core): core for core in (reddit._core, reddit._authorized_core, reddit._read_only_core)
+                     if core is not None}.values():
+            if not isinstance(core._rate_limiter, _ScheduledRateLimiter):
+                core._rate_limiter = _ScheduledRateLimiter(self, core._rate_limiter)
+        return reddit
+
+
+SCHEDULER = RequestScheduler()
+
+
+def setup_scheduler(config):
+    """ Configure SCHEDULER from the [requests] section (burst, reserve, shared state file) """
+    if "requests" not in config:
+        return
+    requests_config = config["requests"]
+    state_file = requests_config.get("state_file") or None
+    if state_file and not os.path.isabs(state_file):
+        state_file = os.path.abspath(state_file)
+    SCHEDULER.configure(TokenBucket(int(requests_config.get("burst", 30)), state_path=state_file),
+                        int(requests_config.get("reserve", 10)))
@@ -0,0 +1,182 @@
+""" Immutable post check rules (config, categories, locations, compiled patterns) and their hot reload """
+
+import json
+import os
+import re
+import time
+from types import MappingProxyType
+
+from patterns import compile_and_check, PatternError, TITLE, BODY
+
+
+class RulesError(Exception):
+    """ Configuration can not be turned into rules """
+
+
+def freeze(value):
+    """ Read-only copy of parsed json, dicts become mapping proxies and lists tuples """
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class Rules:
+    """
+    Everything a post check reads from configuration, built completely (and validated) before
+    it replaces the previous rules, so a post is always checked against one consistent version
+    """
+
+    __slots__ = ("config", "post_categories", "locations", "patterns", "max_selftext_scan", "loaded_utc")
+
+    def __init__(self, config, post_categories, locations, patterns, max_selftext_scan):
+        for name, value in (("config", config), ("post_categories", post_categories), ("locations", locations),
+                            ("patterns", MappingProxyType(patterns)), ("max_selftext_scan", max_selftext_scan),
+                            ("loaded_utc", time.time())):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Rules are immutable, build new ones")
+
+
+def pattern_specs(config, post_categories):
+    """ Configured patterns as {name: (pattern, flags, kind)} for patterns.compile_and_check """
+    specs = {name: (config[name], 0, TITLE)
+             for name in ("trade_post_format", "trade_post_format_strict", "informational_post_format")
+             if name in config}
+    specs["timestamp_regex"] = (config["timestamp_regex"], re.IGNORECASE, BODY)
+    for flair, flair_prop in post_categories["flairs"].items():
+        for part in ("have", "want"):
+            if part in flair_prop:
+                specs["flairs:{}:{}".format(flair, part)] = (flair_prop[part].replace("\\\\", "\\"),
+                                                             re.IGNORECASE, TITLE)
+    return specs
+
+
+def _validate(config, post_categories, locations):
+    for name in ("trade_post_format", "informational_post_format", "timestamp_regex", "default_category",
+                 "lower_min"):
+        if name not in config:
+            raise RulesError("Missing post_check option {}".format(name))
+    flairs = post_categories.get("flairs")
+    groups = post_categories.get("groups")
+    if not flairs or groups is None:
+        raise RulesError("Categories need flairs and groups")
+    if config["default_category"] not in flairs:
+        raise RulesError("Default category {} is not a flair".format(config["default_category"]))
+    for flair, flair_prop in flairs.items():
+        if "class" not in flair_prop:
+            raise RulesError("Flair {} has no class".format(flair))
+        if "have" in flair_prop and "want" in flair_prop:
+            raise RulesError("Flair {} has both have and want patterns".format(flair))
+        if flair_prop.get("group", "personal") not in groups:
+            raise RulesError("Flair {} uses unknown group {}".format(flair, flair_prop.get("group")))
+    if not isinstance(locations, dict) or not all(isinstance(areas, list) for areas in locations.values()):
+        raise RulesError("Locations must map each primary location to a list of secondary locations")
+
+
+def build_rules(config_section, post_categories, locations):
+    """ Validate and compile [post_check] options and parsed json into Rules, raises RulesError """
+    config = dict(config_section)
+    _validate(config, post_categories, locations)
+    max_selftext_scan = int(config.get("max_selftext_scan", 20000))
+    try:
+        patterns = compile_and_check(pattern_specs(config, post_categories), max_selftext_scan,
+                                     float(config.get("regex_budget_ms", 50)) / 1000)
+    except PatternError as exception:
+        raise RulesError(str(exception)) from exception
+    return Rules(MappingProxyType(config), freeze(post_categories), freeze(locations), patterns,
+                 max_selftext_scan)
+
+
+class RulesWatcher:
+    """
+    Rebuilds the rules of a subreddit when config.cfg, submission_categories.json or locations.json
+    change on disk, or when the wiki pages named by categories_wiki/locations_wiki are revised.
+    Files are checked (stat only) at most every interval seconds, wiki pages every wiki_interval.
+    """
+
+    def __init__(self, subreddit, logger, interval=10, wiki_interval=600):
+        self._subreddit = subreddit
+        self._logger = logger
+        self._interval = interval
+        self._wiki_interval = wiki_interval
+        self._files = {"config": subreddit.config_path,
+                       "categories": subreddit.path("submission_categories.json"),
+                       "locations": subreddit.path("locations.json")}
+        self._signature = None
+        self._next_check = 0
+        self._next_wiki_check = 0
+        self._wiki_revisions = {}
+
+    def _file_signature(self):
+        signature = {}
+        for name, path in self._files.items():
+            try:
+                stat = os.stat(path)
+                signature[name] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signature[name] = None
+        return signature
+
+    def _wiki_page(self, config, name):
+        page_name = config["post_check"].get(name + "_wiki")
+        if not page_name:
+            return None
+        return self._subreddit.subreddit.wiki[page_name]
+
+    def _read_json(self, config, name):
+        page = self._wiki_page(config, name)
+        if page is not None:
+            self._wiki_revisions[name] = page.revision_date
+            return json.loads(page.content_md)
+        with open(self._files[name], "r", encoding="utf-8") as json_file:
+            return json.load(json_file)
+
+    def _wiki_changed(self, config):
+        for name in ("categories", "locations"):
+            page = self._wiki_page(config, name)
+            if page is not None and page.revision_date != self._wiki_revisions.get(name):
+                return True
+        return False
+
+    def load(self):
+        """ Build rules from the current files, raises RulesError (or OSError) """
+        signature = self._file_signature()
+        config = self._subreddit.read_config()
+        try:
+            rules = build_rules(config["post_check"], self._read_json(config, "categories"),
+                                self._read_json(config, "locations"))
+        except (KeyError, ValueError) as exception:
+            raise RulesError("Invalid configuration: {!r}".format(exception)) from exception
+        self._subreddit.use_config(config)
+        self._signature = signature
+        self._next_wiki_check = time.monotonic() + self._wiki_interval
+        return rules
+
+    def poll(self):
+        """ New rules if a source changed since the last load, None if unchanged or invalid """
+        now = time.monotonic()
+        if now < self._next_check:
+            return None
+        self._next_check = now + self._interval
+        changed = self._file_signature() != self._signature
+        if not changed and self._wiki_revisions and now >= self._next_wiki_check:
+            self._next_wiki_check = now + self._wiki_interval
+            try:
+                changed = self._wiki_changed(self._subreddit.config)
+            except Exception as exception:
+                self._logger.warning("Could not check rule wiki pages: {}".format(exception))
+        if not changed:
+            return None
+        try:
+            rules = self.load()
+        except Exception as exception:
+            # Keep the previous rules, but do not retry the same broken files every interval
+            self._signature = self._file_signature()
+            self._logger.error("Rules of {} not reloaded, keeping previous rules: {}"
+                               .format(self._subreddit.name, exception))
+            return None
+        self._logger.info("Reloaded rules of {}".format(self._subreddit.name))
+        return rules
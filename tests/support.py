@@ -0,0 +1,30 @@
+""" Helpers shared by the tests """
+
+import atexit
+import importlib
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+_LOG_DIR = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+atexit.register(_LOG_DIR.cleanup)
+
+
+def import_entry_point(name):
+    """
+    Import an entry point module (post_check, flair). Their loggers read the sentry setting of
+    config.cfg and write actions.log to the working directory, so the sample config is used and
+    the log goes to a temporary directory.
+    """
+    import log_conf  # pylint: disable=import-outside-toplevel
+    log_conf.path_to_cfg = os.path.join(ROOT, "config.cfg.sample")
+    cwd = os.getcwd()
+    os.chdir(_LOG_DIR.name)
+    try:
+        return importlib.import_module(name)
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,136 @@
+""" Event export into day partitions and queries of analytics.py """
+
+import calendar
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics  # noqa: E402 pylint: disable=wrong-import-position
+import user_db  # noqa: E402 pylint: disable=wrong-import-position
+from analytics import Exporter, DayPartition, query  # noqa: E402 pylint: disable=wrong-import-position
+from trade_graph import TradeGraph  # noqa: E402 pylint: disable=wrong-import-position
+
+MAY_1 = calendar.timegm((2024, 5, 1, 12, 0, 0))
+MAY_2 = MAY_1 + 86400
+
+
+def event(timestamp, kind, author, reason=None, latency=None, subreddit="hardwareswap"):
+    return {"time": timestamp, "kind": kind, "subreddit": subreddit, "author": author, "reason": reason,
+            "latency": latency}
+
+
+class AnalyticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.spool_dir = os.path.join(self.tmp_dir.name, "spool")
+        self.export_dir = os.path.join(self.tmp_dir.name, "analytics")
+        os.mkdir(self.spool_dir)
+        self.exporter = Exporter(self.export_dir)
+
+    def spool(self, day, events, tail=""):
+        with open(os.path.join(self.spool_dir, day + ".jsonl"), "a", encoding="utf-8") as spool_file:
+            spool_file.write("".join(json.dumps(entry) + "\n" for entry in events) + tail)
+
+    def export(self, **kwargs):
+        return self.exporter.export(self.spool_dir, keep_spool_days=None, **kwargs)
+
+    def test_query(self):
+        self.spool("2024-05-01", [event(MAY_1, "remove", "alice", "repost", 4.0),
+                                  event(MAY_1 + 10, "remove", "bob", "repost", 2.0),
+                                  event(MAY_1 + 20, "remove", "alice", "karma", 10.0),
+                                  event(MAY_1 + 30, "post", "carol")])
+        self.spool("2024-05-02", [event(MAY_2, "remove", "bob", "repost", 6.0),
+                                  event(MAY_2 + 5, "flair", "alice", latency=1.0, subreddit="other")])
+        self.assertEqual(self.export(), 6)
+
+        self.assertEqual(query(self.export_dir), [{"key": None, "count": 6, "latency_p50": 4.0, "latency_p95": 6.0}])
+        self.assertEqual(query(self.export_dir, by="day", kind="remove"),
+                         [{"key": "2024-05-01", "count": 3, "latency_p50": 4.0, "latency_p95": 4.0},
+                          {"key": "2024-05-02", "count": 1, "latency_p50": 6.0, "latency_p95": 6.0}])
+        self.assertEqual([(entry["key"], entry["count"]) for entry in query(self.export_dir, by="reason",
+                                                                            kind="remove")],
+                         [("repost", 3), ("karma", 1)])
+        self.assertEqual([(entry["key"], entry["count"]) for entry in query(self.export_dir, by="author")],
+                         [("alice", 3), ("bob", 2), ("carol", 1)])
+        self.assertEqual(query(self.export_dir, by="subreddit", author="alice", since=MAY_2),
+                         [{"key": "other", "count": 1, "latency_p50": 1.0, "latency_p95": 1.0}])
+        self.assertEqual(query(self.export_dir, until=MAY_1 + 15)[0]["count"], 2)
+        self.assertEqual(query(self.export_dir, author="nobody"), [])
+        with self.assertRaises(ValueError):
+            query(self.export_dir, by="latency")
+
+    def test_incremental_export(self):
+        """ Each run exports the complete lines added since the last one """
+        self.spool("2024-05-01", [event(MAY_1, "post", "alice")], tail='{"time": ')
+        self.assertEqual(self.export(), 1)
+        self.assertEqual(self.export(), 0)
+        with open(os.path.join(self.spool_dir, "2024-05-01.jsonl"), "a", encoding="utf-8") as spool_file:
+            spool_file.write('{}, "kind": "post", "author": "bob"}}\n'.format(MAY_1 + 1))
+        self.spool("2024-05-01", [event(MAY_1 + 2, "post", "carol")])
+        self.assertEqual(self.export(), 2)
+        self.assertEqual([(entry["key"], entry["count"]) for entry in query(self.export_dir, by="author")],
+                         [("alice", 1), ("bob", 1), ("carol", 1)])
+
+    def test_interrupted_export(self):
+        """ A batch interrupted between partitions is finished by the next run without duplicates """
+        self.spool("2024-05-01", [event(MAY_1, "post", "alice")])
+        self.spool("2024-05-02", [event(MAY_2, "post", "bob"), event(MAY_2 + 1, "post", "carol")])
+        append = DayPartition.append
+
+        def fail_second_day(partition, rows, batch):
+            if partition.day == "2024-05-02":
+                raise OSError("disk full")
+            append(partition, rows, batch)
+
+        with mock.patch.object(DayPartition, "append", fail_second_day):
+            with self.assertRaises(OSError):
+                self.export()
+        # Added after the interrupted batch, exported by the batch after it
+        self.spool("2024-05-02", [event(MAY_2 + 2, "post", "dave")])
+        self.assertEqual(self.export(), 3)
+        self.assertEqual(self.export(), 1)
+        self.assertEqual([(entry["key"], entry["count"]) for entry in query(self.export_dir, by="day")],
+                         [("2024-05-01", 1), ("2024-05-02", 3)])
+        self.assertEqual(query(self.export_dir)[0]["count"], 4)
+
+    def test_trades(self):
+        db_path = os.path.join(self.tmp_dir.name, "user.db")
+        con = user_db.connect(db_path)
+        self.addCleanup(con.close)
+        user_db.migrate(con)
+        graph = TradeGraph(con)
+        graph.add("c1", "r1", "t1", "alice", "bob", MAY_1)
+        graph.add("c2", "r2", "t1", "carol", "bob", MAY_2)
+        self.assertEqual(self.export(trade_dbs=[("hardwareswap", db_path)]), 2)
+        graph.add("c3", "r3", "t1", "alice", "dave", MAY_2)
+        self.assertEqual(self.export(trade_dbs=[("hardwareswap", db_path)]), 1)
+        self.assertEqual([(entry["key"], entry["count"]) for entry in query(self.export_dir, by="author",
+                                                                            kind="trade")],
+                         [("alice", 2), ("carol", 1)])
+
+    def test_prune_spool(self):
+        self.spool("2024-05-01", [event(MAY_1, "post", "alice")])
+        self.exporter.export(self.spool_dir, keep_spool_days=7)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+        self.assertEqual(query(self.export_dir)[0]["count"], 1)
+
+    def test_without_numpy(self):
+        self.spool("2024-05-01", [event(MAY_1, "remove", "alice", "repost", 3.0),
+                                  event(MAY_1 + 1, "remove", "bob", "repost")])
+        self.export()
+        expected = [{"key": "alice", "count": 1, "latency_p50": 3.0, "latency_p95": 3.0},
+                    {"key": "bob", "count": 1, "latency_p50": None, "latency_p95": None}]
+        with mock.patch.object(analytics, "numpy", None):
+            self.assertEqual(query(self.export_dir, by="author", reason="repost"), expected)
+        self.assertEqual(query(self.export_dir, by="author", reason="repost"), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+""" Flair dump readers and writers of util/flair_io.py """
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "util"))
+
+from flair_io import iter_flair, write_csv  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class CsvRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "flair.csv")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_backfill_counts_round_trip(self):
+        entries = [{"user": "alice", "flair_css_class": "i-3", "flair_text": ""},
+                   {"user": "bob", "flair_css_class": "i-12", "flair_text": "Trades: 12"}]
+        write_csv(self.path, entries)
+        self.assertEqual(list(iter_flair(self.path, "csv")), entries)
+
+    def test_no_header_row(self):
+        write_csv(self.path, [{"user": "alice", "flair_css_class": "i-1"}])
+        self.assertEqual([entry["user"] for entry in iter_flair(self.path, "csv")], ["alice"])
+
+    def test_text_with_comma(self):
+        entries = [{"user": "carol", "flair_css_class": "i-5", "flair_text": "Trades: 5, verified"}]
+        write_csv(self.path, entries)
+        self.assertEqual(list(iter_flair(self.path, "csv")), entries)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+""" Shared inbox stream (inbox.py) and the mod PM handler of flair.py """
+
+import logging
+import os
+import sys
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import import_entry_point  # noqa: E402 pylint: disable=wrong-import-position
+from inbox import InboxStream, InboxCursor  # noqa: E402 pylint: disable=wrong-import-position
+
+flair = import_entry_point("flair")
+
+
+class FakeInbox:
+    """ praw_h stand-in serving inbox.unread() and recording api/read_message/ calls """
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.read = []
+        self.requests = 0
+        self.fail = False
+        self.inbox = SimpleNamespace(unread=lambda limit=None: [message for message in self.messages
+                                                                if message.fullname not in self.read])
+
+    def post(self, path, data):
+        assert path == "api/read_message/"
+        if self.fail:
+            raise ConnectionError("read_message failed")
+        self.requests += 1
+        self.read += data["id"].split(",")
+
+
+class FakeSubreddit:
+
+    def __init__(self, name, base_dir, praw_h, mods=("mod",)):
+        self.name = name
+        self.base_dir = base_dir
+        self.config = {}
+        self.praw_h = praw_h
+        self.logger = logging.getLogger("test_inbox")
+        self._mods = mods
+
+    def path(self, name):
+        return os.path.join(self.base_dir, name)
+
+    def is_mod(self, username):
+        return username in self._mods
+
+
+def message(fullname, created_utc, body, author="mod"):
+    replies = []
+    return SimpleNamespace(fullname=fullname, created_utc=created_utc, was_comment=False, body=body,
+                           author=SimpleNamespace(name=author), replies=replies, reply=replies.append)
+
+
+def link(subreddit, comment_id):
+    return "https://www.reddit.com/r/{}/comments/abcdef/trade/{}/".format(subreddit, comment_id)
+
+
+class InboxStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.cursor_path = os.path.join(self.tmp_dir.name, "inbox_cursor.json")
+        self.handled = []
+
+    def stream(self, praw_h, subreddits=None):
+        subreddit = FakeSubreddit("main", self.tmp_dir.name, praw_h)
+        return InboxStream(subreddit, self.cursor_path, subreddits)
+
+    def handler(self, name):
+        return lambda message: self.handled.append((name, message.fullname))
+
+    def test_dispatch(self):
+        """ Oldest first, to the first handler accepting a message, comment replies are left alone """
+        reply = message("t1_0", 0, "comment reply")
+        reply.was_comment = True
+        praw_h = FakeInbox([message("t4_3", 3, "!status"), message("t4_1", 1, "links"),
+                            message("t4_2", 2, "from a user", author="someone"), reply])
+        stream = self.stream(praw_h)
+        stream.register("status", self.handler("status"), accepts=lambda message: message.body == "!status")
+        stream.register("mods", self.handler("mods"))
+        stream.register("users", self.handler("users"), mods_only=False,
+                        accepts=lambda message: message.author.name == "someone")
+        self.assertEqual(stream.run(), 3)
+        self.assertEqual(self.handled, [("mods", "t4_1"), ("users", "t4_2"), ("status", "t4_3")])
+        self.assertEqual(sorted(praw_h.read), ["t4_1", "t4_2", "t4_3"])
+
+    def test_unhandled_messages_stay_unread(self):
+        praw_h = FakeInbox([message("t4_1", 1, "hi", author="someone"), message("t4_2", 2, "?")])
+        stream = self.stream(praw_h)
+        stream.register("mods", self.handler("mods"), accepts=lambda message: message.body != "?")
+        self.assertEqual(stream.run(), 0)
+        self.assertEqual(praw_h.read, [])
+
+    def test_mods_of_any_subreddit(self):
+        praw_h = FakeInbox([message("t4_1", 1, "links", author="othermod")])
+        main = FakeSubreddit("main", self.tmp_dir.name, praw_h)
+        other = FakeSubreddit("other", self.tmp_dir.name, praw_h, mods=("othermod",))
+        stream = self.stream(praw_h, [main, other])
+        self.assertTrue(stream.is_from_mod(praw_h.messages[0], other))
+        self.assertFalse(stream.is_from_mod(praw_h.messages[0], main))
+        stream.register("mods", self.handler("mods"))
+        self.assertEqual(stream.run(), 1)
+
+    def test_mark_read_in_batches(self):
+        praw_h = FakeInbox([message("t4_{:02d}".format(number), number, "links") for number in range(30)])
+        stream = self.stream(praw_h)
+        stream.register("mods", self.handler("mods"))
+        self.assertEqual(stream.run(), 30)
+        self.assertEqual(praw_h.requests, 2)
+        self.assertEqual(len(praw_h.read), 30)
+        self.assertEqual(InboxCursor(self.cursor_path).handled, {})
+
+    def test_cursor_skips_messages_handled_before_a_failure(self):
+        """ Messages handled by a run that failed to mark them read are marked, not handled again """
+        finished = []
+        praw_h = FakeInbox([message("t4_1", 1, "links"), message("t4_2", 2, "links")])
+        praw_h.fail = True
+        stream = self.stream(praw_h)
+        stream.register("mods", self.handler("mods"), finish=lambda: finished.append(True))
+        with self.assertRaises(ConnectionError):
+            stream.run()
+        self.assertEqual(finished, [True])
+        self.assertEqual(sorted(InboxCursor(self.cursor_path).handled), ["t4_1", "t4_2"])
+
+        praw_h.fail = False
+        praw_h.messages.append(message("t4_3", 3, "links"))
+        stream = self.stream(praw_h)
+        stream.register("mods", self.handler("mods"))
+        self.assertEqual(stream.run(), 1)
+        self.assertEqual(self.handled, [("mods", "t4_1"), ("mods", "t4_2"), ("mods", "t4_3")])
+        self.assertEqual(sorted(praw_h.read), ["t4_1", "t4_2", "t4_3"])
+
+    def test_cursor_forgets_old_entries(self):
+        cursor = InboxCursor(self.cursor_path, keep_days=1)
+        cursor.add("t4_old", time.time() - 2 * 86400)
+        cursor.add("t4_new", time.time())
+        cursor.marked_read(set())
+        self.assertEqual(list(InboxCursor(self.cursor_path).handled), ["t4_new"])
+
+
+class ModMessagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        for sub_dir in ("main", "other"):
+            os.mkdir(os.path.join(self.tmp_dir.name, sub_dir))
+
+    def flairer(self, subreddit):
+        flairer = flair.TradeFlairer.__new__(flair.TradeFlairer)
+        flairer._subreddit = subreddit  # pylint: disable=protected-access
+        flairer.process_mod_message = lambda message, flairers: ["handled " + message.fullname]
+        return flairer
+
+    def test_filtered_run_leaves_other_subreddits_unread(self):
+        """ With -s main, PMs about the configured r/other get no reply and stay unread """
+        messages = [message("t4_1", 1, link("main", "c000001")),
+                    message("t4_2", 2, link("other", "c000002")),
+                    message("t4_3", 3, link("main", "c000003") + "\n" + link("Other", "c000004"))]
+        praw_h = FakeInbox(messages)
+        primary = FakeSubreddit("other", os.path.join(self.tmp_dir.name, "other"), praw_h)
+        main = FakeSubreddit("main", os.path.join(self.tmp_dir.name, "main"), praw_h)
+        flairers = {"main": self.flairer(main)}
+
+        flairers["main"].process_mod_messages(flairers, primary, {"other"})
+
+        self.assertEqual(praw_h.read, ["t4_1"])
+        self.assertEqual(messages[0].replies, ["handled t4_1"])
+        self.assertEqual(messages[1].replies + messages[2].replies, [])
+        # The cursor belongs to the primary config, not to the filtered subreddit
+        self.assertTrue(os.path.exists(primary.path("inbox_cursor.json")))
+        self.assertFalse(os.path.exists(main.path("inbox_cursor.json")))
+
+        # An unfiltered run picks them up
+        flairers["other"] = self.flairer(primary)
+        flairers["main"].process_mod_messages(flairers, primary)
+        self.assertEqual(sorted(praw_h.read), ["t4_1", "t4_2", "t4_3"])
+        self.assertEqual(messages[2].replies, ["handled t4_2\n\nhandled t4_3"])
+
+    def test_unfiltered_call_uses_own_cursor(self):
+        praw_h = FakeInbox([message("t4_1", 1, link("main", "c000001"))])
+        main = FakeSubreddit("main", os.path.join(self.tmp_dir.name, "main"), praw_h)
+        self.flairer(main).process_mod_messages()
+        self.assertEqual(praw_h.read, ["t4_1"])
+        self.assertTrue(os.path.exists(main.path("inbox_cursor.json")))
+
+    def test_non_mod_messages_stay_unread(self):
+        praw_h = FakeInbox([message("t4_1", 1, link("main", "c000001"), author="someone")])
+        main = FakeSubreddit("main", os.path.join(self.tmp_dir.name, "main"), praw_h)
+        stream = InboxStream(main, main.path("inbox_cursor.json"))
+        self.flairer(main).register_inbox_handler(stream)
+        self.assertEqual(stream.run(), 0)
+        self.assertEqual(praw_h.read, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+""" Schedule of pending trade rechecks (recheck_scheduler.py) and the recheck pass of flair.py """
+
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import import_entry_point  # noqa: E402 pylint: disable=wrong-import-position
+import user_db  # noqa: E402 pylint: disable=wrong-import-position
+from recheck_scheduler import RecheckScheduler  # noqa: E402 pylint: disable=wrong-import-position
+
+flair = import_entry_point("flair")
+
+
+class RecheckSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.con = user_db.connect(os.path.join(self.tmp_dir.name, "user.db"))
+        user_db.migrate(self.con)
+        self.addCleanup(self.con.close)
+        self.rechecks = RecheckScheduler(self.con)
+
+    def test_due_in_order(self):
+        self.rechecks.schedule("c2", "t1", 200, "age")
+        self.rechecks.schedule("c1", "t1", 100, "karma")
+        self.rechecks.schedule("c3", "t1", 300, "age")
+        self.assertEqual(self.rechecks.pop_due(250), [("c1", "t1"), ("c2", "t1")])
+        self.assertEqual(self.rechecks.pop_due(250), [])
+        self.assertEqual(self.rechecks.pop_due(300), [("c3", "t1")])
+
+    def test_reschedule_replaces_due_time(self):
+        self.rechecks.pop_due(0)
+        self.assertEqual(self.rechecks.schedule("c1", "t1", 100, "karma"), 1)
+        self.assertEqual(self.rechecks.schedule("c1", "t1", 500, "karma"), 2)
+        self.assertEqual(self.rechecks.pop_due(400), [])
+        self.assertEqual(self.rechecks.pop_due(500), [("c1", "t1")])
+
+    def test_removed_entries_are_skipped(self):
+        self.rechecks.schedule("c1", "t1", 100, "age")
+        self.rechecks.pop_due(0)
+        self.rechecks.remove("c1")
+        self.assertEqual(self.rechecks.pop_due(1000), [])
+        self.assertIsNone(self.rechecks.due_utc("c1"))
+        self.assertEqual(len(self.rechecks), 0)
+
+    def test_schedule_survives_restart(self):
+        self.rechecks.schedule("c1", "t1", 100, "age")
+        self.assertEqual(RecheckScheduler(self.con).pop_due(100), [("c1", "t1")])
+
+
+def praw_comment(comment_id, author, body):
+    return SimpleNamespace(id=comment_id, created_utc=0, link_id="t3_t1", parent_id="t3_t1", permalink="",
+                           author=SimpleNamespace(name=author), body=body, author_flair_css_class=None,
+                           author_flair_text=None, banned_by=None, mod_reports=[], removed=False, replies=[])
+
+
+class ProcessRechecksTest(unittest.TestCase):
+    """ TradeFlairer._process_rechecks without a reddit connection, flairing itself is not reached """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        con = user_db.connect(os.path.join(self.tmp_dir.name, "user.db"))
+        user_db.migrate(con)
+        self.addCleanup(con.close)
+        self.rechecks = RecheckScheduler(con)
+        self.comments = {}
+        subreddit = SimpleNamespace(comment=lambda comment_id: SimpleNamespace(
+            refresh=lambda: self.comments[comment_id]))
+        self.flairer = flair.TradeFlairer.__new__(flair.TradeFlairer)
+        # pylint: disable=protected-access
+        self.flairer._subreddit = subreddit
+        self.flairer._config = {"link_id": "t1", "prevlink_id": "t0"}
+        self.flairer._rechecks = self.rechecks
+        self.flairer._logger = logging.getLogger("test_recheck")
+        self.flairer.pending = {}
+        self.flairer.open_submission = lambda submission_id: None
+        self.flairer.close_submission = lambda: None
+
+    def add_pending(self, comment_id, author, body, due_utc=100):
+        self.comments[comment_id] = praw_comment(comment_id, author, body)
+        self.flairer.pending[comment_id] = None
+        self.rechecks.schedule(comment_id, "t1", due_utc, "age")
+
+    def test_explicit_link_does_not_stop_the_pass(self):
+        self.add_pending("c1", "alice", "Traded with [bob](https://reddit.com/u/bob)")
+        self.add_pending("c2", "carol", "u/dave u/erin", due_utc=101)
+        self.flairer._process_rechecks()  # pylint: disable=protected-access
+        # Both checked: neither can pass (explicit link, two users), so both are dropped
+        self.assertEqual(len(self.rechecks), 0)
+
+    def test_failing_recheck_stays_scheduled(self):
+        self.add_pending("c1", "alice", "u/bob")
+        self.add_pending("c2", "carol", "u/dave u/erin", due_utc=101)
+        del self.comments["c1"]
+        with self.assertLogs("test_recheck", "ERROR"):
+            self.flairer._process_rechecks()  # pylint: disable=protected-access
+        self.assertEqual(self.rechecks.due_utc("c1"), 100)
+        self.assertIsNone(self.rechecks.due_utc("c2"))
+
+    def test_closed_thread_is_dropped(self):
+        self.add_pending("c1", "alice", "u/bob")
+        self.rechecks.schedule("c1", "old", 100, "age")
+        self.flairer._process_rechecks()  # pylint: disable=protected-access
+        self.assertEqual(len(self.rechecks), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
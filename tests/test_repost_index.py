@@ -0,0 +1,85 @@
+""" Near-duplicate lookups of repost_index.RepostIndex """
+
+import os
+import random
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import user_db  # noqa: E402 pylint: disable=wrong-import-position
+from repost_index import RepostIndex, shingles  # noqa: E402 pylint: disable=wrong-import-position
+
+DAY = 86400
+WORDS = ["selling", "buying", "gpu", "cpu", "ram", "ssd", "case", "monitor", "keyboard", "mouse", "shipped",
+         "local", "paypal", "cash", "$120", "$80", "$300", "obo", "mint", "used", "boxed", "warranty", "like",
+         "new", "condition", "timestamps", "included", "pickup", "only", "firm", "price", "each", "bundle"]
+
+
+def post_text(rand, length=40):
+    return " ".join(rand.choice(WORDS) for _ in range(length))
+
+
+def edit(rand, text):
+    """ text with one word replaced, as a reposter freshening up the old text would """
+    words = text.split()
+    words[rand.randrange(len(words))] = "edited"
+    return " ".join(words)
+
+
+class RepostIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.con = user_db.connect(os.path.join(self.tmp_dir.name, "user.db"))
+        user_db.migrate(self.con)
+        self.addCleanup(self.con.close)
+        self.index = RepostIndex(self.con)
+        self.now = int(time.time())
+
+    def test_near_duplicate_recall(self):
+        rand = random.Random(7)
+        originals = [post_text(rand) for _ in range(50)]
+        for number, text in enumerate(originals):
+            self.assertEqual(self.index.check_and_add("p{}".format(number), "user{}".format(number),
+                                                      self.now, text), [])
+
+        found = 0
+        for number, text in enumerate(originals):
+            matches = self.index.check_and_add("r{}".format(number), "other", self.now + DAY, edit(rand, text))
+            # Only the original is similar enough, never one of the unrelated posts
+            self.assertLessEqual({post_id for _score, post_id, _author in matches}, {"p{}".format(number)})
+            found += bool(matches)
+        self.assertGreaterEqual(found / len(originals), 0.95)
+
+    def test_match_details(self):
+        text = post_text(random.Random(1))
+        self.index.check_and_add("p1", "seller", self.now, text)
+        matches = self.index.check_and_add("p2", "seller2", self.now + 60, text)
+        self.assertEqual(matches, [(1.0, "p1", "seller")])
+
+    def test_reindexing_a_post_does_not_match_itself(self):
+        text = post_text(random.Random(2))
+        self.index.check_and_add("p1", "seller", self.now, text)
+        self.assertEqual(self.index.check_and_add("p1", "seller", self.now, text + " bump"), [])
+
+    def test_window(self):
+        text = post_text(random.Random(3))
+        self.index.check_and_add("p1", "seller", self.now, text)
+        self.assertEqual(self.index.check_and_add("p2", "seller", self.now + 31 * DAY, text), [])
+        self.index.prune(self.now + DAY)
+        self.assertEqual(self.con.execute("SELECT COUNT(*) FROM submission_band WHERE post_id='p1'").fetchone()[0], 0)
+        self.assertEqual([post_id for _score, post_id, _author
+                          in self.index.check_and_add("p3", "seller", self.now + 32 * DAY, text)], ["p2"])
+
+    def test_short_texts_are_not_indexed(self):
+        self.assertEqual(len(shingles("selling a gpu")), 1)
+        self.assertEqual(self.index.check_and_add("p1", "seller", self.now, "selling a gpu cheap"), [])
+        self.assertEqual(self.con.execute("SELECT COUNT(*) FROM submission_signature").fetchone()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
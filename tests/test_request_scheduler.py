@@ -0,0 +1,136 @@
+""" Token bucket and priority queue of request_scheduler.py """
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from request_scheduler import (  # noqa: E402 pylint: disable=wrong-import-position
+    RequestScheduler, TokenBucket, MODERATION, NORMAL, BULK)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_refill(self):
+        bucket = TokenBucket(capacity=2, rate=4.0)
+        self.assertEqual(bucket.try_take(), (True, 0.0))
+        self.assertEqual(bucket.try_take(), (True, 0.0))
+        taken, wait = bucket.try_take()
+        self.assertFalse(taken)
+        self.assertAlmostEqual(wait, 0.25, delta=0.01)
+        # Half a second later two tokens are back, but never more than the capacity
+        bucket._state["updated"] -= 0.5  # pylint: disable=protected-access
+        self.assertTrue(bucket.try_take()[0])
+        self.assertTrue(bucket.try_take()[0])
+        self.assertFalse(bucket.try_take()[0])
+        bucket._state["updated"] -= 10  # pylint: disable=protected-access
+        self.assertEqual(sum(bucket.try_take()[0] for _ in range(5)), 2)
+
+    def test_reserve(self):
+        bucket = TokenBucket(capacity=5, rate=0.001)
+        self.assertFalse(bucket.try_take(reserve=5)[0])
+        self.assertTrue(bucket.try_take(reserve=3)[0])
+        self.assertFalse(bucket.try_take(reserve=4)[0])
+
+    def test_update_limits(self):
+        bucket = TokenBucket(capacity=30, rate=1.0)
+        bucket.update_limits(remaining=3, seconds_to_reset=60)
+        self.assertEqual(sum(bucket.try_take()[0] for _ in range(5)), 3)
+        bucket.update_limits(remaining=600, seconds_to_reset=300)
+        self.assertAlmostEqual(bucket._state["rate"], 2.0)  # pylint: disable=protected-access
+
+    def test_shared_state_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state_path = os.path.join(tmp_dir, "ratelimit.json")
+            first = TokenBucket(capacity=3, rate=0.001, state_path=state_path)
+            second = TokenBucket(capacity=3, rate=0.001, state_path=state_path)
+            self.assertTrue(first.try_take()[0])
+            self.assertTrue(second.try_take()[0])
+            self.assertTrue(first.try_take()[0])
+            self.assertFalse(second.try_take()[0])
+
+
+class ManualBucket:
+    """ Bucket handing out tokens released by the test, ignoring reserves """
+
+    def __init__(self):
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def try_take(self, reserve=0):  # pylint: disable=unused-argument
+        with self._lock:
+            if self.tokens > 0:
+                self.tokens -= 1
+                return True, 0.0
+        return False, 0.01
+
+    def update_limits(self, remaining, seconds_to_reset):
+        pass
+
+
+class RequestSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = ManualBucket()
+        self.scheduler = RequestScheduler(self.bucket)
+        self.order = []
+        self.threads = []
+
+    def request(self, priority, task):
+        """ Start a thread making one request and wait until it is queued """
+
+        def run():
+            with self.scheduler.priority(priority, task):
+                self.scheduler.acquire()
+            self.order.append(task)
+
+        queued = len(self.scheduler._waiting)  # pylint: disable=protected-access
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+        deadline = time.monotonic() + 5
+        while len(self.scheduler._waiting) == queued:  # pylint: disable=protected-access
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+    def release(self):
+        """ Hand out one token at a time, so order records the order requests were let through """
+        for sent in range(len(self.threads)):
+            self.bucket.tokens = 1
+            deadline = time.monotonic() + 5
+            while len(self.order) == sent:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.001)
+        for thread in self.threads:
+            thread.join(5)
+
+    def test_priority_order(self):
+        self.request(BULK, "bulk")
+        self.request(NORMAL, "normal")
+        self.request(BULK, "bulk")
+        self.request(MODERATION, "moderation")
+        self.release()
+        self.assertEqual(self.order, ["moderation", "normal", "bulk", "bulk"])
+
+    def test_fair_between_tasks(self):
+        """ A task with a backlog does not hold back another task of the same class """
+        for _ in range(4):
+            self.request(BULK, "a")
+        self.request(BULK, "b")
+        self.release()
+        self.assertEqual(self.order, ["a", "b", "a", "a", "a"])
+
+    def test_default_priority(self):
+        self.assertEqual(self.scheduler.current(), (NORMAL, threading.current_thread().name))
+        with self.scheduler.priority(BULK, "outer"):
+            with self.scheduler.priority(MODERATION):
+                self.assertEqual(self.scheduler.current(), (MODERATION, threading.current_thread().name))
+            self.assertEqual(self.scheduler.current(), (BULK, "outer"))
+
+
+if __name__ == "__main__":
+    unittest.main()
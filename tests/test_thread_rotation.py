@@ -0,0 +1,69 @@
+""" Archiving of trade thread logs in thread_rotation.py """
+
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import thread_rotation  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class FakeSubreddit:
+    """ The SubRedditMod attributes thread_rotation uses for archiving """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.config = {"rotation": {"archive_dir": "archive"}, "trade": {"link_id": "cur", "prevlink_id": "prev"}}
+
+    def path(self, filename):
+        return os.path.join(self.base_dir, filename)
+
+
+class ArchiveThreadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.subreddit = FakeSubreddit(self.tmp_dir.name)
+        self.write_log("old", "_completed.log", ["c1", "c2"])
+        self.write_log("old", "_pending.log", ["c3"])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_log(self, submission_id, suffix, comment_ids):
+        with open(self.subreddit.path(submission_id + suffix), "a", encoding="utf-8") as log_file:
+            log_file.write("".join(comment_id + "\n" for comment_id in comment_ids))
+
+    def test_archives_and_removes_logs(self):
+        self.assertEqual(thread_rotation.archive_thread(self.subreddit, "old"), 2)
+        self.assertEqual(thread_rotation.read_archive(self.subreddit, "old")["pending"], ["c3"])
+        self.assertEqual(thread_rotation.logged_threads(self.subreddit), set())
+        self.assertFalse(os.path.exists(self.subreddit.path("old" + thread_rotation.LOCK_SUFFIX)))
+
+    def test_open_thread_is_not_archived(self):
+        lock = thread_rotation.lock_thread(self.subreddit, "old")
+        self.assertIsNone(thread_rotation.archive_thread(self.subreddit, "old"))
+        # Written by the process that still has the thread open
+        self.write_log("old", "_completed.log", ["c4"])
+        lock.close()
+        self.assertEqual(thread_rotation.archive_thread(self.subreddit, "old"), 3)
+        self.assertIn("c4", thread_rotation.read_archive(self.subreddit, "old")["completed"])
+
+    def test_lock_after_archiving_is_a_new_file(self):
+        thread_rotation.archive_thread(self.subreddit, "old")
+        lock = thread_rotation.lock_thread(self.subreddit, "old")
+        self.assertIsNone(thread_rotation.archive_thread(self.subreddit, "old"))
+        lock.close()
+
+    def test_current_threads_are_kept(self):
+        self.write_log("cur", "_completed.log", ["c5"])
+        self.write_log("prev", "_completed.log", ["c6"])
+        thread_rotation.archive_closed_threads(self.subreddit, logging.getLogger("test_thread_rotation"))
+        self.assertEqual(thread_rotation.logged_threads(self.subreddit), {"cur", "prev"})
+
+
+if __name__ == "__main__":
+    unittest.main()
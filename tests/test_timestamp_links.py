@@ -0,0 +1,217 @@
+""" Timestamp link normalization, checks against a local stub host and reuse reports of post_check.py """
+
+import concurrent.futures
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from support import import_entry_point  # noqa: E402 pylint: disable=wrong-import-position
+import user_db  # noqa: E402 pylint: disable=wrong-import-position
+from records import PostRecord  # noqa: E402 pylint: disable=wrong-import-position
+from timestamp_links import (LinkChecker, normalize_url, extract_links, OK, MISSING,  # noqa: E402
+                             UNREACHABLE)  # pylint: disable=wrong-import-position
+
+# timestamp_regex of config.cfg.sample
+TIMESTAMP_REGEX = re.compile(r"http[s]?:\/\/(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+",
+                             re.IGNORECASE)
+post_check = import_entry_point("post_check")
+
+
+def setUpModule():  # pylint: disable=invalid-name
+    STUB.start()
+
+
+def tearDownModule():  # pylint: disable=invalid-name
+    STUB.stop()
+
+
+class StubHost:
+    """ Image host on a local port: /ok..., /gone... (404), /removed, /slow/..., /shared/..., /garbage... """
+
+    def __init__(self):
+        self.hits = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self.url = None
+
+    def start(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                with stub._lock:  # pylint: disable=protected-access
+                    stub.hits[self.path] = stub.hits.get(self.path, 0) + 1
+                if self.path.startswith("/slow"):
+                    time.sleep(2)
+                elif self.path.startswith("/shared"):
+                    time.sleep(0.3)
+                if self.path.startswith("/garbage"):
+                    # Not an HTTP status line, http.client raises BadStatusLine
+                    self.wfile.write(b"GARBAGE\r\n\r\n")
+                    self.close_connection = True
+                    return
+                if self.path.startswith("/gone"):
+                    self.send_response(404)
+                elif self.path == "/removed":
+                    self.send_response(302)
+                    self.send_header("Location", "/removed.png")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *_args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = "http://127.0.0.1:{}".format(self._server.server_address[1])
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+STUB = StubHost()
+
+
+class NormalizeTest(unittest.TestCase):
+
+    def test_host_query_and_fragment(self):
+        self.assertEqual(normalize_url("HTTPS://WWW.Example.com/Foo/?utm=1#top"), "https://example.com/Foo")
+        self.assertEqual(normalize_url("https://m.example.com/Foo/)."), "https://example.com/Foo")
+
+    def test_imgur_forms(self):
+        self.assertEqual(normalize_url("http://imgur.com/gallery/my-gpu-AbC12"), "https://imgur.com/a/AbC12")
+        self.assertEqual(normalize_url("https://www.imgur.com/a/AbC12/"), "https://imgur.com/a/AbC12")
+        self.assertEqual(normalize_url("https://i.imgur.com/XyZ9.jpg"), "https://imgur.com/XyZ9")
+
+    def test_extract_links(self):
+        text = ("Timestamps: https://imgur.com/a/AbC12 and [again](http://www.imgur.com/gallery/AbC12), "
+                "https://i.imgur.com/XyZ9.png https://example.com/other")
+        self.assertEqual(extract_links(TIMESTAMP_REGEX, text),
+                         ["https://imgur.com/a/AbC12", "https://imgur.com/XyZ9", "https://example.com/other"])
+        self.assertEqual(extract_links(TIMESTAMP_REGEX, text, ["imgur.com"]),
+                         ["https://imgur.com/a/AbC12", "https://imgur.com/XyZ9"])
+
+
+class LinkCheckerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = LinkChecker(concurrency=4, timeout=0.5, user_agent="test")
+
+    def tearDown(self):
+        self.checker.close()
+
+    def test_statuses(self):
+        urls = [STUB.url + path for path in ("/ok", "/gone", "/removed", "/slow/1")]
+        statuses = self.checker.check(urls).result(10)
+        self.assertEqual(statuses, dict(zip(urls, [OK, MISSING, MISSING, UNREACHABLE])))
+
+    def test_malformed_response(self):
+        url = STUB.url + "/garbage/1"
+        self.assertEqual(self.checker.check([url]).result(10), {url: UNREACHABLE})
+
+    def test_unreachable_host(self):
+        # Port 9 (discard) is closed on a test machine
+        url = "http://127.0.0.1:9/a"
+        self.assertEqual(self.checker.check([url]).result(10), {url: UNREACHABLE})
+
+    def test_inflight_checks_are_shared(self):
+        url = STUB.url + "/shared/1"
+        futures = [self.checker.check([url]) for _ in range(3)]
+        self.assertEqual([future.result(10)[url] for future in futures], [OK] * 3)
+        self.assertEqual(STUB.hits["/shared/1"], 1)
+
+
+class FakeSubmission:
+
+    def __init__(self, reports, post_id):
+        self._reports = reports
+        self._id = post_id
+
+    def report(self, reason):
+        self._reports.append((self._id, reason))
+
+
+class VerifyTimestampsTest(unittest.TestCase):
+    """ PostChecker.verify_timestamps and report_timestamps with a real user.db and link checker """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        con = user_db.connect(os.path.join(self.tmp_dir.name, "user.db"))
+        user_db.migrate(con)
+        self.addCleanup(con.close)
+        self.reports = []
+        subreddit = SimpleNamespace(praw_h=SimpleNamespace(config=SimpleNamespace(user_agent="test")),
+                                    submission=lambda post_id: FakeSubmission(self.reports, post_id))
+        rules = SimpleNamespace(config={"timestamp_concurrency": "2", "timestamp_timeout": "0.5",
+                                        "timestamp_hosts": ""},
+                                patterns={"timestamp_regex": TIMESTAMP_REGEX})
+        self.checker = post_check.PostChecker(subreddit, con, rules)
+        self.addCleanup(self.checker._link_checker.close)  # pylint: disable=protected-access
+
+    def verify(self, post_id, author, *paths):
+        post = PostRecord(id=post_id, author_name=author, created_utc=time.time(), subreddit="test")
+        self.checker.verify_timestamps(post, " ".join(STUB.url + path for path in paths))
+
+    def finish_checks(self):
+        deadline = time.monotonic() + 10
+        while self.checker._timestamp_checks and time.monotonic() < deadline:  # pylint: disable=protected-access
+            time.sleep(0.05)
+            self.checker.report_timestamps()
+
+    def test_reuse_by_another_user_is_reported(self):
+        self.verify("p1", "alice", "/ok/reuse")
+        self.verify("p2", "Alice", "/ok/reuse")
+        self.verify("p3", "bob", "/ok/reuse")
+        self.finish_checks()
+        self.assertEqual(self.reports, [("p3", "Timestamp reused from https://redd.it/p1 by /u/alice")])
+
+    def test_unreachable_timestamps_are_reported(self):
+        self.verify("p1", "carol", "/gone/1", "/slow/2")
+        self.verify("p2", "dave", "/gone/2", "/ok/other")
+        self.finish_checks()
+        self.assertEqual([post_id for post_id, _reason in self.reports], ["p1"])
+        self.assertTrue(self.reports[0][1].startswith("Timestamp not reachable"))
+
+    def test_malformed_response_is_reported(self):
+        self.verify("p1", "frank", "/garbage/2")
+        self.finish_checks()
+        self.assertEqual([post_id for post_id, _reason in self.reports], ["p1"])
+
+    def test_failed_check_is_dropped(self):
+        failed = concurrent.futures.Future()
+        failed.set_exception(RuntimeError("checker failed"))
+        post = PostRecord(id="p1", author_name="gina", created_utc=time.time(), subreddit="test")
+        self.checker._timestamp_checks.append((post, [STUB.url + "/ok/x"], failed))  # pylint: disable=protected-access
+        self.checker.report_timestamps()
+        self.assertEqual(self.checker._timestamp_checks, [])  # pylint: disable=protected-access
+        self.assertEqual(self.reports, [])
+
+    def test_checked_links_are_not_fetched_again(self):
+        self.verify("p1", "erin", "/ok/cached")
+        self.finish_checks()
+        self.verify("p2", "erin", "/ok/cached")
+        self.assertEqual(self.checker._timestamp_checks, [])  # pylint: disable=protected-access
+        self.assertEqual(STUB.hits["/ok/cached"], 1)
+
+    def test_deleted_author(self):
+        self.verify("p1", None, "/ok/deleted")
+        self.finish_checks()
+        self.assertEqual(self.reports, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
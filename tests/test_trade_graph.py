@@ -0,0 +1,87 @@
+""" Trade edges and trading ring detection of trade_graph.TradeGraph """
+
+import itertools
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import user_db  # noqa: E402 pylint: disable=wrong-import-position
+from trade_graph import TradeGraph  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class TradeGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.con = user_db.connect(os.path.join(self.tmp_dir.name, "user.db"))
+        user_db.migrate(self.con)
+        self.addCleanup(self.con.close)
+        self.graph = TradeGraph(self.con)
+        self._ids = itertools.count()
+
+    def trade(self, user_a, user_b, times=1, created_utc=1000):
+        for _ in range(times):
+            number = next(self._ids)
+            self.graph.add("c{}".format(number), "r{}".format(number), "t1", user_a, user_b, created_utc)
+
+    def test_ring(self):
+        # a, b and c confirm trades with each other, a also made one outside trade
+        self.trade("a", "B", 3)
+        self.trade("b", "c", 3)
+        self.trade("C", "a", 2)
+        self.trade("a", "x")
+        # A pair is too small to report
+        self.trade("g", "h", 5)
+        # d trades with e and f repeatedly, but mostly with others
+        self.trade("d", "e", 2)
+        self.trade("e", "f", 2)
+        for number in range(10):
+            self.trade("d", "buyer{}".format(number))
+        self.assertEqual(self.graph.find_rings(), [(["a", "b", "c"], 8, 9)])
+
+    def test_largest_ring_first(self):
+        for user_a, user_b in (("a", "b"), ("b", "c"), ("c", "a")):
+            self.trade(user_a, user_b, 2)
+        for user_a, user_b in (("p", "q"), ("q", "r"), ("r", "s"), ("s", "p")):
+            self.trade(user_a, user_b, 3)
+        self.assertEqual(self.graph.find_rings(), [(["p", "q", "r", "s"], 12, 12), (["a", "b", "c"], 6, 6)])
+        self.assertEqual(self.graph.find_rings(min_pair_trades=3), [(["p", "q", "r", "s"], 12, 12)])
+
+    def test_single_trades_do_not_join(self):
+        for user_a, user_b in itertools.combinations("abcd", 2):
+            self.trade(user_a, user_b)
+        self.assertEqual(self.graph.find_rings(), [])
+        self.assertEqual(self.graph.find_rings(min_pair_trades=1), [(["a", "b", "c", "d"], 6, 6)])
+
+    def test_size_limit(self):
+        users = ["user{:02d}".format(number) for number in range(25)]
+        for user_a, user_b in zip(users, users[1:] + users[:1]):
+            self.trade(user_a, user_b, 2)
+        self.assertEqual(self.graph.find_rings(), [])
+        self.assertEqual(len(self.graph.find_rings(max_size=25)), 1)
+
+    def test_since(self):
+        self.trade("a", "b", 2, created_utc=100)
+        self.trade("b", "c", 2, created_utc=100)
+        self.trade("c", "a", 2, created_utc=5000)
+        self.assertEqual(len(self.graph.find_rings()), 1)
+        self.assertEqual(self.graph.find_rings(since_utc=1000), [])
+
+    def test_queries(self):
+        self.trade("Alice", "bob", 2)
+        self.trade("carol", "alice")
+        self.assertFalse(self.graph.add("c0", "r0", "t1", "alice", "bob", 1000))
+        self.assertTrue(self.graph.has_traded("bob", "Alice"))
+        self.assertEqual(len(self.graph.trades_between("bob", "Alice")), 2)
+        self.assertEqual(self.graph.partners("Alice"), {"bob": 2, "carol": 1})
+        self.assertEqual(self.graph.top_partner_share("bob"), (2, 2))
+        self.graph.remove("c0")
+        self.assertEqual(self.graph.trade_count("bob"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
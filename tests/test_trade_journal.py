@@ -0,0 +1,87 @@
+""" Write-ahead journal of trade flair changes (trade_journal.py) """
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trade_journal import TradeJournal  # noqa: E402 pylint: disable=wrong-import-position
+
+FLAIRS = [("alice", "", "i-3", 3), ("bob", "text", "i-8", 8)]
+TRADE = ("c1", "r1", "t1", "alice", "bob", 100)
+
+
+class TradeJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "t1_journal.log")
+
+    def reopen(self, journal):
+        # A crash leaves the file as written, close() would remove a journal without open intents
+        journal._file.close()  # pylint: disable=protected-access
+        journal = TradeJournal(self.path)
+        self.addCleanup(journal._file.close)  # pylint: disable=protected-access
+        return journal
+
+    def test_replay_open_intent(self):
+        journal = TradeJournal(self.path)
+        journal.intent("c1", FLAIRS, TRADE, "r1")
+        journal.flaired("c1", "alice")
+        journal.intent("c2", FLAIRS[:1])
+        journal.commit("c2")
+
+        journal = self.reopen(journal)
+        self.assertEqual(list(journal.open_intents), ["c1"])
+        intent = journal.open_intents["c1"]
+        self.assertEqual(intent["flairs"], [list(flair) for flair in FLAIRS])
+        self.assertEqual(intent["trade"], list(TRADE))
+        self.assertEqual(intent["reply"], "r1")
+        self.assertEqual(intent["flaired"], ["alice"])
+        self.assertFalse(intent["replied"])
+
+    def test_replay_after_torn_write(self):
+        """ A crash in the middle of a record loses only that step """
+        journal = TradeJournal(self.path)
+        journal.intent("c1", FLAIRS, TRADE, "r1")
+        journal.flaired("c1", "alice")
+        journal.flaired("c1", "bob")
+        journal._file.close()  # pylint: disable=protected-access
+        with open(self.path, "r+", encoding="utf-8") as journal_file:
+            journal_file.truncate(os.path.getsize(self.path) - 10)
+
+        journal = TradeJournal(self.path)
+        self.assertEqual(journal.open_intents["c1"]["flaired"], ["alice"])
+
+        # Steps logged after the torn record survive the next replay
+        journal.flaired("c1", "bob")
+        journal.replied("c1")
+        journal = self.reopen(journal)
+        self.assertEqual(journal.open_intents["c1"]["flaired"], ["alice", "bob"])
+        self.assertTrue(journal.open_intents["c1"]["replied"])
+
+        journal.commit("c1")
+        journal = self.reopen(journal)
+        self.assertEqual(journal.open_intents, {})
+
+    def test_close_removes_finished_journal(self):
+        journal = TradeJournal(self.path)
+        journal.intent("c1", FLAIRS, TRADE, "r1")
+        journal.commit("c1")
+        journal.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_close_keeps_open_intents(self):
+        journal = TradeJournal(self.path)
+        journal.intent("c1", FLAIRS, TRADE, "r1")
+        journal.close()
+        journal = TradeJournal(self.path)
+        self.addCleanup(journal.close)
+        self.assertEqual(list(journal.open_intents), ["c1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
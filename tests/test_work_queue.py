@@ -0,0 +1,72 @@
+""" Leases and retries of work_queue.WorkQueue """
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from work_queue import WorkQueue  # noqa: E402 pylint: disable=wrong-import-position
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "queue.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def worker(self, name, lease_seconds=1, max_attempts=2):
+        queue = WorkQueue(self.path, lease_seconds, max_attempts)
+        queue.owner = name
+        self.addCleanup(queue.close)
+        return queue
+
+    def state(self, post_id):
+        queue = self.worker("reader")
+        return queue._con.execute("SELECT state FROM post_queue WHERE post_id=?",  # pylint: disable=protected-access
+                                  (post_id,)).fetchone()[0]
+
+    def test_expired_lease_is_given_up_after_max_attempts(self):
+        # Lease times are whole seconds, a lease of 0 s is expired in the next second
+        first, second = self.worker("first", lease_seconds=0), self.worker("second", lease_seconds=0)
+        first.enqueue("p1", "sub", "alice", 100)
+        self.assertEqual(first.claim()["attempts"], 1)
+        time.sleep(1.1)
+        self.assertEqual(second.claim()["attempts"], 2)
+        time.sleep(1.1)
+        self.assertIsNone(first.claim())
+        self.assertEqual(self.state("p1"), "failed")
+
+    def test_given_up_post_does_not_block_the_author(self):
+        queue = self.worker("first", lease_seconds=0, max_attempts=1)
+        queue.enqueue("p1", "sub", "alice", 100)
+        queue.enqueue("p2", "sub", "alice", 200)
+        self.assertEqual(queue.claim()["post_id"], "p1")
+        time.sleep(1.1)
+        self.assertEqual(queue.claim()["post_id"], "p2")
+
+    def test_lease_is_kept_while_checking(self):
+        first, second = self.worker("first", lease_seconds=3), self.worker("second", lease_seconds=3)
+        first.enqueue("p1", "sub", "alice", 100)
+        job = first.claim()
+        with first.keep_leased(job["post_id"]):
+            time.sleep(4)
+            self.assertIsNone(second.claim())
+        first.complete(job["post_id"])
+        self.assertEqual(self.state("p1"), "done")
+
+    def test_renew_fails_for_another_owner(self):
+        first, second = self.worker("first"), self.worker("second")
+        first.enqueue("p1", "sub", "alice", 100)
+        first.claim()
+        self.assertFalse(second.renew("p1"))
+        self.assertTrue(first.renew("p1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,229 @@
+"""
+Monthly rotation of the confirmed trade thread: compacts the logs of closed threads into archives,
+prewarms the profile cache and signals running bot processes to switch to the new thread
+"""
+
+import os
+import gzip
+import json
+import glob
+import fcntl
+import signal
+import atexit
+import time
+
+import user_db
+from trade_journal import TradeJournal
+from trade_graph import TradeGraph, SCHEMA_VERSION as TRADE_GRAPH_VERSION
+from profile_cache import ProfileCache, SCHEMA_VERSION as PROFILE_CACHE_VERSION
+from request_scheduler import BULK
+
+LOG_SUFFIXES = ("_completed.log", "_pending.log")
+LOCK_SUFFIX = "_thread.lock"
+
+
+def _rotation_config(subreddit, key, default):
+    if "rotation" in subreddit.config:
+        return subreddit.config["rotation"].get(key, default)
+    return default
+
+
+class RotationSignal:
+    """ Counts the SIGHUPs sent by notify_processes, consumers compare it with the count they last handled """
+
+    def __init__(self):
+        self.count = 0
+
+    def install(self):
+        signal.signal(signal.SIGHUP, self._handle)
+
+    def _handle(self, _signum, _frame):
+        self.count += 1
+
+
+ROTATION = RotationSignal()
+# Pid files of this process, locked as long as it runs
+_PID_FILES = []
+
+
+def register_process(subreddit, name):
+    """
+    Write a locked pid file into the run_dir of subreddit and count SIGHUPs in ROTATION. The file is
+    removed at exit, a file left by a killed process is no longer locked and removed by notify_processes.
+    """
+    run_dir = subreddit.path(_rotation_config(subreddit, "run_dir", "run"))
+    os.makedirs(run_dir, exist_ok=True)
+    pid_path = os.path.join(run_dir, "{}.{}.pid".format(name, os.getpid()))
+    pid_file = open(pid_path, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+    fcntl.flock(pid_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    pid_file.write(str(os.getpid()))
+    pid_file.flush()
+    _PID_FILES.append(pid_file)
+    ROTATION.install()
+    atexit.register(_remove_pid_file, pid_path, os.getpid())
+    return pid_path
+
+
+def _remove_pid_file(pid_path, pid):
+    # Forked children inherit the atexit handlers of their parent
+    if os.getpid() == pid and os.path.exists(pid_path):
+        os.remove(pid_path)
+
+
+def notify_processes(subreddit, logger=None):
+    """ Send SIGHUP to every process registered in the run_dir of subreddit, returns their number """
+    notified = 0
+    run_dir = subreddit.path(_rotation_config(subreddit, "run_dir", "run"))
+    for pid_path in glob.glob(os.path.join(run_dir, "*.pid")):
+        try:
+            with open(pid_path, "r", encoding="utf-8") as pid_file:
+                try:
+                    fcntl.flock(pid_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Locked by the running process, its pid is not reused by another one
+                    os.kill(int(pid_file.read()), signal.SIGHUP)
+                    notified += 1
+                    continue
+            os.remove(pid_path)
+        except (OSError, ValueError) as exception:
+            if logger:
+                logger.warning("Could not notify {}: {}".format(pid_path, exception))
+    return notified
+
+
+def lock_thread(subreddit, submission_id):
+    """
+    Shared lock of a thread's logs, held by flair.py from opening the thread to closing it (close the
+    returned file to release it). archive_thread does not archive a locked thread.
+    """
+    lock_path = subreddit.path(submission_id + LOCK_SUFFIX)
+    while True:
+        lock_file = open(lock_path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        try:
+            # archive_thread removes the lock file, a lock of a removed file does not count
+            if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path)):
+                return lock_file
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+
+
+def archive_path(subreddit, submission_id):
+    archive_dir = subreddit.path(_rotation_config(subreddit, "archive_dir", "archive"))
+    return os.path.join(archive_dir, submission_id + ".json.gz")
+
+
+def read_archive(subreddit, submission_id):
+    """ Completed and pending comment ids of an archived thread as {"completed": [...], "pending": [...]} or None """
+    path = archive_path(subreddit, submission_id)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as archive_file:
+        return json.load(archive_file)
+
+
+def archive_thread(subreddit, submission_id):
+    """
+    Compact the completed and pending logs of submission_id into its archive, merged with an earlier
+    archive of the thread. Returns the number of completed trades, None if a flair.py process has the
+    thread open (lock_thread) or its journal has unfinished flair changes (resumed by the next flair.py
+    run on the thread); the thread is then archived by a later rotation.
+    """
+    lock_path = subreddit.path(submission_id + LOCK_SUFFIX)
+    with open(lock_path, "a", encoding="utf-8") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        completed = _archive_locked_thread(subreddit, submission_id)
+        if completed is not None:
+            os.remove(lock_path)
+        return completed
+
+
+def _archive_locked_thread(subreddit, submission_id):
+    journal_path = subreddit.path(submission_id + "_journal.log")
+    if os.path.exists(journal_path):
+        journal = TradeJournal(journal_path)
+        open_intents = bool(journal.open_intents)
+        journal.close()
+        if open_intents:
+            return None
+
+    logged = {}
+    for suffix in LOG_SUFFIXES:
+        try:
+            with open(subreddit.path(submission_id + suffix), "r", encoding="utf-8") as log_file:
+                logged[suffix] = log_file.read().splitlines()
+        except FileNotFoundError:
+            logged[suffix] = []
+    archived = read_archive(subreddit, submission_id) or {"completed": [], "pending": []}
+    completed = set(archived["completed"]).union(logged["_completed.log"])
+    pending = dict.fromkeys(comment_id for comment_id in archived["pending"] + logged["_pending.log"]
+                            if comment_id not in completed)
+
+    path = archive_path(subreddit, submission_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as archive_file:
+        json.dump({"submission": submission_id, "archived_utc": int(time.time()),
+                   "completed": sorted(completed), "pending": list(pending)}, archive_file, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+    for suffix in LOG_SUFFIXES:
+        if os.path.exists(subreddit.path(submission_id + suffix)):
+            os.remove(subreddit.path(submission_id + suffix))
+    return len(completed)
+
+
+def logged_threads(subreddit):
+    """ Submission ids of all trade threads with completed or pending logs """
+    threads = set()
+    for suffix in LOG_SUFFIXES:
+        for path in glob.glob(subreddit.path("*" + suffix)):
+            threads.add(os.path.basename(path)[:-len(suffix)])
+    return threads
+
+
+def archive_closed_threads(subreddit, logger):
+    """ Archive the logs of every thread except the current and previous (grace period) trade threads """
+    keep = {subreddit.config["trade"].get("link_id"), subreddit.config["trade"].get("prevlink_id")}
+    for submission_id in sorted(logged_threads(subreddit) - keep):
+        completed = archive_thread(subreddit, submission_id)
+        if completed is None:
+            logger.warning("Not archiving {}, it is open in flair.py or its journal has unfinished flair changes"
+                           .format(submission_id))
+        else:
+            logger.info("Archived {} with {} completed trades".format(submission_id, completed))
+
+
+def prewarm_profiles(subreddit, submission_id, logger):
+    """ Fetch the profiles of the most active traders of submission_id into the profile cache """
+    top = int(_rotation_config(subreddit, "prewarm_top", 200))
+    con = user_db.connect(subreddit.path(subreddit.config["trade"]["user_db"]))
+    try:
+        if user_db.current_version(con) < max(TRADE_GRAPH_VERSION, PROFILE_CACHE_VERSION):
+            logger.warning("Profile prewarm skipped until user db is migrated")
+            return 0
+        max_age = float(subreddit.config["trade"].get("profile_cache_hours", 6)) * 3600
+        cache = ProfileCache(con, max_age)
+        cache.prune(time.time() - 30 * 86400)
+        with subreddit.priority(BULK):
+            return cache.prewarm(subreddit, TradeGraph(con).top_traders(submission_id, top))
+    finally:
+        con.close()
+
+
+def rotate_trade_thread(subreddit, post_id, logger):
+    """ Make post_id the current trade thread, the current one is kept as previous thread for its grace period """
+    trade_config = subreddit.config["trade"]
+    closed_id = trade_config["link_id"]
+    if "prevlink_id" in trade_config:
+        trade_config["prevlink_id"] = closed_id
+    trade_config["link_id"] = post_id
+    subreddit.save_config()
+
+    # Processes reload the config and refetch the mods on their own, the profile cache is shared in user.db
+    logger.info("Notified {} running processes".format(notify_processes(subreddit, logger)))
+    # Threads still open in a process switching over are locked and left to the next rotation
+    archive_closed_threads(subreddit, logger)
+    logger.info("Prewarmed {} trader profiles".format(prewarm_profiles(subreddit, closed_id, logger)))
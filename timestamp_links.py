@@ -0,0 +1,158 @@
+"""
+Verification of timestamp links in trade posts: candidate links are normalized, checked concurrently in a
+background thread and remembered in user.db, so reused albums cost no request and reuse by others is found
+"""
+
+import asyncio
+import http.client
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+# Schema version of user.db adding the timestamp_link table
+SCHEMA_VERSION = 9
+
+OK = "ok"
+MISSING = "missing"
+UNREACHABLE = "unreachable"
+
+# Markdown and punctuation the timestamp regex picks up after a link
+TRAILING = ").,;:!?]*>'\""
+IMGUR_HOSTS = ("imgur.com", "i.imgur.com")
+
+
+def normalize_url(url):
+    """
+    Canonical form of a link: lower case host without www./m., no query or fragment, imgur galleries as
+    albums and direct imgur images as their image page
+    """
+    parts = urlsplit(url.strip().rstrip(TRAILING))
+    host = (parts.hostname or "").lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    scheme = parts.scheme.lower()
+    path = parts.path.rstrip("/")
+    if host in IMGUR_HOSTS:
+        segments = path.strip("/").split("/")
+        if len(segments) > 1 and segments[0] in ("a", "gallery"):
+            # New gallery links carry a title slug in front of the id
+            path = "/a/" + segments[1].rsplit("-", 1)[-1]
+        elif host == "i.imgur.com":
+            path = "/" + segments[0].split(".", 1)[0]
+        host = "imgur.com"
+        scheme = "https"
+    netloc = host if parts.port is None else "{}:{}".format(host, parts.port)
+    return urlunsplit((scheme, netloc, path, "", ""))
+
+
+def extract_links(pattern, text, hosts=None):
+    """ Normalized http(s) links matched by pattern in text, in order, only on hosts (e.g. imgur.com) if given """
+    links = {}
+    for match in pattern.finditer(text):
+        url = normalize_url(match.group(0))
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            continue
+        if hosts and not any(parts.hostname == host or parts.hostname.endswith("." + host) for host in hosts):
+            continue
+        links[url] = None
+    return list(links)
+
+
+class LinkChecker:
+    """
+    Checks links on an asyncio event loop in a daemon thread: at most concurrency requests at a time,
+    each with a timeout, one request for a link checked by several posts at once. Requests use urllib
+    in a thread pool, callers get a concurrent.futures.Future and never wait for the network.
+    """
+
+    def __init__(self, concurrency=8, timeout=10, user_agent="redditswapbot"):
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._headers = {"User-Agent": user_agent}
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="timestamp_check")
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._inflight = {}
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="timestamp_check", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        self._ready.set()
+        self._loop.run_forever()
+
+    def _fetch(self, url):
+        request = urllib.request.Request(url, headers=self._headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self._timeout) as response:
+                # Deleted imgur images redirect to a placeholder
+                return MISSING if response.geturl().endswith("/removed.png") else OK
+        except urllib.error.HTTPError as error:
+            return MISSING if error.code in (404, 410) else UNREACHABLE
+        except (urllib.error.URLError, http.client.HTTPException, OSError, ValueError):
+            # HTTPException covers malformed responses (bad status line, incomplete body)
+            return UNREACHABLE
+
+    async def _check_url(self, url):
+        async with self._semaphore:
+            try:
+                # The socket timeout applies per read, the whole request gets twice as long
+                return await asyncio.wait_for(self._loop.run_in_executor(self._executor, self._fetch, url),
+                                              self._timeout * 2)
+            except asyncio.TimeoutError:
+                return UNREACHABLE
+
+    def _shared_check(self, url):
+        if url not in self._inflight:
+            task = self._loop.create_task(self._check_url(url))
+            task.add_done_callback(lambda _task: self._inflight.pop(url, None))
+            self._inflight[url] = task
+        return self._inflight[url]
+
+    async def _check(self, urls):
+        statuses = await asyncio.gather(*(self._shared_check(url) for url in urls))
+        return dict(zip(urls, statuses))
+
+    def check(self, urls):
+        """ Future of {url: OK, MISSING or UNREACHABLE} """
+        return asyncio.run_coroutine_threadsafe(self._check(list(urls)), self._loop)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=False)
+
+
+class TimestampLinks:
+    """ First use (author, post) and last check result of every timestamp link in user.db """
+
+    def __init__(self, db_con, cache_seconds=86400):
+        self._con = db_con
+        self._cache_seconds = cache_seconds
+
+    def record(self, url, author, post_id, created_utc):
+        """ Remember the first use of url, returns the row of its first use (this one if new) """
+        with self._con:
+            self._con.execute("INSERT OR IGNORE INTO timestamp_link (url, author, post_id, first_seen_utc) "
+                              "VALUES (?, ?, ?, ?)", (url, author, post_id, int(created_utc)))
+        return self._con.execute("SELECT * FROM timestamp_link WHERE url=?", (url,)).fetchone()
+
+    def cached_status(self, url):
+        """ Status of the last check of url, None if it was not checked within cache_seconds """
+        row = self._con.execute("SELECT status FROM timestamp_link WHERE url=? AND checked_utc >= ?",
+                                (url, int(time.time() - self._cache_seconds))).fetchone()
+        return row[0] if row is not None else None
+
+    def store_status(self, url, status):
+        with self._con:
+            self._con.execute("UPDATE timestamp_link SET status=?, checked_utc=? WHERE url=?",
+                              (status, int(time.time()), url))
@@ -0,0 +1,138 @@
+""" Confirmed trades as edges between users in user.db, with queries and a trading ring detector """
+
+import collections
+
+# Schema version of user.db adding the trade table
+SCHEMA_VERSION = 5
+
+
+class _DisjointSet:
+    """ Union-find with path halving and union by size """
+
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+
+    def find(self, item):
+        if item not in self._parent:
+            self._parent[item] = item
+            self._size[item] = 1
+        while self._parent[item] != item:
+            self._parent[item] = self._parent[self._parent[item]]
+            item = self._parent[item]
+        return item
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return
+        if self._size[first] < self._size[second]:
+            first, second = second, first
+        self._parent[second] = first
+        self._size[first] += self._size[second]
+
+
+class TradeGraph:
+    """ Every confirmed trade is one row (comment id, thread, both users, confirmation time) """
+
+    def __init__(self, db_con):
+        self._con = db_con
+
+    def add(self, comment_id, reply_id, submission_id, user_a, user_b, created_utc):
+        """ Record a confirmed trade, returns False if the comment was already recorded """
+        with self._con:
+            cursor = self._con.execute("INSERT OR IGNORE INTO trade (comment_id, reply_id, submission_id, user_a, "
+                                       "user_b, created_utc) VALUES (?, ?, ?, ?, ?, ?)",
+                                       (comment_id, reply_id, submission_id, user_a, user_b, int(created_utc)))
+        return cursor.rowcount == 1
+
+    def add_many(self, trades):
+        """ Record (comment_id, reply_id, submission_id, user_a, user_b, created_utc) tuples """
+        with self._con:
+            self._con.executemany("INSERT OR IGNORE INTO trade (comment_id, reply_id, submission_id, user_a, "
+                                  "user_b, created_utc) VALUES (?, ?, ?, ?, ?, ?)", trades)
+
+    def remove(self, comment_id):
+        with self._con:
+            self._con.execute("DELETE FROM trade WHERE comment_id=?", (comment_id,))
+
+    def trades_between(self, first, second):
+        """ Trades of two users with each other, oldest first """
+        return self._con.execute("SELECT * FROM trade WHERE (user_a=? AND user_b=?) OR (user_a=? AND user_b=?) "
+                                 "ORDER BY created_utc", (first, second, second, first)).fetchall()
+
+    def has_traded(self, first, second):
+        return self._con.execute("SELECT 1 FROM trade WHERE (user_a=? AND user_b=?) OR (user_a=? AND user_b=?) "
+                                 "LIMIT 1", (first, second, second, first)).fetchone() is not None
+
+    def trade_count(self, user):
+        return self._con.execute("SELECT (SELECT COUNT(*) FROM trade WHERE user_a=?) + "
+                                 "(SELECT COUNT(*) FROM trade WHERE user_b=?)", (user, user)).fetchone()[0]
+
+    def partners(self, user):
+        """ Counter of user's trade partners (lower case) """
+        rows = self._con.execute("SELECT user_b FROM trade WHERE user_a=? UNION ALL "
+                                 "SELECT user_a FROM trade WHERE user_b=?", (user, user))
+        return collections.Counter(row[0].lower() for row in rows)
+
+    def top_partner_share(self, user, top=3):
+        """ Trades with user's top partners and user's total trades, e.g. (9, 10) is suspicious """
+        partners = self.partners(user)
+        return sum(count for _, count in partners.most_common(top)), sum(partners.values())
+
+    def top_traders(self, submission_id, limit=100):
+        """ Users with the most confirmed trades in the thread submission_id, most trades first """
+        rows = self._con.execute("SELECT user, COUNT(*) AS trades FROM (SELECT user_a AS user FROM trade "
+                                 "WHERE submission_id=? UNION ALL SELECT user_b FROM trade WHERE submission_id=?) "
+                                 "GROUP BY user COLLATE NOCASE ORDER BY trades DESC LIMIT ?",
+                                 (submission_id, submission_id, limit))
+        return [row[0] for row in rows]
+
+    def edges(self, since_utc=0):
+        """ (user_a, user_b) of every trade since since_utc, lower case """
+        for row in self._con.execute("SELECT user_a, user_b FROM trade WHERE created_utc >= ?", (int(since_utc),)):
+            yield row[0].lower(), row[1].lower()
+
+    def find_rings(self, since_utc=0, min_pair_trades=2, min_size=3, max_size=20, min_internal_share=0.8):
+        """
+        Groups of users that mostly trade with each other again and again (flair farming).
+        Users are joined when they traded at least min_pair_trades times with each other, a group
+        is reported when every member made at least min_internal_share of their trades inside it.
+        One pass over the edges plus union-find, so near-linear in the number of trades.
+        Returns [(members, internal_trades, total_trades)], largest internal count first.
+        """
+        pair_counts = collections.Counter()
+        totals = collections.Counter()
+        for user_a, user_b in self.edges(since_utc):
+            if user_a == user_b:
+                continue
+            pair_counts[(user_a, user_b) if user_a < user_b else (user_b, user_a)] += 1
+            totals[user_a] += 1
+            totals[user_b] += 1
+
+        groups = _DisjointSet()
+        for (user_a, user_b), count in pair_counts.items():
+            if count >= min_pair_trades:
+                groups.union(user_a, user_b)
+
+        members = collections.defaultdict(list)
+        for user in totals:
+            members[groups.find(user)].append(user)
+        internal = collections.Counter()
+        internal_by_user = collections.Counter()
+        for (user_a, user_b), count in pair_counts.items():
+            root = groups.find(user_a)
+            if root == groups.find(user_b):
+                internal[root] += count
+                internal_by_user[user_a] += count
+                internal_by_user[user_b] += count
+
+        rings = []
+        for root, users in members.items():
+            if not min_size <= len(users) <= max_size:
+                continue
+            if all(internal_by_user[user] >= min_internal_share * totals[user] for user in users):
+                # Internal trades are counted for both members, external ones for one
+                rings.append((sorted(users), internal[root], sum(totals[user] for user in users) - internal[root]))
+        rings.sort(key=lambda ring: ring[1], reverse=True)
+        return rings
@@ -0,0 +1,83 @@
+""" Write-ahead journal of trade flair changes, so an interrupted flair run resumes without double counting """
+
+import json
+import os
+
+
+class TradeJournal:
+    """
+    Per confirmation thread journal of json lines. An intent with the absolute target flairs is
+    synced to disk before the first flair change, every finished step is logged after it and a
+    commit once the comment is in the completed log. Open intents found on open are resumed
+    by applying only their unfinished steps, which are idempotent (flair is set, not incremented).
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self.open_intents = {}
+        if os.path.exists(path):
+            self._replay()
+        self._file = open(path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+
+    def _replay(self):
+        complete = 0
+        with open(self._path, "rb") as journal_file:
+            for line in journal_file:
+                if not line.endswith(b"\n"):
+                    # Torn last line of a crash, the step it describes is redone
+                    break
+                complete += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                comment_id = record["comment"]
+                if record["op"] == "intent":
+                    record["flaired"] = []
+                    record["replied"] = False
+                    self.open_intents[comment_id] = record
+                elif comment_id not in self.open_intents:
+                    continue
+                elif record["op"] == "flaired":
+                    self.open_intents[comment_id]["flaired"].append(record["user"])
+                elif record["op"] == "replied":
+                    self.open_intents[comment_id]["replied"] = True
+                elif record["op"] == "commit":
+                    del self.open_intents[comment_id]
+        # Drop the torn line, records appended after it would otherwise continue it
+        if complete < os.path.getsize(self._path):
+            os.truncate(self._path, complete)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def intent(self, comment_id, flairs, trade=None, reply=None):
+        """
+        Log planned changes before making them: flairs [(user, text, css_class, trade_count)],
+        trade the TradeGraph row and reply the id of the comment to answer (None for no reply)
+        """
+        record = {"op": "intent", "comment": comment_id, "flairs": [list(flair) for flair in flairs],
+                  "trade": list(trade) if trade else None, "reply": reply}
+        self._write(record)
+        self.open_intents[comment_id] = dict(record, flaired=[], replied=False)
+
+    def flaired(self, comment_id, user):
+        self._write({"op": "flaired", "comment": comment_id, "user": user})
+        self.open_intents[comment_id]["flaired"].append(user)
+
+    def replied(self, comment_id):
+        self._write({"op": "replied", "comment": comment_id})
+        self.open_intents[comment_id]["replied"] = True
+
+    def commit(self, comment_id):
+        if comment_id in self.open_intents:
+            self._write({"op": "commit", "comment": comment_id})
+            del self.open_intents[comment_id]
+
+    def close(self):
+        """ Close, removing the journal if nothing is left open """
+        self._file.close()
+        if not self.open_intents:
+            os.remove(self._path)
@@ -0,0 +1,220 @@
+""" user.db connection helper and versioned, online schema migrations """
+
+import sqlite3
+import time
+
+# Registered migrations as (version, description, function), applied in version order
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """ Register function(con, batch_size, pause) as migration to schema version """
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return func
+    return register
+
+
+def connect(path, timeout=30):
+    """
+    Connect to user.db, WAL journaling lets the bot keep reading (and writing between
+    batches) while a migration is running
+    """
+    con = sqlite3.connect(path, timeout=timeout)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL")
+    _ensure_version_tables(con)
+    return con
+
+
+def _ensure_version_tables(con):
+    with con:
+        con.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+version INTEGER PRIMARY KEY NOT NULL,
+description TEXT,
+applied_utc INTEGER
+)''')
+        con.execute('''CREATE TABLE IF NOT EXISTS migration_progress (
+version INTEGER PRIMARY KEY NOT NULL,
+last_rowid INTEGER NOT NULL
+)''')
+
+
+def current_version(con):
+    return con.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def pending_migrations(con):
+    version = current_version(con)
+    return [entry for entry in MIGRATIONS if entry[0] > version]
+
+
+def table_columns(con, table):
+    return {row[1] for row in con.execute("PRAGMA table_info({})".format(table))}
+
+
+def add_column(con, table, column, definition):
+    """ Add column unless it exists (ALTER TABLE ADD COLUMN does not rewrite the table) """
+    if column not in table_columns(con, table):
+        with con:
+            con.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, definition))
+
+
+def batched_update(con, version, table, sql, batch_size, pause):
+    """
+    Run sql, which must restrict itself to "rowid > :lo AND rowid <= :hi", over table in
+    rowid batches of batch_size, each in its own short transaction. Progress is stored
+    so an interrupted migration resumes at the last committed batch.
+    """
+    row = con.execute("SELECT last_rowid FROM migration_progress WHERE version=?", (version,)).fetchone()
+    low = row[0] if row else 0
+    high_water = con.execute("SELECT COALESCE(MAX(rowid), 0) FROM {}".format(table)).fetchone()[0]
+    while low < high_water:
+        high = low + batch_size
+        with con:
+            con.execute(sql, {"lo": low, "hi": high})
+            con.execute("INSERT OR REPLACE INTO migration_progress (version, last_rowid) VALUES (?, ?)",
+                        (version, high))
+        low = high
+        if pause:
+            # Leave the write lock to the bot between batches
+            time.sleep(pause)
+
+
+def migrate(con, batch_size=1000, pause=0.0, logger=None):
+    """ Apply all pending migrations, returns the new schema version """
+    for version, description, func in pending_migrations(con):
+        if logger:
+            logger.info("Migrating user db to version {}: {}".format(version, description))
+        start = time.monotonic()
+        func(con, batch_size, pause)
+        with con:
+            con.execute("INSERT INTO schema_version (version, description, applied_utc) VALUES (?, ?, ?)",
+                        (version, description, int(time.time())))
+            con.execute("DELETE FROM migration_progress WHERE version=?", (version,))
+        if logger:
+            logger.info("Migrated to version {} in {:.1f}s".format(version, time.monotonic() - start))
+    return current_version(con)
+
+
+@migration(1, "create user table")
+def _create_user_table(con, _batch_size, _pause):
+    with con:
+        con.execute('''CREATE TABLE IF NOT EXISTS user (
+username TEXT PRIMARY KEY NOT NULL ,
+flair_text TEXT,
+flair_css_class TEXT,
+personal_last_created INTEGER DEFAULT 0,
+personal_last_id TEXT DEFAULT '',
+nonpersonal_last_created INTEGER DEFAULT 0,
+nonpersonal_last_id TEXT DEFAULT ''
+)''')
+
+
+@migration(2, "move legacy last_created/last_id into personal group columns")
+def _split_legacy_last_post(con, batch_size, pause):
+    if "last_created" not in table_columns(con, "user"):
+        return
+    add_column(con, "user", "personal_last_created", "INTEGER DEFAULT 0")
+    add_column(con, "user", "personal_last_id", "TEXT DEFAULT ''")
+    add_column(con, "user", "nonpersonal_last_created", "INTEGER DEFAULT 0")
+    add_column(con, "user", "nonpersonal_last_id", "TEXT DEFAULT ''")
+    # Legacy rows stored a "YYYY-MM-DD HH:MM:SS" timestamp, new rows store created_utc
+    batched_update(con, 2, "user", '''UPDATE user SET
+personal_last_created = COALESCE(CAST(strftime('%s', last_created) AS INTEGER), 0),
+personal_last_id = COALESCE(last_id, '')
+WHERE rowid > :lo AND rowid <= :hi''', batch_size, pause)
+
+
+@migration(3, "add commercial group columns")
+def _add_commercial_group(con, _batch_size, _pause):
+    add_column(con, "user", "commercial_last_created", "INTEGER DEFAULT 0")
+    add_column(con, "user", "commercial_last_id", "TEXT DEFAULT ''")
+
+
+@migration(4, "add submission signature tables for the repost index")
+def _add_repost_index(con, _batch_size, _pause):
+    with con:
+        con.execute('''CREATE TABLE IF NOT EXISTS submission_signature (
+post_id TEXT PRIMARY KEY NOT NULL,
+author TEXT,
+created_utc INTEGER,
+signature BLOB
+)''')
+        con.execute("CREATE INDEX IF NOT EXISTS submission_signature_created ON submission_signature (created_utc)")
+        con.execute('''CREATE TABLE IF NOT EXISTS submission_band (
+band INTEGER NOT NULL,
+bucket INTEGER NOT NULL,
+post_id TEXT NOT NULL
+)''')
+        con.execute("CREATE INDEX IF NOT EXISTS submission_band_bucket ON submission_band (band, bucket)")
+        con.execute("CREATE INDEX IF NOT EXISTS submission_band_post ON submission_band (post_id)")
+
+
+@migration(5, "add confirmed trade graph table")
+def _add_trade_graph(con, _batch_size, _pause):
+    with con:
+        con.execute('''CREATE TABLE IF NOT EXISTS trade (
+comment_id TEXT PRIMARY KEY NOT NULL,
+reply_id TEXT,
+submission_id TEXT,
+user_a TEXT NOT NULL COLLATE NOCASE,
+user_b TEXT NOT NULL COLLATE NOCASE,
+created_utc INTEGER
+)''')
+        con.execute("CREATE INDEX IF NOT EXISTS trade_user_a ON trade (user_a, user_b)")
+        con.execute("CREATE INDEX IF NOT EXISTS trade_user_b ON trade (user_b, user_a)")
+
+
+@migration(6, "add local snapshot of subreddit flair")
+def _add_flair_snapshot(con, _batch_size, _pause):
+    with con:
+        con.execute('''CREATE TABLE IF NOT EXISTS flair_snapshot (
+username TEXT PRIMARY KEY NOT NULL COLLATE NOCASE,
+flair_text TEXT,
+flair_css_class TEXT,
+seen_utc INTEGER
+)''')
+        con.execute("CREATE INDEX IF NOT EXISTS flair_snapshot_seen ON flair_snapshot (seen_utc)")
+        con.execute('''CREATE TABLE IF NOT EXISTS flair_sync (
+name TEXT PRIMARY KEY NOT NULL,
+value TEXT
+)''')
+
+
+@migration(7, "add redditor profile cache")
+def _add_profile_cache(con, _batch_size, _pause):
+    with con:
+        con.execute('''CREATE TABLE IF NOT EXISTS redditor_profile (
+username TEXT PRIMARY KEY NOT NULL COLLATE NOCASE,
+created_utc INTEGER,
+karma INTEGER,
+suspended INTEGER NOT NULL DEFAULT 0,
+fetched_utc INTEGER NOT NULL
+)''')
+
+
+@migration(8, "add recheck schedule of pending trade confirmations")
+def _add_pending_recheck(con, _batch_size, _pause):
+    with con:
+        con.execute('''CREATE TABLE IF NOT EXISTS pending_recheck (
+comment_id TEXT PRIMARY KEY NOT NULL,
+submission_id TEXT NOT NULL,
+due_utc INTEGER NOT NULL,
+reason TEXT,
+attempts INTEGER NOT NULL DEFAULT 1
+)''')
+
+
+@migration(9, "add timestamp link registry")
+def _add_timestamp_links(con, _batch_size, _pause):
+    with con:
+        con.execute('''CREATE TABLE IF NOT EXISTS timestamp_link (
+url TEXT PRIMARY KEY NOT NULL,
+author TEXT COLLATE NOCASE,
+post_id TEXT,
+first_seen_utc INTEGER,
+status TEXT,
+checked_utc INTEGER
+)''')
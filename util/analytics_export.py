@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+""" Export new moderation events and confirmed trades into the analytics partitions, run from cron """
+
+import sys
+import os
+import argparse
+from configparser import ConfigParser
+
+containing_dir = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+sys.path.insert(0, containing_dir)
+
+from analytics import Exporter  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def read_config(path):
+    config = ConfigParser(interpolation=None)
+    config.read(path)
+    return config
+
+
+def trade_dbs(config_path):
+    """ (subreddit, user.db path) of the subreddit of config_path and its [multi] subreddits """
+    config = read_config(config_path)
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+    config_paths = [config_path]
+    if "multi" in config:
+        config_paths += [os.path.join(base_dir, sub_dir.strip(), "config.cfg")
+                         for sub_dir in config["multi"].get("subreddits", "").split(",") if sub_dir.strip()]
+    dbs = []
+    for path in config_paths:
+        sub_config = read_config(path)
+        db_path = os.path.join(os.path.dirname(os.path.abspath(path)), sub_config["trade"]["user_db"])
+        if os.path.exists(db_path):
+            dbs.append((sub_config["subreddit"]["uri"].lower(), db_path))
+    return dbs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export moderation events into columnar day partitions")
+    parser.add_argument("-c", "--config", dest="config", default=os.path.join(containing_dir, "config.cfg"),
+                        help="config file of the (first) subreddit")
+    parser.add_argument("-s", "--spool", dest="spool", help="event spool directory (default [analytics] spool_dir)")
+    parser.add_argument("-o", "--out", dest="out", help="export directory (default [analytics] export_dir)")
+    parser.add_argument("--no-trades", dest="trades", action="store_false",
+                        help="do not export confirmed trades of the user.db files")
+    args = parser.parse_args()
+
+    config = read_config(args.config)
+    analytics = config["analytics"] if "analytics" in config else {}
+    base_dir = os.path.dirname(os.path.abspath(args.config))
+    spool_dir = args.spool or analytics.get("spool_dir")
+    export_dir = args.out or analytics.get("export_dir", "analytics")
+    exporter = Exporter(os.path.join(base_dir, export_dir))
+    rows = exporter.export(os.path.join(base_dir, spool_dir) if spool_dir else None,
+                           trade_dbs(args.config) if args.trades else (),
+                           int(analytics.get("keep_spool_days", 7)))
+    print("Exported {} events".format(rows))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+""" Event counts and latency percentiles from the analytics partitions written by analytics_export.py """
+
+import sys
+import os
+import json
+import time
+import calendar
+import argparse
+
+containing_dir = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+sys.path.insert(0, containing_dir)
+
+from analytics import GROUPS, query  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def parse_day(day):
+    return calendar.timegm(time.strptime(day, "%Y-%m-%d"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query exported moderation events")
+    parser.add_argument("-d", "--dir", dest="dir", default=os.path.join(containing_dir, "analytics"),
+                        help="export directory")
+    parser.add_argument("--days", type=int, default=30, help="only events of the last DAYS days")
+    parser.add_argument("--since", help="first day (YYYY-MM-DD, UTC), overrides --days")
+    parser.add_argument("--until", help="last day (YYYY-MM-DD, UTC)")
+    parser.add_argument("-b", "--by", choices=GROUPS, help="group by")
+    parser.add_argument("-k", "--kind", help="event kind (post, flair, remove, comment, report, user_flair, "
+                                             "trade_pending, trade)")
+    parser.add_argument("-s", "--subreddit", help="subreddit (lower case)")
+    parser.add_argument("-r", "--reason", help="removal/report reason or flair category")
+    parser.add_argument("-a", "--author", help="author")
+    parser.add_argument("-n", "--limit", type=int, default=50, help="number of groups shown")
+    parser.add_argument("--json", action="store_true", help="print json")
+    args = parser.parse_args()
+
+    since = parse_day(args.since) if args.since else time.time() - args.days * 86400
+    until = parse_day(args.until) + 86400 if args.until else None
+    filters = {name: getattr(args, name) for name in ("kind", "subreddit", "reason", "author")
+               if getattr(args, name) is not None}
+    result = query(args.dir, since, until, args.by, **filters)[:args.limit]
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for entry in result:
+        print("{:<30} {:>8} p50 {:>10} p95 {:>10}".format(
+            str(entry["key"]) if args.by else "total", entry["count"],
+            "-" if entry["latency_p50"] is None else "{:.1f}s".format(entry["latency_p50"]),
+            "-" if entry["latency_p95"] is None else "{:.1f}s".format(entry["latency_p95"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+""" Streaming readers for flair dumps (json from modutils or csv) """
+
+import csv
+import json
+from itertools import islice
+
+CHUNK_SIZE = 1 << 16
+
+
+def iter_json(path, chunk_size=CHUNK_SIZE):
+    """
+    Incrementally yield objects from a json array (or concatenated/line separated objects)
+    without loading the whole file
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    with open(path, "r", encoding="utf-8") as json_file:
+        while True:
+            # Skip array syntax and whitespace between objects
+            while pos < len(buf) and buf[pos] in "[], \t\r\n":
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    return
+                buf = json_file.read(chunk_size)
+                pos = 0
+                eof = not buf
+                continue
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Object continues in the next chunk
+                data = json_file.read(chunk_size)
+                eof = not data
+                buf = buf[pos:] + data
+                pos = 0
+                continue
+            pos = end
+            yield obj
+
+
+def iter_csv(path):
+    """ Yield flair entries from username,flair_css_class,flair_text lines """
+    with open(path, "r", encoding="utf-8", newline="") as csv_file:
+        for row in csv.reader(csv_file):
+            if not row:
+                continue
+            username, flair_css, flair_text = (row + ["", ""])[:3]
+            yield {"user": username, "flair_css_class": flair_css, "flair_text": flair_text}
+
+
+def write_csv(path, entries):
+    """ Write {'user', 'flair_text', 'flair_css_class'} entries in the format iter_csv reads (no header) """
+    with open(path, "w", encoding="utf-8", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        for entry in entries:
+            writer.writerow([entry["user"], entry.get("flair_css_class") or "", entry.get("flair_text") or ""])
+
+
+def iter_flair(path, filetype):
+    """ Yield normalized {'user', 'flair_text', 'flair_css_class'} entries from path """
+    entries = iter_json(path) if filetype == "json" else iter_csv(path)
+    for entry in entries:
+        yield {"user": entry["user"],
+               "flair_text": entry.get("flair_text") or "",
+               "flair_css_class": entry.get("flair_css_class") or ""}
+
+
+def chunked(iterable, size):
+    """ Yield lists of at most size items """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+""" Sync the local flair snapshot in user.db and report flair deviating from user.db trade counts """
+
+import sys
+import os
+import csv
+import time
+import contextlib
+import argparse
+from configparser import SafeConfigParser
+
+import praw
+
+containing_dir = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+sys.path.insert(0, containing_dir)
+
+import user_db  # noqa: E402 pylint: disable=wrong-import-position
+from flair_snapshot import FlairSnapshot, SCHEMA_VERSION  # noqa: E402 pylint: disable=wrong-import-position
+from request_scheduler import SCHEDULER, BULK, setup_scheduler  # noqa: E402 pylint: disable=wrong-import-position
+
+cfg_file = SafeConfigParser()
+path_to_cfg = os.path.join(containing_dir, 'config.cfg')
+cfg_file.read(path_to_cfg)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync subreddit flair into user.db and reconcile it")
+    parser.add_argument("-d", "--db", dest="db", default=None, help="user database (default from config)")
+    parser.add_argument("--full", dest="full", action="store_true", help="sweep the whole flair list now")
+    parser.add_argument("--full-days", dest="full_days", type=float, default=7,
+                        help="sweep the whole flair list if the last full sweep is older than this")
+    parser.add_argument("--no-sync", dest="sync", action="store_false", help="only report from the snapshot")
+    parser.add_argument("--report", dest="report", default=None, metavar="CSV",
+                        help="write users whose flair deviates from user.db by more than flair_dev ('-' prints)")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(containing_dir, cfg_file["trade"]["user_db"])
+    con = user_db.connect(db_path)
+    if user_db.current_version(con) < SCHEMA_VERSION:
+        sys.exit("User db is not migrated, run util/user_db_convert.py")
+    snapshot = FlairSnapshot(con)
+
+    if args.sync:
+        setup_scheduler(cfg_file)
+        reddit = SCHEDULER.install(praw.Reddit(**cfg_file["login"]))
+        subreddit = reddit.subreddit(cfg_file["subreddit"]["uri"])
+        last_full = float(snapshot.checkpoint("full_sweep_utc", 0))
+        with SCHEDULER.priority(BULK, "flair_snapshot"):
+            if (args.full or snapshot.checkpoint("full_sweep_start") or
+                    time.time() - last_full > args.full_days * 86400):
+                print("Full flair sweep")
+                stored = snapshot.full_sweep(subreddit, lambda count: print("\r{} users".format(count), end=""))
+                print("\rStored flair of {} users".format(stored))
+            else:
+                print("Refetched flair of {} recently changed users".format(snapshot.recent_sweep(subreddit)))
+
+    if args.report:
+        report = snapshot.reconcile(int(cfg_file["trade"].get("flair_dev", 2)))
+        with (open(args.report, "w", encoding="utf-8", newline="") if args.report != "-"
+              else contextlib.nullcontext(sys.stdout)) as report_file:
+            writer = csv.writer(report_file)
+            writer.writerow(["user", "subreddit_trades", "user_db_trades", "reason"])
+            writer.writerows(report)
+        if args.report != "-":
+            print("{} deviating users written to {}".format(len(report), args.report))
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,74 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
+""" Stream a subreddit flair dump into the user table of user.db """
 
-import sys, os
-import json
+import sys
+import os
+import time
 import argparse
 import sqlite3 as lite
 
-con = None
+from flair_io import iter_flair, chunked
+
+containing_dir = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+sys.path.insert(0, containing_dir)
+
+import user_db  # noqa: E402 pylint: disable=wrong-import-position
+
+UPSERT = ('INSERT INTO user (username, flair_text, flair_css_class) '
+          'VALUES (:user, :flair_text, :flair_css_class) '
+          'ON CONFLICT(username) DO UPDATE SET '
+          'flair_text=excluded.flair_text, flair_css_class=excluded.flair_css_class')
+
 
 def extant_file(x):
     if not os.path.exists(x):
-        raise argparse.ArgumentError("{0} does not exist".format(x))
+        raise argparse.ArgumentTypeError("{0} does not exist".format(x))
     return x
 
+
+def import_flair(con, entries, chunk_size=5000, progress=None):
+    """ Upsert entries in chunk_size transactions, returns number of rows """
+    total = 0
+    start = time.monotonic()
+    for chunk in chunked(entries, chunk_size):
+        with con:
+            con.executemany(UPSERT, chunk)
+        total += len(chunk)
+        if progress:
+            elapsed = time.monotonic() - start
+            progress(total, total / elapsed if elapsed else 0.0)
+    return total
+
+
 def main():
     parser = argparse.ArgumentParser(description="Import flairs")
-    parser.add_argument("-f", "--file", dest="filename", help="json input file", metavar="FILE", type=extant_file, required=True)
+    parser.add_argument("-f", "--file", dest="filename", help="input file", metavar="FILE",
+                        type=extant_file, required=True)
+    parser.add_argument("-t", "--type", dest="filetype", help="json or csv", metavar="TYPE",
+                        choices=['json', 'csv'], default="json")
+    parser.add_argument("-d", "--db", dest="db", help="user database", default="user.db")
+    parser.add_argument("-c", "--chunk-size", dest="chunk_size", type=int, default=5000,
+                        help="rows per transaction")
     args = parser.parse_args()
 
     try:
-        con = lite.connect('user.db')
+        con = user_db.connect(args.db)
+        user_db.migrate(con)
     except lite.Error as e:
         print("Error %s:" % e.args[0])
         sys.exit(1)
 
-    curs = con.cursor()
+    def progress(rows, rate):
+        print("\r{rows} rows ({rate:.0f} rows/s)".format(rows=rows, rate=rate), end="", flush=True)
 
-    curs.execute('''CREATE TABLE IF NOT EXISTS user (
-username TEXT PRIMARY KEY NOT NULL ,
-flair_text TEXT,
-flair_css_class TEXT,
-last_created timestamp,
-last_id TEXT DEFAULT ''
-)''')
-
-    flair_json = json.load(open(args.filename))
-
-    curs.executemany('INSERT INTO flair (username, flair_text, flair_css_class) VALUES (:user, :flair_text, :flair_css_class)', flair_json)
-
-    con.commit()
-
-    if con:
+    start = time.monotonic()
+    try:
+        total = import_flair(con, iter_flair(args.filename, args.filetype), args.chunk_size, progress)
+    finally:
         con.close()
+    elapsed = time.monotonic() - start
+    print("\nImported {total} rows in {elapsed:.1f}s".format(total=total, elapsed=elapsed))
+
 
 if __name__ == "__main__":
     main()
@@ -1,67 +1,172 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
+""" Push flair from a json or csv dump to the subreddit in resumable batches """
 
-import sys, os
+import sys
+import os
 import json
+import time
 import argparse
-import praw
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from configparser import SafeConfigParser
 
+import praw
+
 containing_dir = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+sys.path.insert(0, containing_dir)
+
+from request_scheduler import SCHEDULER, BULK, setup_scheduler  # noqa: E402 pylint: disable=wrong-import-position
+from flair_io import iter_flair, chunked  # noqa: E402 pylint: disable=wrong-import-position
+
 cfg_file = SafeConfigParser()
 path_to_cfg = os.path.join(containing_dir, 'config.cfg')
 cfg_file.read(path_to_cfg)
-username = cfg_file.get('reddit', 'username')
-password = cfg_file.get('reddit', 'password')
-app_key = cfg_file.get('reddit', 'app_key')
-app_secret = cfg_file.get('reddit', 'app_secret')
-subreddit = cfg_file.get('reddit', 'subreddit')
+setup_scheduler(cfg_file)
+
+# flair.update sends at most 100 users per request
+BATCH_SIZE = 100
+
 
 def extant_file(x):
     if not os.path.exists(x):
-        raise argparse.ArgumentError("{0} does not exist".format(x))
+        raise argparse.ArgumentTypeError("{0} does not exist".format(x))
     return x
 
+
+class Checkpoint:
+    """ Acknowledged batch numbers, persisted after every batch """
+
+    def __init__(self, path):
+        self.path = path
+        self.done_through = -1
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as checkpoint_file:
+                state = json.load(checkpoint_file)
+            self.done_through = state["done_through"]
+            self.done = set(state["done"])
+
+    def is_done(self, batch_no):
+        return batch_no <= self.done_through or batch_no in self.done
+
+    def ack(self, batch_no):
+        with self._lock:
+            self.done.add(batch_no)
+            while self.done_through + 1 in self.done:
+                self.done_through += 1
+                self.done.remove(self.done_through)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as checkpoint_file:
+                json.dump({"done_through": self.done_through, "done": sorted(self.done)}, checkpoint_file)
+            os.replace(tmp_path, self.path)
+
+
+class FlairPusher:
+    """
+    Send flair batches concurrently, one praw instance per worker thread, all sharing the
+    request scheduler at bulk priority
+    """
+
+    def __init__(self, current_flair=None):
+        self._local = threading.local()
+        self._current = current_flair or {}
+        # Counters are updated by the worker threads
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.skipped = 0
+        self.failed = []
+
+    def _subreddit(self):
+        if not hasattr(self._local, "subreddit"):
+            reddit = SCHEDULER.install(praw.Reddit(**cfg_file["login"]))
+            self._local.subreddit = reddit.subreddit(cfg_file["subreddit"]["uri"])
+        return self._local.subreddit
+
+    def filter_unchanged(self, batch):
+        """ Drop entries whose subreddit flair already matches """
+        changed = [entry for entry in batch
+                   if self._current.get(entry["user"].lower()) != (entry["flair_text"], entry["flair_css_class"])]
+        with self._lock:
+            self.skipped += len(batch) - len(changed)
+        return changed
+
+    def push(self, batch):
+        """ Send a batch, returns the results of users whose flair was not set """
+        if not batch:
+            return []
+        with SCHEDULER.priority(BULK, "flair_import"):
+            results = self._subreddit().flair.update(batch)
+        failed = [result for result in results if not result.get("ok", True)]
+        with self._lock:
+            self.sent += len(batch)
+            self.failed += failed
+        return failed
+
+
+def load_current_flair(reddit):
+    """ Current subreddit flair as {username.lower(): (text, css_class)} """
+    current = {}
+    with SCHEDULER.priority(BULK, "flair_import"):
+        for flair in reddit.subreddit(cfg_file["subreddit"]["uri"]).flair(limit=None):
+            current[flair["user"].name.lower()] = (flair["flair_text"] or "", flair["flair_css_class"] or "")
+    return current
+
+
 def main():
     parser = argparse.ArgumentParser(description="Import flairs to subreddit")
-    parser.add_argument("-f", "--file", dest="filename", help="input file", metavar="FILE", type=extant_file, required=True)
-    parser.add_argument("-t", "--type", dest="filetype", help="json or csv", metavar="TYPE", type=str, choices=['json', 'csv'], required=True)
+    parser.add_argument("-f", "--file", dest="filename", help="input file", metavar="FILE",
+                        type=extant_file, required=True)
+    parser.add_argument("-t", "--type", dest="filetype", help="json or csv", metavar="TYPE",
+                        type=str, choices=['json', 'csv'], required=True)
+    parser.add_argument("-c", "--checkpoint", dest="checkpoint", default=None,
+                        help="checkpoint file (default: FILE.checkpoint)")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=4,
+                        help="concurrent flair requests")
+    parser.add_argument("--diff", dest="diff", action="store_true",
+                        help="skip users whose subreddit flair is already correct")
     args = parser.parse_args()
 
-    r = praw.Reddit(client_id=app_key,
-                    client_secret=app_secret,
-                    username=username,
-                    password=password,
-                    user_agent=username)
-
-    if args.filetype == "json":
-        r.subreddit(subreddit).flair.update(load_json(args.filename))
-    elif args.filetype == "csv":
-        r.subreddit(subreddit).flair.update(load_csv(args.filename))
-
-def load_json(file):
-    flair_json = json.load(open(file))
-    for entry in flair_json:
-        if entry['flair_css_class'] is None:
-            entry['flair_css_class'] = ""
-        print("Setting username: \'" + entry['user'] + "\' to flair_css_class: \'" + entry['flair_css_class'] + "\' and flair_text to: \'" + str(entry['flair_text']) + "\'")
-
-    return flair_json
-
-def load_csv(file):
-    flair_dict = []
-    print("start")
-    with open(file) as flair:
-        for line in flair:
-            username, flair_css, flair_text = line.rstrip().split(',')
-            print("Setting username: \'" + username + "\' to flair_css_class: \'" + flair_css + "\' and flair_text to: \'" + flair_text + "\'")
-            i = {
-                'user': username,
-                'flair_css_class': flair_css,
-                'flair_text': flair_text,
-            }
-            flair_dict.append(i)
-
-    return flair_dict
+    checkpoint = Checkpoint(args.checkpoint or args.filename + ".checkpoint")
+    current = None
+    if args.diff:
+        print("Fetching current subreddit flair")
+        current = load_current_flair(SCHEDULER.install(praw.Reddit(**cfg_file["login"])))
+        print("Fetched flair of {} users".format(len(current)))
+    pusher = FlairPusher(current)
+
+    def send(batch_no, batch):
+        # Batches with failed users stay unacknowledged and are sent again by the next run
+        if not pusher.push(pusher.filter_unchanged(batch)):
+            checkpoint.ack(batch_no)
+        return batch_no
+
+    start = time.monotonic()
+    in_flight = set()
+    batches = enumerate(chunked(iter_flair(args.filename, args.filetype), BATCH_SIZE))
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for batch_no, batch in batches:
+            if checkpoint.is_done(batch_no):
+                continue
+            # Bound queued batches so memory stays flat regardless of input size
+            if len(in_flight) >= 2 * args.workers:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+            in_flight.add(executor.submit(send, batch_no, batch))
+            print("\rSent {sent}, skipped {skipped}, failed {failed} ({rate:.0f} users/s)".format(
+                sent=pusher.sent, skipped=pusher.skipped, failed=len(pusher.failed),
+                rate=pusher.sent / max(time.monotonic() - start, 1e-9)), end="", flush=True)
+        for future in in_flight:
+            future.result()
+
+    print("\nDone: sent {sent}, skipped {skipped}, failed {failed}".format(
+        sent=pusher.sent, skipped=pusher.skipped, failed=len(pusher.failed)))
+    for result in pusher.failed:
+        print("Failed: {}".format(result))
+    if pusher.failed:
+        print("Rerun the same command to retry the batches with failed users")
+
 
 if __name__ == "__main__":
     main()
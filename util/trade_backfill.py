@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+""" Read-only backfill of trade counts and trade graph edges from past confirmation threads """
+
+import sys
+import os
+import json
+import time
+import argparse
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from configparser import SafeConfigParser
+
+import praw
+
+containing_dir = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+sys.path.insert(0, containing_dir)
+
+from records import CommentRecord  # noqa: E402 pylint: disable=wrong-import-position
+from confirmations import confirmed_trades  # noqa: E402 pylint: disable=wrong-import-position
+from request_scheduler import SCHEDULER, BULK, setup_scheduler  # noqa: E402 pylint: disable=wrong-import-position
+from flair_io import write_csv  # noqa: E402 pylint: disable=wrong-import-position
+
+cfg_file = SafeConfigParser()
+path_to_cfg = os.path.join(containing_dir, 'config.cfg')
+cfg_file.read(path_to_cfg)
+setup_scheduler(cfg_file)
+
+
+class ThreadFetcher:
+    """ Fetch and parse confirmation threads, one praw instance per worker thread, nothing is posted """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _reddit(self):
+        if not hasattr(self._local, "reddit"):
+            self._local.reddit = SCHEDULER.install(praw.Reddit(**cfg_file["login"]))
+        return self._local.reddit
+
+    def trades(self, submission_id):
+        """ Confirmed trades of a thread as TradeGraph rows """
+        with SCHEDULER.priority(BULK, "backfill"):
+            submission = self._reddit().submission(id=submission_id)
+            submission.comments.replace_more(limit=None, threshold=0)
+        # Records of the top level comments and their replies, the comment forest is dropped here
+        comments = [CommentRecord.from_praw(comment, reply_depth=1) for comment in submission.comments]
+        return list(confirmed_trades(submission_id, comments))
+
+
+def read_thread_ids(args):
+    thread_ids = list(args.threads)
+    if args.file:
+        with open(args.file, "r", encoding="utf-8") as ids_file:
+            thread_ids += [line.strip() for line in ids_file if line.strip()]
+    # Keep order, drop duplicates
+    return list(dict.fromkeys(thread_ids))
+
+
+def trade_counts(trades):
+    """ {user.lower(): confirmed trades} """
+    counts = collections.Counter()
+    for _comment_id, _reply_id, _submission_id, user_a, user_b, _created_utc in trades:
+        counts[user_a.lower()] += 1
+        counts[user_b.lower()] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild trade counts from past confirmation threads "
+                                                 "without replying, reporting or flairing")
+    parser.add_argument("threads", nargs="*", help="confirmation thread ids")
+    parser.add_argument("-f", "--file", dest="file", default=None, help="file with one thread id per line")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=4, help="threads fetched concurrently")
+    parser.add_argument("-o", "--output", dest="output", default="backfill.json",
+                        help="result file with per-thread trades and per-user counts")
+    parser.add_argument("--csv", dest="csv", default=None,
+                        help="also write counts as flair csv (username,flair_css_class,flair_text) for "
+                             "comparing with a flair dump, flair_text is left empty so do not import it")
+    parser.add_argument("--graph", dest="graph", default=None, metavar="USER_DB",
+                        help="also add the trades to the trade graph of this user db")
+    args = parser.parse_args()
+
+    thread_ids = read_thread_ids(args)
+    if not thread_ids:
+        parser.error("no thread ids given")
+
+    fetcher = ThreadFetcher()
+    trades_by_thread = {}
+    failed = {}
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(fetcher.trades, thread_id): thread_id for thread_id in thread_ids}
+        for future in as_completed(futures):
+            thread_id = futures[future]
+            try:
+                trades_by_thread[thread_id] = future.result()
+            except Exception as exception:
+                failed[thread_id] = str(exception)
+            print("\rFetched {done}/{total} threads ({failed} failed, {elapsed:.0f}s)".format(
+                done=len(trades_by_thread) + len(failed), total=len(thread_ids), failed=len(failed),
+                elapsed=time.monotonic() - start), end="", flush=True)
+    print()
+
+    # Thread order of the input, not completion order, so reruns give identical files
+    trades = [trade for thread_id in thread_ids for trade in trades_by_thread.get(thread_id, [])]
+    counts = trade_counts(trades)
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump({"threads": {thread_id: trades_by_thread[thread_id]
+                               for thread_id in thread_ids if thread_id in trades_by_thread},
+                   "failed": failed,
+                   "counts": dict(sorted(counts.items()))}, output_file, indent=1)
+
+    if args.csv:
+        write_csv(args.csv, ({"user": user, "flair_css_class": "i-{}".format(count), "flair_text": ""}
+                             for user, count in sorted(counts.items())))
+
+    if args.graph:
+        import user_db  # pylint: disable=import-outside-toplevel
+        from trade_graph import TradeGraph  # pylint: disable=import-outside-toplevel
+        con = user_db.connect(args.graph)
+        TradeGraph(con).add_many(trades)
+        con.close()
+
+    print("{trades} trades of {users} users in {threads} threads written to {output}".format(
+        trades=len(trades), users=len(counts), threads=len(trades_by_thread), output=args.output))
+    for thread_id, error in failed.items():
+        print("Failed: {} ({})".format(thread_id, error))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+""" Query the confirmed trade graph in user.db and look for trading rings """
+
+import sys
+import os
+import time
+import argparse
+
+containing_dir = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+sys.path.insert(0, containing_dir)
+
+import user_db  # noqa: E402 pylint: disable=wrong-import-position
+from trade_graph import TradeGraph  # noqa: E402 pylint: disable=wrong-import-position
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query confirmed trades")
+    parser.add_argument("-d", "--db", dest="db", default="user.db", help="user database")
+    subparsers = parser.add_subparsers(dest="command")
+    pair_parser = subparsers.add_parser("pair", help="trades between two users")
+    pair_parser.add_argument("users", nargs=2)
+    user_parser = subparsers.add_parser("user", help="trade partners of a user")
+    user_parser.add_argument("user")
+    user_parser.add_argument("-t", "--top", type=int, default=3, help="number of top partners shown")
+    rings_parser = subparsers.add_parser("rings", help="groups of users mostly trading with each other")
+    rings_parser.add_argument("--days", type=int, default=365, help="only trades of the last DAYS days")
+    rings_parser.add_argument("--min-pair", type=int, default=2, help="trades linking two users")
+    rings_parser.add_argument("--min-size", type=int, default=3, help="smallest group reported")
+    rings_parser.add_argument("--share", type=float, default=0.8,
+                              help="minimum share of each member's trades inside the group")
+    args = parser.parse_args()
+
+    con = user_db.connect(args.db)
+    graph = TradeGraph(con)
+    if args.command == "pair":
+        for trade in graph.trades_between(*args.users):
+            print("{} {} https://redd.it/{} ({} <-> {})".format(
+                time.strftime("%Y-%m-%d", time.gmtime(trade["created_utc"])), trade["comment_id"],
+                trade["submission_id"], trade["user_a"], trade["user_b"]))
+    elif args.command == "user":
+        partners = graph.partners(args.user)
+        top, total = graph.top_partner_share(args.user, args.top)
+        print("{} trades with {} partners, {} with the top {}".format(total, len(partners), top, args.top))
+        for partner, count in partners.most_common(args.top):
+            print("  {}: {}".format(partner, count))
+    elif args.command == "rings":
+        for members, internal, total in graph.find_rings(time.time() - args.days * 86400, args.min_pair,
+                                                         args.min_size, min_internal_share=args.share):
+            print("{} internal of {} trades: {}".format(internal, total, ", ".join(members)))
+    else:
+        parser.print_help()
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
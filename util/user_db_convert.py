@@ -1,60 +1,39 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
+""" Apply pending user.db schema migrations, safe to run while the bot is running """
 
-import sys, os
-import json
+import sys
+import os
 import argparse
-import sqlite3 as lite
+import logging
 
-con = None
+containing_dir = os.path.dirname(os.path.abspath(os.path.dirname(sys.argv[0])))
+sys.path.insert(0, containing_dir)
+
+import user_db  # noqa: E402 pylint: disable=wrong-import-position
 
-def extant_file(x):
-    if not os.path.exists(x):
-        raise argparse.ArgumentError("{0} does not exist".format(x))
-    return x
 
 def main():
-    # parser = argparse.ArgumentParser(description="Import flairs")
-    # parser.add_argument("-f", "--file", dest="filename", help="json input file", metavar="FILE", type=extant_file, required=True)
-    # args = parser.parse_args()
-
-    try:
-        old_con = lite.connect('old_user.db', detect_types=lite.PARSE_DECLTYPES | lite.PARSE_COLNAMES)
-        old_con.row_factory = lite.Row
-        new_con = lite.connect('new_user.db')
-    except lite.Error as e:
-        print("Error %s:" % e.args[0])
-        sys.exit(1)
-
-    old_curs = old_con.cursor()
-    new_curs = new_con.cursor()
-
-    new_curs.execute('''CREATE TABLE IF NOT EXISTS user (
-username TEXT PRIMARY KEY NOT NULL ,
-flair_text TEXT,
-flair_css_class TEXT,
-personal_last_created INTEGER DEFAULT 0,
-personal_last_id TEXT DEFAULT '',
-nonpersonal_last_created INTEGER DEFAULT 0,
-nonpersonal_last_id TEXT DEFAULT ''
-)''')
-
-    old_curs.execute('SELECT username, last_id, last_created as "last_created [timestamp]" FROM user')
-    results = old_curs.fetchall()
-
-    import pdb
-    new_lines = []
-    # pdb.set_trace()
-    for line in results:
-        new_lines.append((line[0], line[1], int(line[2].strftime("%s"))+2*60*60))
-
-    # pdb.set_trace()
-
-    new_curs.executemany('INSERT INTO user (username, personal_last_id, personal_last_created) VALUES (:user, :personal_last_id, :personal_last_created)', new_lines)
-
-    new_con.commit()
-
-    if new_con:
-        new_con.close()
+    parser = argparse.ArgumentParser(description="Migrate user.db to the latest schema version")
+    parser.add_argument("-d", "--db", dest="db", default="user.db", help="user database")
+    parser.add_argument("-b", "--batch-size", dest="batch_size", type=int, default=1000,
+                        help="rows updated per transaction")
+    parser.add_argument("-p", "--pause", dest="pause", type=float, default=0.01,
+                        help="seconds to sleep between batches")
+    parser.add_argument("-s", "--status", dest="status", action="store_true",
+                        help="only print current version and pending migrations")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    logger = logging.getLogger("user_db_convert")
+
+    con = user_db.connect(args.db)
+    print("Current schema version: {}".format(user_db.current_version(con)))
+    for version, description, _func in user_db.pending_migrations(con):
+        print("Pending: {} - {}".format(version, description))
+    if not args.status:
+        user_db.migrate(con, args.batch_size, args.pause, logger)
+    con.close()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,145 @@
+""" Durable sqlite backed queue of submissions for post_check workers """
+
+import os
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# Oldest claimable submission (pending, or leased by a crashed worker whose lease expired and
+# attempts are left) of an author without a live lease or an older claimable submission
+_CLAIM_SQL = '''SELECT post_id, subreddit, author, attempts FROM post_queue AS q
+WHERE (q.state='pending' OR (q.state='leased' AND q.lease_expires < :now AND q.attempts < :max_attempts))
+AND NOT EXISTS (
+    SELECT 1 FROM post_queue AS o
+    WHERE o.author = q.author AND o.post_id != q.post_id AND (
+        (o.state='leased' AND o.lease_expires >= :now) OR
+        ((o.state='pending' OR (o.state='leased' AND o.lease_expires < :now)) AND
+         (o.created_utc < q.created_utc OR (o.created_utc = q.created_utc AND o.post_id < q.post_id)))))
+ORDER BY created_utc, post_id LIMIT 1'''
+
+
+class WorkQueue:
+    """
+    Submissions are claimed with a lease by one worker at a time, in creation order per author,
+    and an author's next submission is not handed out while an earlier one is still leased so
+    cooldown checks see every earlier submission of that author.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3):
+        # Leases are renewed from a heartbeat thread (see keep_leased)
+        self._con = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._con.row_factory = sqlite3.Row
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self.owner = "{}:{}".format(os.uname().nodename, os.getpid())
+        self._con.execute('''CREATE TABLE IF NOT EXISTS post_queue (
+post_id TEXT PRIMARY KEY NOT NULL,
+subreddit TEXT NOT NULL,
+author TEXT NOT NULL,
+created_utc INTEGER NOT NULL,
+state TEXT NOT NULL DEFAULT 'pending',
+lease_owner TEXT,
+lease_expires INTEGER DEFAULT 0,
+attempts INTEGER DEFAULT 0,
+last_error TEXT
+)''')
+        self._con.execute("CREATE INDEX IF NOT EXISTS post_queue_state ON post_queue (state, created_utc)")
+        self._con.execute("CREATE INDEX IF NOT EXISTS post_queue_author ON post_queue (author, state)")
+
+    def close(self):
+        self._con.close()
+
+    def enqueue(self, post_id, subreddit, author, created_utc, state=PENDING):
+        """ Add a submission, returns False if it was already queued (or handled) """
+        cursor = self._con.execute("INSERT OR IGNORE INTO post_queue (post_id, subreddit, author, created_utc, state) "
+                                   "VALUES (?, ?, ?, ?, ?)", (post_id, subreddit, author, int(created_utc), state))
+        return cursor.rowcount == 1
+
+    def is_known(self, post_id):
+        return self._con.execute("SELECT 1 FROM post_queue WHERE post_id=?", (post_id,)).fetchone() is not None
+
+    def claim(self):
+        """ Lease the next claimable submission, returns a row (post_id, subreddit, author, attempts) or None """
+        now = int(time.time())
+        self._con.execute("BEGIN IMMEDIATE")
+        try:
+            # Submissions that killed or hung their worker max_attempts times are given up
+            self._con.execute("UPDATE post_queue SET state='failed', lease_owner=NULL, "
+                              "last_error=COALESCE(last_error, 'lease expired') "
+                              "WHERE state='leased' AND lease_expires < ? AND attempts >= ?",
+                              (now, self._max_attempts))
+            row = self._con.execute(_CLAIM_SQL, {"now": now, "max_attempts": self._max_attempts}).fetchone()
+            if row is not None:
+                row = dict(row, attempts=row["attempts"] + 1)
+                self._con.execute("UPDATE post_queue SET state='leased', lease_owner=?, lease_expires=?, "
+                                  "attempts=attempts+1 WHERE post_id=?",
+                                  (self.owner, now + self._lease_seconds, row["post_id"]))
+            self._con.execute("COMMIT")
+        except Exception:
+            self._con.execute("ROLLBACK")
+            raise
+        return row
+
+    def renew(self, post_id):
+        """ Extend the lease of a submission this worker holds, returns False if it lost the lease """
+        cursor = self._con.execute("UPDATE post_queue SET lease_expires=? WHERE post_id=? AND lease_owner=? "
+                                   "AND state='leased'",
+                                   (int(time.time()) + self._lease_seconds, post_id, self.owner))
+        return cursor.rowcount == 1
+
+    def keep_leased(self, post_id):
+        """
+        Context manager renewing the lease of post_id in the background while it is checked, for at
+        most max_attempts lease periods so a hung worker still loses the submission
+        """
+        return _LeaseKeeper(self, post_id, self._lease_seconds, self._lease_seconds * self._max_attempts)
+
+    def complete(self, post_id):
+        self._con.execute("UPDATE post_queue SET state='done', lease_owner=NULL WHERE post_id=? AND lease_owner=?",
+                          (post_id, self.owner))
+
+    def fail(self, post_id, error):
+        """ Release a submission after an error, it is retried until max_attempts """
+        self._con.execute("UPDATE post_queue SET state=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                          "lease_owner=NULL, last_error=? WHERE post_id=? AND lease_owner=?",
+                          (self._max_attempts, str(error), post_id, self.owner))
+
+    def depth(self):
+        """ Number of submissions waiting for (or being processed by) a worker """
+        return self._con.execute("SELECT COUNT(*) FROM post_queue WHERE state IN ('pending', 'leased')").fetchone()[0]
+
+    def prune(self, before_utc):
+        """ Forget handled submissions created before before_utc """
+        self._con.execute("DELETE FROM post_queue WHERE state IN ('done', 'failed') AND created_utc < ?",
+                          (int(before_utc),))
+
+
+class _LeaseKeeper:
+    """ Renews a lease every third of the lease period until exit or max_seconds """
+
+    def __init__(self, queue, post_id, lease_seconds, max_seconds):
+        self._queue = queue
+        self._post_id = post_id
+        self._interval = max(1, lease_seconds // 3)
+        self._deadline = time.monotonic() + max_seconds - lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease_keeper", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self._interval) and time.monotonic() < self._deadline:
+            if not self._queue.renew(self._post_id):
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()